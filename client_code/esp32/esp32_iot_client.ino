@@ -40,6 +40,13 @@ unsigned long lastDataSend = 0;
 const unsigned long heartbeatInterval = 30000;  // 30秒
 const unsigned long dataSendInterval = 10000;   // 10秒
 bool serverConnected = false;
+String configETag = "";  // 上次获取的配置ETag，配置未变化时服务器返回304
+unsigned long lastConfigCheck = 0;
+const unsigned long configCheckInterval = 60000;  // 60秒（控制命令通过长轮询送达，配置只需低频检查）
+
+// 控制命令长轮询（服务器有命令时立即返回，否则最多挂起commandPollWait秒）
+const int commandPollWait = 30;
+String pendingAcks = "";  // 已执行、待在下一次轮询时确认的命令ID（逗号分隔）
 
 void setup() {
   Serial.begin(115200);
@@ -65,6 +72,9 @@ void setup() {
   // 注册设备
   registerDevice();
   
+  // 控制命令在单独任务中长轮询，不阻塞传感器数据上传
+  xTaskCreatePinnedToCore(commandTask, "commands", 8192, NULL, 1, NULL, 0);
+  
   Serial.println("ESP32 IoT Client started");
   digitalWrite(LED_PIN, HIGH);  // 启动指示灯
 }
@@ -90,8 +100,11 @@ void loop() {
     lastDataSend = currentTime;
   }
   
-  // 检查服务器命令
-  checkServerCommands();
+  // 检查配置更新（控制命令由命令任务处理）
+  if (currentTime - lastConfigCheck >= configCheckInterval) {
+    checkServerCommands();
+    lastConfigCheck = currentTime;
+  }
   
   delay(1000);
 }
@@ -289,17 +302,21 @@ float readUltrasonicDistance() {
 }
 
 void checkServerCommands() {
-  // 这里可以实现轮询服务器命令的逻辑
-  // 或者使用WebSocket进行实时通信
-  
+  // 检查服务器端的配置更新
   if (WiFi.status() != WL_CONNECTED || !serverConnected) return;
   
   HTTPClient http;
   http.begin(String(serverURL) + "/api/esp32/config/" + deviceID);
+  if (configETag.length() > 0) {
+    http.addHeader("If-None-Match", configETag);
+  }
+  const char* headerKeys[] = {"ETag"};
+  http.collectHeaders(headerKeys, 1);
   
   int httpResponseCode = http.GET();
   
   if (httpResponseCode == 200) {
+    configETag = http.header("ETag");
     String response = http.getString();
     
     DynamicJsonDocument doc(1024);
@@ -329,6 +346,68 @@ void checkServerCommands() {
   http.end();
 }
 
+bool requestCommands(int wait, const String& acks, DynamicJsonDocument& doc) {
+  // 长轮询命令队列，同时确认acks中的命令
+  HTTPClient http;
+  String url = String(serverURL) + "/api/esp32/commands/" + deviceID + "?wait=" + String(wait);
+  if (acks.length() > 0) {
+    url += "&ack=" + acks;
+  }
+  http.begin(url);
+  http.setTimeout((wait + 10) * 1000);
+  
+  int httpResponseCode = http.GET();
+  bool ok = false;
+  if (httpResponseCode == 200) {
+    ok = !deserializeJson(doc, http.getString()) && doc["success"];
+  }
+  http.end();
+  return ok;
+}
+
+void commandTask(void* arg) {
+  // 命令任务：长轮询命令队列并依次执行，执行结果在下一次轮询时批量确认
+  for (;;) {
+    if (WiFi.status() != WL_CONNECTED || !serverConnected) {
+      delay(5000);
+      continue;
+    }
+    
+    DynamicJsonDocument doc(4096);
+    if (!requestCommands(commandPollWait, pendingAcks, doc)) {
+      delay(5000);
+      continue;
+    }
+    pendingAcks = "";
+    if (doc.containsKey("retry_after")) {
+      // 服务器挂起的长轮询已满，稍后再轮询
+      delay((int)doc["retry_after"] * 1000);
+    }
+    
+    for (JsonObject command : doc["commands"].as<JsonArray>()) {
+      String id = String((long)command["id"]);
+      String action = command["action"].as<String>();
+      
+      // 执行后会重启或断网的命令先确认，避免重启后重复执行
+      // 确认成功后才执行；确认失败时保留待确认的ID，该命令和之后的命令在下一次轮询时重新下发
+      if (action == "restart" || action == "deep_sleep" || action == "wifi_reconnect") {
+        DynamicJsonDocument ackDoc(1024);
+        if (!requestCommands(0, pendingAcks.length() > 0 ? pendingAcks + "," + id : id, ackDoc)) {
+          delay(5000);
+          break;
+        }
+        pendingAcks = "";
+      } else {
+        if (pendingAcks.length() > 0) {
+          pendingAcks += ",";
+        }
+        pendingAcks += id;
+      }
+      executeControlCommand(action, command["parameters"]);
+    }
+  }
+}
+
 void executeControlCommand(String action, JsonObject parameters) {
   if (action == "gpio_write") {
     int pin = parameters["pin"];
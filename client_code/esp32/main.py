@@ -4,11 +4,13 @@
 import network
 import urequests
 import ujson
+import ustruct
 import time
 import machine
 from machine import Pin, ADC, PWM, I2C
 import dht
 import gc
+import _thread
 
 # 配置信息
 WIFI_SSID = "YourWiFiName"
@@ -26,16 +28,47 @@ ECHO_PIN = 19
 LED_PIN = 2
 RELAY_PIN = 23
 
+# 紧凑二进制上传格式（与服务器 src/utils/sensor_frame.py 保持一致）
+USE_COMPACT_UPLOAD = True
+SENSOR_FRAME_CONTENT_TYPE = "application/x-sensor-frame"
+SENSOR_FRAME_VERSION = 1
+SENSOR_CODES = {
+    "temperature": 0x01,
+    "humidity": 0x02,
+    "pressure": 0x03,
+    "light": 0x04,
+    "uv_index": 0x05,
+    "air_quality": 0x06,
+    "motion": 0x07,
+    "distance": 0x08,
+}
+SYSTEM_STATUS_CODES = {
+    "free_heap": 0x10,
+    "wifi_rssi": 0x11,
+}
+ANALOG_PIN_BASE = 0x40
+DIGITAL_PIN_BASE = 0x80
+
+# 控制命令长轮询（服务器有命令时立即返回，否则最多挂起COMMAND_POLL_WAIT秒）
+COMMAND_POLL_WAIT = 30
+# 执行后设备会重启或断网的命令，先确认再执行，避免重启后重复执行
+ACK_BEFORE_EXECUTE = ("restart", "deep_sleep", "wifi_reconnect")
+
 class ESP32IoTClient:
     def __init__(self):
         self.device_id = DEVICE_ID
         self.device_name = DEVICE_NAME
         self.wifi_connected = False
         self.server_connected = False
+        self.compact_upload = False
+        self.config_etag = None  # 上次获取的配置ETag，配置未变化时服务器返回304
         self.last_heartbeat = 0
         self.last_data_send = 0
+        self.last_config_check = 0
         self.heartbeat_interval = 30000  # 30秒
         self.data_send_interval = 10000  # 10秒
+        self.config_check_interval = 60000  # 60秒（控制命令通过长轮询送达，配置只需低频检查）
+        self.pending_acks = []  # 已执行、待在下一次轮询时确认的命令ID
         
         # 初始化硬件
         self.setup_hardware()
@@ -133,6 +166,8 @@ class ESP32IoTClient:
             
             if response and response.get("success"):
                 self.server_connected = True
+                # 服务器支持时使用紧凑二进制格式上传数据
+                self.compact_upload = USE_COMPACT_UPLOAD and SENSOR_FRAME_CONTENT_TYPE in response.get("upload_formats", [])
                 print("Device registered successfully")
                 return True
             else:
@@ -143,15 +178,15 @@ class ESP32IoTClient:
             print(f"Registration error: {e}")
             return False
     
-    def send_http_request(self, method, endpoint, data=None):
-        """发送HTTP请求"""
+    def send_http_request(self, method, endpoint, data=None, content_type="application/json"):
+        """发送HTTP请求，content_type非JSON时data为已编码的请求体"""
         try:
             url = SERVER_URL + endpoint
-            headers = {"Content-Type": "application/json"}
+            headers = {"Content-Type": content_type}
             
             if method == "POST" and data:
-                json_data = ujson.dumps(data)
-                response = urequests.post(url, data=json_data, headers=headers)
+                body = ujson.dumps(data) if content_type == "application/json" else data
+                response = urequests.post(url, data=body, headers=headers)
             elif method == "GET":
                 response = urequests.get(url, headers=headers)
             else:
@@ -260,6 +295,26 @@ class ESP32IoTClient:
             print(f"Ultrasonic reading error: {e}")
             return -1
     
+    def encode_sensor_frame(self, sensor_data):
+        """将传感器数据编码为紧凑二进制帧：版本、device_id、(传感器编码, float32)记录"""
+        device_id = self.device_id.encode()
+        frame = bytearray(ustruct.pack("<BB", SENSOR_FRAME_VERSION, len(device_id)))
+        frame.extend(device_id)
+        
+        for name, code in SENSOR_CODES.items():
+            if name in sensor_data:
+                frame.extend(ustruct.pack("<Bf", code, float(sensor_data[name])))
+        
+        for name, code in SYSTEM_STATUS_CODES.items():
+            if name in sensor_data.get("system_status", {}):
+                frame.extend(ustruct.pack("<Bf", code, float(sensor_data["system_status"][name])))
+        
+        for key, base in (("analog_inputs", ANALOG_PIN_BASE), ("digital_inputs", DIGITAL_PIN_BASE)):
+            for pin, value in sensor_data.get(key, {}).items():
+                frame.extend(ustruct.pack("<Bf", base | (int(pin) & 0x3F), float(value)))
+        
+        return bytes(frame)
+    
     def send_sensor_data(self):
         """发送传感器数据到服务器"""
         if not self.server_connected:
@@ -269,7 +324,11 @@ class ESP32IoTClient:
             sensor_data = self.read_sensors()
             sensor_data["device_id"] = self.device_id
             
-            response = self.send_http_request("POST", "/api/esp32/data", sensor_data)
+            if self.compact_upload:
+                frame = self.encode_sensor_frame(sensor_data)
+                response = self.send_http_request("POST", "/api/esp32/data", frame, SENSOR_FRAME_CONTENT_TYPE)
+            else:
+                response = self.send_http_request("POST", "/api/esp32/data", sensor_data)
             
             if response and response.get("success"):
                 print("Sensor data sent successfully")
@@ -315,13 +374,31 @@ class ESP32IoTClient:
             print(f"Heartbeat error: {e}")
             return False
     
+    def fetch_config(self):
+        """带If-None-Match获取设备配置，配置未变化（304）时返回None"""
+        headers = {}
+        if self.config_etag:
+            headers["If-None-Match"] = self.config_etag
+        
+        response = urequests.get(SERVER_URL + f"/api/esp32/config/{self.device_id}", headers=headers)
+        try:
+            if response.status_code == 304:
+                return None
+            if response.status_code != 200:
+                print(f"HTTP GET failed: {response.status_code}")
+                return None
+            self.config_etag = response.headers.get("ETag")
+            return response.json()
+        finally:
+            response.close()
+    
     def check_server_commands(self):
-        """检查服务器命令"""
+        """检查服务器端的配置更新"""
         if not self.server_connected:
             return
         
         try:
-            response = self.send_http_request("GET", f"/api/esp32/config/{self.device_id}")
+            response = self.fetch_config()
             
             if response and response.get("success"):
                 config = response.get("config", {})
@@ -343,6 +420,55 @@ class ESP32IoTClient:
         except Exception as e:
             print(f"Command checking error: {e}")
     
+    def poll_commands(self):
+        """长轮询服务器命令队列，同时批量确认上一批已执行的命令，返回命令列表"""
+        endpoint = f"/api/esp32/commands/{self.device_id}?wait={COMMAND_POLL_WAIT}"
+        if self.pending_acks:
+            endpoint += "&ack=" + ",".join(str(command_id) for command_id in self.pending_acks)
+        
+        response = self.send_http_request("GET", endpoint)
+        if not response or not response.get("success"):
+            return []
+        # 请求成功说明服务器已确认这批命令
+        self.pending_acks = []
+        if "retry_after" in response:
+            # 服务器挂起的长轮询已满，稍后再轮询
+            time.sleep(response["retry_after"])
+        return response.get("commands", [])
+    
+    def ack_commands(self, command_ids):
+        """立即确认命令（不等待新命令）"""
+        ids = ",".join(str(command_id) for command_id in command_ids)
+        response = self.send_http_request("GET", f"/api/esp32/commands/{self.device_id}?wait=0&ack={ids}")
+        return bool(response and response.get("success"))
+    
+    def command_loop(self):
+        """命令线程：长轮询命令队列并依次执行，执行结果在下一次轮询时确认"""
+        while True:
+            try:
+                if not self.server_connected:
+                    time.sleep(5)
+                    continue
+                
+                for command in self.poll_commands():
+                    command_id = command["id"]
+                    action = command["action"]
+                    if action in ACK_BEFORE_EXECUTE:
+                        # 确认成功后才执行；确认失败时保留待确认的ID，该命令和之后的命令在下一次轮询时重新下发
+                        if not self.ack_commands(self.pending_acks + [command_id]):
+                            time.sleep(5)
+                            break
+                        self.pending_acks = []
+                    else:
+                        self.pending_acks.append(command_id)
+                    self.execute_control_command(action, command.get("parameters", {}))
+                
+                gc.collect()
+                
+            except Exception as e:
+                print(f"Command polling error: {e}")
+                time.sleep(5)
+    
     def execute_control_command(self, action, parameters):
         """执行控制命令"""
         try:
@@ -394,6 +520,9 @@ class ESP32IoTClient:
         """主运行循环"""
         print("Starting ESP32 IoT Client...")
         
+        # 控制命令在单独线程中长轮询，不阻塞传感器数据上传
+        _thread.start_new_thread(self.command_loop, ())
+        
         while True:
             try:
                 current_time = time.ticks_ms()
@@ -417,8 +546,10 @@ class ESP32IoTClient:
                     self.send_sensor_data()
                     self.last_data_send = current_time
                 
-                # 检查服务器命令
-                self.check_server_commands()
+                # 检查配置更新（控制命令由命令线程处理）
+                if time.ticks_diff(current_time, self.last_config_check) >= self.config_check_interval:
+                    self.check_server_commands()
+                    self.last_config_check = current_time
                 
                 # 垃圾回收
                 gc.collect()
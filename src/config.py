@@ -31,6 +31,86 @@ class Config:
     # API配置
     API_RATE_LIMIT = "100 per minute"
     
+    # 传感器数据存储模式：rows 每个读数一行；frames 每次上传合并为一帧
+    SENSOR_STORAGE_MODE = (os.environ.get('SENSOR_STORAGE_MODE') or 'rows').lower()
+    
+    # 传感器数据写缓冲（组提交）配置
+    INGEST_BUFFER_ENABLED = (os.environ.get('INGEST_BUFFER_ENABLED') or 'false').lower() == 'true'
+    INGEST_BUFFER_MAX_BATCH = int(os.environ.get('INGEST_BUFFER_MAX_BATCH') or 1000)
+    INGEST_BUFFER_MAX_DELAY_MS = int(os.environ.get('INGEST_BUFFER_MAX_DELAY_MS') or 200)
+    INGEST_BUFFER_MAX_QUEUE = int(os.environ.get('INGEST_BUFFER_MAX_QUEUE') or 10000)
+    # 刷新失败时的重试次数和首次退避时间（毫秒，每次翻倍）；逐条写入仍失败的记录追加到死信文件（NDJSON）
+    INGEST_BUFFER_RETRIES = int(os.environ.get('INGEST_BUFFER_RETRIES') or 3)
+    INGEST_BUFFER_RETRY_BACKOFF_MS = int(os.environ.get('INGEST_BUFFER_RETRY_BACKOFF_MS') or 100)
+    INGEST_BUFFER_DEAD_LETTER_PATH = os.environ.get('INGEST_BUFFER_DEAD_LETTER_PATH') or os.path.join(
+        os.path.dirname(__file__), 'database', 'ingest_dead_letter.ndjson'
+    )
+    
+    # 设备在线状态跟踪（心跳只写内存，定期批量写回数据库）
+    PRESENCE_TRACKING_ENABLED = (os.environ.get('PRESENCE_TRACKING_ENABLED') or 'true').lower() == 'true'
+    PRESENCE_FLUSH_INTERVAL = int(os.environ.get('PRESENCE_FLUSH_INTERVAL') or 10)
+    
+    # 设备注册表缓存（LRU + TTL）
+    DEVICE_CACHE_ENABLED = (os.environ.get('DEVICE_CACHE_ENABLED') or 'true').lower() == 'true'
+    DEVICE_CACHE_SIZE = int(os.environ.get('DEVICE_CACHE_SIZE') or 10000)
+    DEVICE_CACHE_TTL = int(os.environ.get('DEVICE_CACHE_TTL') or 60)
+    # 未注册设备ID的负缓存；注册只使本进程的条目失效，其他进程最多在TTL秒内仍返回404，因此TTL保持很短
+    DEVICE_NEGATIVE_CACHE_SIZE = int(os.environ.get('DEVICE_NEGATIVE_CACHE_SIZE') or 10000)
+    DEVICE_NEGATIVE_CACHE_TTL = int(os.environ.get('DEVICE_NEGATIVE_CACHE_TTL') or 3)
+    
+    # 设备统计（/api/devices/stats 和 /health 共享）的缓存时间（秒）
+    DEVICE_STATS_CACHE_TTL = int(os.environ.get('DEVICE_STATS_CACHE_TTL') or 5)
+    
+    # 仪表板快照（/api/dashboard/snapshot）的缓存时间（秒）
+    DASHBOARD_SNAPSHOT_TTL = int(os.environ.get('DASHBOARD_SNAPSHOT_TTL') or 2)
+    
+    # 数据查询接口每页最多返回的条数
+    DATA_QUERY_MAX_PAGE_SIZE = int(os.environ.get('DATA_QUERY_MAX_PAGE_SIZE') or 1000)
+    
+    # 时间桶聚合查询每个序列最多的桶数
+    DATA_QUERY_MAX_BUCKETS = int(os.environ.get('DATA_QUERY_MAX_BUCKETS') or 10000)
+    
+    # 分钟/小时/天汇总表：后台每隔ROLLUP_COMPACT_INTERVAL秒按ID顺序压缩已提交的数据；遇到ID空缺（事务尚未提交）时停止，
+    # 空缺超过ROLLUP_LAG_SECONDS秒仍未填补时视为回滚留下的永久空缺
+    ROLLUP_ENABLED = (os.environ.get('ROLLUP_ENABLED') or 'true').lower() == 'true'
+    ROLLUP_COMPACT_INTERVAL = int(os.environ.get('ROLLUP_COMPACT_INTERVAL') or 10)
+    ROLLUP_BATCH_SIZE = int(os.environ.get('ROLLUP_BATCH_SIZE') or 5000)
+    ROLLUP_LAG_SECONDS = int(os.environ.get('ROLLUP_LAG_SECONDS') or 30)
+    
+    # 冷数据归档：后台每隔ARCHIVE_INTERVAL秒将早于ARCHIVE_AFTER_DAYS天的数据按天移入ARCHIVE_PATH下的压缩文件
+    ARCHIVE_ENABLED = (os.environ.get('ARCHIVE_ENABLED') or 'false').lower() == 'true'
+    ARCHIVE_PATH = os.environ.get('ARCHIVE_PATH') or os.path.join(os.path.dirname(__file__), 'database', 'archive')
+    ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS') or 30)
+    ARCHIVE_INTERVAL = int(os.environ.get('ARCHIVE_INTERVAL') or 3600)
+    ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE') or 100000)
+    
+    # 设备命令长轮询：最长挂起秒数、跨进程写入命令的复查间隔（秒）和每次最多下发的命令数
+    COMMAND_MAX_WAIT = int(os.environ.get('COMMAND_MAX_WAIT') or 30)
+    COMMAND_RECHECK_INTERVAL = int(os.environ.get('COMMAND_RECHECK_INTERVAL') or 5)
+    COMMAND_BATCH_SIZE = int(os.environ.get('COMMAND_BATCH_SIZE') or 20)
+    # 每个进程同时挂起的长轮询上限，超过时立即返回空列表；每个挂起的请求占用一个工作线程，
+    # 需要多线程或协程的WSGI服务器（如gunicorn -k gthread --threads N 或 -k gevent），上限应小于每个进程的线程数
+    COMMAND_MAX_WAITERS = int(os.environ.get('COMMAND_MAX_WAITERS') or 50)
+    
+    # SSE实时读数推送：订阅者上限、每个订阅者的队列长度（满时丢弃最旧的读数）和空闲保活间隔（秒）
+    # 推送只在进程内分发，多个worker时每个SSE连接只收到同一worker写入的读数；需要完整的实时数据时使用单个worker
+    LIVE_STREAM_ENABLED = (os.environ.get('LIVE_STREAM_ENABLED') or 'true').lower() == 'true'
+    LIVE_STREAM_MAX_SUBSCRIBERS = int(os.environ.get('LIVE_STREAM_MAX_SUBSCRIBERS') or 100)
+    LIVE_STREAM_QUEUE_SIZE = int(os.environ.get('LIVE_STREAM_QUEUE_SIZE') or 1000)
+    LIVE_STREAM_KEEPALIVE = int(os.environ.get('LIVE_STREAM_KEEPALIVE') or 15)
+    
+    # 批量导出时每块（服务端游标每次读取、Parquet每个行组）的行数
+    EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE') or 10000)
+    
+    # NDJSON流式写入配置
+    STREAM_BATCH_SIZE = int(os.environ.get('STREAM_BATCH_SIZE') or 500)
+    STREAM_MAX_LINE_BYTES = int(os.environ.get('STREAM_MAX_LINE_BYTES') or 65536)
+    STREAM_MAX_ERRORS = int(os.environ.get('STREAM_MAX_ERRORS') or 100)
+    
+    # gzip/deflate请求体解压后的大小上限（字节），流式导入接口单独设置
+    MAX_DECOMPRESSED_BODY_SIZE = int(os.environ.get('MAX_DECOMPRESSED_BODY_SIZE') or 32 * 1024 * 1024)
+    STREAM_MAX_DECOMPRESSED_BODY_SIZE = int(os.environ.get('STREAM_MAX_DECOMPRESSED_BODY_SIZE') or 2 * 1024 * 1024 * 1024)
+    
 class DevelopmentConfig(Config):
     DEBUG = True
     
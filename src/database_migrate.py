@@ -0,0 +1,331 @@
+"""
+数据库迁移脚本
+将已有数据库升级到当前的表结构，每个迁移都会先检查是否需要执行，可以重复运行
+
+用法:
+    python src/database_migrate.py               执行所有需要的迁移
+    python src/database_migrate.py --status      查看迁移状态
+    python src/database_migrate.py --drop-legacy 删除迁移后保留的旧表
+    python src/database_migrate.py --check-indexes 用EXPLAIN检查常用查询是否使用索引
+"""
+import argparse
+import json
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from datetime import datetime, timedelta
+
+from sqlalchemy import inspect, text
+from sqlalchemy.orm import lazyload
+from src.models import db
+from src.models.channel import Channel
+from src.models.current_value import CurrentValue
+from src.models.sensor_data import SensorData
+from src.models.sensor_frame import ROW_SOURCE, SensorFrame
+
+# 迁移时每批复制的行数
+COPY_BATCH_SIZE = 5000
+
+LEGACY_SENSOR_TABLE = 'sensor_data_legacy'
+
+
+def _columns(inspector, table):
+    if not inspector.has_table(table):
+        return set()
+    return {column['name'] for column in inspector.get_columns(table)}
+
+
+def sensor_channels_needed(inspector):
+    """sensor_data仍是旧结构（每行保存device_id/sensor_type/unit/extra_data），或旧表数据尚未复制完"""
+    if 'device_id' in _columns(inspector, 'sensor_data'):
+        return True
+    return inspector.has_table(LEGACY_SENSOR_TABLE) and not _legacy_copy_complete()
+
+
+def _legacy_copy_complete():
+    legacy_max = db.session.execute(text(f'SELECT MAX(id) FROM {LEGACY_SENSOR_TABLE}')).scalar()
+    current_max = db.session.query(db.func.max(SensorData.id)).scalar()
+    return legacy_max is None or (current_max or 0) >= legacy_max
+
+
+def migrate_sensor_channels(inspector):
+    """将sensor_data拆分为channels通道表和 (channel_id, timestamp, value) 读数表"""
+    engine = db.engine
+
+    if 'device_id' in _columns(inspector, 'sensor_data'):
+        with engine.begin() as connection:
+            if engine.dialect.name == 'sqlite':
+                # SQLite的索引名全库唯一，重命名前删除旧表索引以便新表创建同名索引
+                for index in inspector.get_indexes('sensor_data'):
+                    connection.execute(text(f'DROP INDEX IF EXISTS {index["name"]}'))
+            connection.execute(text(f'ALTER TABLE sensor_data RENAME TO {LEGACY_SENSOR_TABLE}'))
+        print(f"✓ 旧表已重命名为 {LEGACY_SENSOR_TABLE}")
+
+    db.metadata.create_all(engine, tables=[Channel.__table__, SensorData.__table__])
+
+    # 按主键分批复制，保留原有ID；中断后重新运行会从已复制的最大ID继续
+    last_id = db.session.query(db.func.max(SensorData.id)).scalar() or 0
+    copied = 0
+    while True:
+        legacy_rows = db.session.execute(text(
+            f'SELECT id, device_id, sensor_type, value, unit, timestamp, extra_data '
+            f'FROM {LEGACY_SENSOR_TABLE} WHERE id > :last_id ORDER BY id LIMIT :limit'
+        ), {'last_id': last_id, 'limit': COPY_BATCH_SIZE}).mappings().all()
+        if not legacy_rows:
+            break
+
+        rows = [
+            SensorData.build_row(
+                device_id=row['device_id'],
+                sensor_type=row['sensor_type'],
+                value=row['value'],
+                unit=row['unit'],
+                metadata=_load_json(row['extra_data']),
+                timestamp=_load_datetime(row['timestamp'])
+            )
+            for row in legacy_rows
+        ]
+        channel_ids = Channel.resolve_ids(rows)
+        db.session.execute(SensorData.__table__.insert(), [
+            {'id': legacy['id'], 'channel_id': channel_id, 'value': row['value'], 'timestamp': row['timestamp']}
+            for legacy, channel_id, row in zip(legacy_rows, channel_ids, rows)
+        ])
+        db.session.commit()
+
+        last_id = legacy_rows[-1]['id']
+        copied += len(legacy_rows)
+        print(f"  已复制 {copied} 条传感器数据 (id <= {last_id})")
+
+    channel_count = db.session.query(db.func.count(Channel.id)).scalar()
+    print(f"✓ 传感器数据迁移完成: {copied} 条数据, {channel_count} 个通道")
+    print(f"  确认无误后可运行 --drop-legacy 删除 {LEGACY_SENSOR_TABLE}")
+
+
+def _load_json(value):
+    """文本SQL读取的JSON列在SQLite中为字符串"""
+    if isinstance(value, str):
+        return json.loads(value)
+    return value
+
+
+def _load_datetime(value):
+    """文本SQL读取的DATETIME列在SQLite中为字符串"""
+    if isinstance(value, str):
+        return datetime.fromisoformat(value)
+    return value
+
+
+# 复合索引: (表名, 索引名, 索引列, 被取代的单列索引)
+COMPOSITE_INDEXES = [
+    ('sensor_data', 'ix_sensor_data_channel_time', ('channel_id', 'timestamp', 'id', 'value'), 'ix_sensor_data_channel_id'),
+    ('channels', 'ix_channels_device_sensor', ('device_id', 'sensor_type'), 'ix_channels_device_id'),
+]
+
+
+def _index_columns(inspector, table):
+    """表上各索引的列，按索引名索引"""
+    return {index['name']: tuple(index['column_names']) for index in inspector.get_indexes(table)}
+
+
+def composite_indexes_needed(inspector):
+    """复合索引不存在或列不一致，或被取代的单列索引尚未删除"""
+    for table, name, columns, replaced in COMPOSITE_INDEXES:
+        if not set(columns) <= _columns(inspector, table):
+            continue
+        indexes = _index_columns(inspector, table)
+        if indexes.get(name) != columns or replaced in indexes:
+            return True
+    return False
+
+
+def migrate_composite_indexes(inspector):
+    """创建复合索引并删除被取代的单列索引；MySQL上使用在线DDL，建索引期间不阻塞读写"""
+    mysql = db.engine.dialect.name == 'mysql'
+    for table, name, columns, replaced in COMPOSITE_INDEXES:
+        if not set(columns) <= _columns(inspector, table):
+            continue
+        indexes = _index_columns(inspector, table)
+        
+        if indexes.get(name) != columns:
+            column_list = ', '.join(columns)
+            if mysql:
+                drop = f'DROP INDEX {name}, ' if name in indexes else ''
+                statements = [f'ALTER TABLE {table} {drop}ADD INDEX {name} ({column_list}), ALGORITHM=INPLACE, LOCK=NONE']
+            else:
+                statements = [f'DROP INDEX IF EXISTS {name}', f'CREATE INDEX {name} ON {table} ({column_list})']
+            with db.engine.begin() as connection:
+                for sql in statements:
+                    connection.execute(text(sql))
+            print(f"✓ 已创建索引 {table}.{name} ({column_list})")
+        
+        # 复合索引的首列可以支持原单列索引的查询和外键约束
+        if replaced in indexes:
+            if mysql:
+                sql = f'ALTER TABLE {table} DROP INDEX {replaced}, ALGORITHM=INPLACE, LOCK=NONE'
+            else:
+                sql = f'DROP INDEX IF EXISTS {replaced}'
+            with db.engine.begin() as connection:
+                connection.execute(text(sql))
+            print(f"✓ 已删除索引 {table}.{replaced}")
+
+
+def current_values_needed(inspector):
+    """current_values表为空但已有传感器通道（升级前写入的数据）"""
+    if 'channel_id' not in _columns(inspector, 'sensor_data'):
+        return False
+    if not inspector.has_table(CurrentValue.__tablename__):
+        return True
+    return db.session.query(CurrentValue.device_id).first() is None and db.session.query(Channel.id).first() is not None
+
+
+def migrate_current_values(inspector):
+    """用每个 (设备, 传感器类型) 的最新读数填充current_values表"""
+    db.metadata.create_all(db.engine, tables=[CurrentValue.__table__])
+
+    pairs = db.session.query(Channel.device_id, Channel.sensor_type).distinct().all()
+    filled = 0
+    for i in range(0, len(pairs), COPY_BATCH_SIZE):
+        rows, channel_ids = [], []
+        for device_id, sensor_type in pairs[i:i + COPY_BATCH_SIZE]:
+            latest = SensorData.get_latest_data(device_id, sensor_type, 1)
+            if not latest:
+                continue
+            reading = latest[0]
+            rows.append(SensorData.build_row(
+                device_id=device_id,
+                sensor_type=sensor_type,
+                value=reading.value,
+                unit=reading.unit,
+                timestamp=reading.timestamp
+            ))
+            channel_ids.append(reading.channel_id)
+        # 迁移期间新写入的更晚的读数不会被覆盖
+        CurrentValue.update_many(rows, channel_ids)
+        db.session.commit()
+        filled += len(rows)
+    print(f"✓ 最新值表填充完成: {filled} 个传感器")
+
+
+def device_config_version_needed(inspector):
+    """devices表缺少config_version列"""
+    return inspector.has_table('devices') and 'config_version' not in _columns(inspector, 'devices')
+
+
+def migrate_device_config_version(inspector):
+    """为devices表添加配置版本列（已有设备从0开始）"""
+    with db.engine.begin() as connection:
+        connection.execute(text('ALTER TABLE devices ADD COLUMN config_version INTEGER NOT NULL DEFAULT 0'))
+    print("✓ 已添加 devices.config_version")
+
+
+# (名称, 说明, 是否需要执行, 执行函数)，按顺序执行
+MIGRATIONS = [
+    ('sensor_channels', '传感器数据按通道规范化 (channels表)', sensor_channels_needed, migrate_sensor_channels),
+    ('composite_indexes', '按通道和时间查询的复合索引', composite_indexes_needed, migrate_composite_indexes),
+    ('current_values', '每种传感器的最新值表 (current_values)', current_values_needed, migrate_current_values),
+    ('device_config_version', '设备配置版本 (配置接口ETag)', device_config_version_needed, migrate_device_config_version),
+]
+
+
+def pending_migrations():
+    """返回需要执行的迁移名称列表（需在应用上下文中调用）"""
+    inspector = inspect(db.engine)
+    return [name for name, _, needed, _ in MIGRATIONS if needed(inspector)]
+
+
+def run_migrations():
+    """依次执行所有需要的迁移"""
+    for name, description, needed, migrate in MIGRATIONS:
+        inspector = inspect(db.engine)
+        if not needed(inspector):
+            print(f"- {name}: 无需执行")
+            continue
+        print(f"→ {name}: {description}")
+        migrate(inspector)
+
+
+def drop_legacy_tables():
+    """删除迁移后保留的旧表"""
+    inspector = inspect(db.engine)
+    if not inspector.has_table(LEGACY_SENSOR_TABLE):
+        print("- 没有需要删除的旧表")
+        return
+    if not _legacy_copy_complete():
+        print(f"⚠ {LEGACY_SENSOR_TABLE} 尚未复制完成，请先运行迁移")
+        return
+    with db.engine.begin() as connection:
+        connection.execute(text(f'DROP TABLE {LEGACY_SENSOR_TABLE}'))
+    print(f"✓ 已删除 {LEGACY_SENSOR_TABLE}")
+
+
+def _explain(query):
+    """返回查询的执行计划文本"""
+    statement = query.options(lazyload('*')).statement if hasattr(query, 'statement') else query
+    sql = str(statement.compile(dialect=db.engine.dialect, compile_kwargs={'literal_binds': True}))
+    prefix = 'EXPLAIN QUERY PLAN ' if db.engine.dialect.name == 'sqlite' else 'EXPLAIN '
+    rows = db.session.connection().exec_driver_sql(prefix + sql).all()
+    return ' | '.join(' '.join(str(value) for value in row if value is not None) for row in rows)
+
+
+def check_indexes():
+    """用EXPLAIN检查常用查询是否使用复合索引，全部通过时返回True"""
+    channel_id = db.session.query(db.func.min(Channel.id)).scalar() or 1
+    end_time = datetime.utcnow()
+    start_time = end_time - timedelta(hours=24)
+    
+    # (说明, 查询, 应使用的索引, 是否应由索引完成排序)
+    checks = [
+        ('单通道最新数据', SensorData.page_query([channel_id], 10), 'ix_sensor_data_channel_time', True),
+        ('单通道翻页', SensorData.page_query([channel_id], 10, start_time, end_time, (end_time, ROW_SOURCE, 1, 0)),
+         'ix_sensor_data_channel_time', True),
+        ('多通道最新数据', SensorData.page_query([channel_id, channel_id + 1], 10), 'ix_sensor_data_channel_time', False),
+        ('多设备最新数据', SensorData.latest_queries([channel_id, channel_id + 1], 10)[0],
+         'ix_sensor_data_channel_time', True),
+        ('多设备最新帧', SensorFrame.latest_queries(['device', 'device2'], 10)[0], 'ix_sensor_frames_device_time', True),
+        ('时间范围查询', SensorData.range_query([channel_id], start_time, end_time), 'ix_sensor_data_channel_time', False),
+        ('设备通道', Channel.query.filter_by(device_id='device', sensor_type='temperature'), 'ix_channels_device_sensor', False),
+    ]
+    
+    passed = True
+    for description, query, index, ordered in checks:
+        plan = _explain(query)
+        ok = index in plan
+        if ordered:
+            ok = ok and 'TEMP B-TREE' not in plan and 'filesort' not in plan
+        passed = passed and ok
+        print(f"{'✓' if ok else '✗'} {description}: {plan}")
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='IoT服务器数据库迁移')
+    parser.add_argument('--status', action='store_true', help='只显示迁移状态')
+    parser.add_argument('--drop-legacy', action='store_true', help='删除迁移后保留的旧表')
+    parser.add_argument('--check-indexes', action='store_true', help='用EXPLAIN检查常用查询是否使用索引')
+    args = parser.parse_args()
+
+    from src.database_init import create_app
+    app = create_app()
+
+    with app.app_context():
+        # 创建尚不存在的表（已有表不会被修改）
+        db.create_all()
+
+        if args.status:
+            pending = pending_migrations()
+            for name, description, _, _ in MIGRATIONS:
+                state = '待执行' if name in pending else '已完成'
+                print(f"{name}: {state} - {description}")
+        elif args.drop_legacy:
+            drop_legacy_tables()
+        elif args.check_indexes:
+            if not check_indexes():
+                sys.exit(1)
+        else:
+            run_migrations()
+            print("✓ 数据库迁移完成")
+
+
+if __name__ == '__main__':
+    main()
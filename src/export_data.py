@@ -0,0 +1,59 @@
+"""
+传感器数据导出脚本
+以服务端游标逐块读取数据并写入本地文件，格式与 GET /api/data/export 相同
+
+用法:
+    python src/export_data.py -o data.csv
+    python src/export_data.py --format parquet --device-id esp32_001 --start 2024-01-01 --end 2024-02-01 -o data.parquet
+    python src/export_data.py --format arrow --sensor-type temperature -o temperature.arrows
+"""
+import argparse
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from src.models.sensor_data import SensorData
+from src.utils.export import EXPORT_FORMATS, ExportFormatError, check_format, encode_chunks
+from src.utils.timestamps import parse_time
+
+
+def export(output, fmt='csv', device_id=None, sensor_type=None, start_time=None, end_time=None, chunk_size=10000):
+    """导出到文件（需要在应用上下文中调用），返回写入的字节数"""
+    chunks = SensorData.iter_export(device_id, sensor_type, start_time, end_time, chunk_size=chunk_size)
+    written = 0
+    with open(output, 'wb') as f:
+        for data in encode_chunks(fmt, chunks):
+            f.write(data)
+            written += len(data)
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description='导出传感器数据')
+    parser.add_argument('-o', '--output', required=True, help='输出文件路径')
+    parser.add_argument('--format', default='csv', choices=list(EXPORT_FORMATS), help='导出格式 (parquet和arrow需要pyarrow)')
+    parser.add_argument('--device-id', help='只导出指定设备')
+    parser.add_argument('--sensor-type', help='只导出指定传感器类型')
+    parser.add_argument('--start', type=parse_time, help='开始时间 (ISO格式，包含)')
+    parser.add_argument('--end', type=parse_time, help='结束时间 (ISO格式，包含)')
+    parser.add_argument('--chunk-size', type=int, help='每块读取的行数 (默认EXPORT_CHUNK_SIZE)')
+    args = parser.parse_args()
+
+    try:
+        check_format(args.format)
+    except ExportFormatError as e:
+        parser.error(str(e))
+
+    from src.database_init import create_app
+    app = create_app()
+
+    with app.app_context():
+        written = export(
+            args.output, args.format, args.device_id, args.sensor_type, args.start, args.end,
+            args.chunk_size or app.config['EXPORT_CHUNK_SIZE']
+        )
+        print(f"✓ 导出完成: {args.output} ({written} 字节)")
+
+
+if __name__ == '__main__':
+    main()
@@ -3,13 +3,25 @@ import sys
 # DON'T CHANGE THIS !!!
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
-from flask import Flask, send_from_directory, jsonify
+from flask import Flask, request, send_from_directory, jsonify
 from flask_cors import CORS
+from datetime import datetime
 from src.config import config
 from src.models import db
 from src.models.device import Device
 from src.models.sensor_data import SensorData
 from src.models.user import User
+from src.database_migrate import pending_migrations
+from src.services.archive import sensor_archiver
+from src.services.command_notifier import command_notifier
+from src.services.dashboard_snapshot import dashboard_snapshot
+from src.services.device_cache import device_cache
+from src.services.device_stats import device_stats
+from src.services.ingest_buffer import ingest_buffer
+from src.services.live_stream import live_stream
+from src.services.presence import presence
+from src.services.rollup import rollup_compactor
+from src.utils.compression import DecompressionMiddleware, RequestBodyError, read_decoded_body
 
 # 导入所有路由蓝图
 from src.routes.user import user_bp
@@ -17,6 +29,8 @@ from src.routes.devices import devices_bp
 from src.routes.data import data_bp
 from src.routes.microbit import microbit_bp
 from src.routes.esp32 import esp32_bp
+from src.routes.dashboard import dashboard_bp
+from src.routes.stream import stream_bp
 
 def create_app():
     """创建Flask应用实例"""
@@ -29,6 +43,23 @@ def create_app():
     # 启用CORS支持
     CORS(app, origins="*")
     
+    # 支持gzip/deflate压缩的上传请求体
+    streaming_paths = {'/api/data/stream': app.config['STREAM_MAX_DECOMPRESSED_BODY_SIZE']}
+    app.wsgi_app = DecompressionMiddleware(
+        app.wsgi_app,
+        max_size=app.config['MAX_DECOMPRESSED_BODY_SIZE'],
+        path_limits=streaming_paths
+    )
+    
+    # 压缩的请求体在进入视图前解压，损坏的压缩数据返回400、超过大小限制返回413，不会被视图中的通用异常处理变成500
+    @app.before_request
+    def decode_request_body():
+        read_decoded_body(request, streaming_paths)
+    
+    @app.errorhandler(RequestBodyError)
+    def request_body_error(error):
+        return jsonify({'success': False, 'error': str(error)}), error.status_code
+    
     # 尝试连接MySQL，失败则使用SQLite
     try:
         # 测试MySQL连接
@@ -59,17 +90,35 @@ def create_app():
     # 初始化数据库
     db.init_app(app)
     
+    # 初始化设备注册表缓存、设备统计缓存、传感器数据写缓冲、设备在线状态跟踪和汇总表压缩
+    command_notifier.init_app(app)
+    dashboard_snapshot.init_app(app)
+    device_cache.init_app(app)
+    device_stats.init_app(app)
+    ingest_buffer.init_app(app)
+    live_stream.init_app(app)
+    presence.init_app(app)
+    rollup_compactor.init_app(app)
+    sensor_archiver.init_app(app)
+    
     # 注册蓝图
     app.register_blueprint(user_bp, url_prefix='/api')
     app.register_blueprint(devices_bp, url_prefix='/api')
     app.register_blueprint(data_bp, url_prefix='/api')
     app.register_blueprint(microbit_bp, url_prefix='/api/microbit')
     app.register_blueprint(esp32_bp, url_prefix='/api/esp32')
+    app.register_blueprint(dashboard_bp, url_prefix='/api')
+    app.register_blueprint(stream_bp, url_prefix='/api/stream')
     
     # 创建数据库表
     with app.app_context():
         db.create_all()
         
+        # 已有数据库的表结构需要通过迁移脚本升级
+        pending = pending_migrations()
+        if pending:
+            print(f"⚠ 数据库表结构需要升级 ({', '.join(pending)})，请运行: python src/database_migrate.py")
+        
         # 创建默认管理员用户（如果不存在）
         admin_user = User.get_by_username('admin')
         if not admin_user:
@@ -96,7 +145,8 @@ def create_app():
                 'data': '/api/data',
                 'microbit': '/api/microbit',
                 'esp32': '/api/esp32',
-                'users': '/api/users'
+                'users': '/api/users',
+                'metrics': '/api/metrics'
             },
             'status': 'running'
         })
@@ -107,30 +157,56 @@ def create_app():
         """健康检查端点"""
         try:
             # 检查数据库连接
-            db.session.execute('SELECT 1')
+            db.session.execute(db.text('SELECT 1'))
             db_status = 'healthy'
         except Exception as e:
             db_status = f'error: {str(e)}'
         
-        # 统计设备数量
+        # 统计设备数量（与 /api/devices/stats 共享缓存）
         try:
-            total_devices = Device.query.count()
-            online_devices = Device.query.filter_by(status='online').count()
-            microbit_devices = Device.query.filter_by(device_type='microbit').count()
-            esp32_devices = Device.query.filter_by(device_type='esp32').count()
-        except:
-            total_devices = online_devices = microbit_devices = esp32_devices = 0
+            stats = device_stats.get()
+        except Exception:
+            stats = {'total': 0, 'online': 0, 'microbit': 0, 'esp32': 0}
         
         return jsonify({
             'status': 'healthy',
             'database': db_status,
-            'devices': {
-                'total': total_devices,
-                'online': online_devices,
-                'microbit': microbit_devices,
-                'esp32': esp32_devices
-            },
-            'timestamp': db.func.now()
+            'devices': stats,
+            'timestamp': datetime.utcnow().isoformat()
+        })
+    
+    # 存活探针：只确认进程能处理请求，不访问数据库
+    @app.route('/health/live')
+    def liveness_probe():
+        """存活探针"""
+        return jsonify({'status': 'alive'})
+    
+    # 就绪探针：只执行 SELECT 1，不统计任何表
+    @app.route('/health/ready')
+    def readiness_probe():
+        """就绪探针，数据库不可用时返回503"""
+        try:
+            db.session.execute(db.text('SELECT 1'))
+        except Exception as e:
+            db.session.rollback()
+            return jsonify({'status': 'unavailable', 'database': f'error: {str(e)}'}), 503
+        return jsonify({'status': 'ready', 'database': 'healthy'})
+    
+    # 运行指标
+    @app.route('/api/metrics')
+    def metrics():
+        """运行指标（写缓冲等内部计数器）"""
+        return jsonify({
+            'success': True,
+            'device_cache': device_cache.stats(),
+            'ingest_buffer': ingest_buffer.stats(),
+            'live_stream': live_stream.stats(),
+            'presence': presence.stats(),
+            'device_stats': device_stats.stats(),
+            'commands': command_notifier.stats(),
+            'dashboard_snapshot': dashboard_snapshot.stats(),
+            'rollup': rollup_compactor.stats(),
+            'archive': sensor_archiver.stats()
         })
     
     # 静态文件服务
@@ -182,7 +258,7 @@ if __name__ == '__main__':
     print(f"Database: {app.config.get('SQLALCHEMY_DATABASE_URI', 'Not configured')}")
     print("API Endpoints:")
     print("  - /api - API信息")
-    print("  - /health - 健康检查")
+    print("  - /health - 健康检查 (/health/live 存活探针, /health/ready 就绪探针)")
     print("  - /api/devices - 设备管理")
     print("  - /api/data - 数据管理")
     print("  - /api/microbit - micro:bit接口")
@@ -2,8 +2,26 @@ from flask_sqlalchemy import SQLAlchemy
 
 db = SQLAlchemy()
 
+# 单条语句的绑定参数上限（SQLite 3.32之前默认为999）和复合查询的SELECT数量上限（SQLite默认为500）
+MAX_BIND_PARAMS = 999
+MAX_COMPOUND_SELECTS = 500
+
+def union_all_chunks(selects):
+    """将结构相同的SELECT按绑定参数总数分组，每组合并为一条UNION ALL语句"""
+    if not selects:
+        return []
+    params = max(len(selects[0].compile().params), 1)
+    size = min(MAX_BIND_PARAMS // params, MAX_COMPOUND_SELECTS)
+    return [db.union_all(*selects[i:i + size]) for i in range(0, len(selects), size)]
+
 # 导入所有模型
 from .device import Device
+from .channel import Channel
+from .current_value import CurrentValue
+from .device_command import DeviceCommand
+from .sensor_rollup import SensorRollup, RollupWatermark
+from .sensor_frame import SensorFrame
+from .sensor_archive import ArchiveSegment
 from .sensor_data import SensorData
 from .user import User
 
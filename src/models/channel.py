@@ -0,0 +1,150 @@
+import hashlib
+import json
+import threading
+from datetime import datetime
+from sqlalchemy.exc import IntegrityError
+from src.models import db
+
+class Channel(db.Model):
+    """传感器通道：设备、传感器类型、单位和静态元数据的组合，sensor_data只保存通道ID"""
+    __tablename__ = 'channels'
+    __table_args__ = (
+        db.Index('ix_channels_device_sensor', 'device_id', 'sensor_type'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    device_id = db.Column(db.String(50), db.ForeignKey('devices.device_id'), nullable=False)
+    sensor_type = db.Column(db.String(50), nullable=False)
+    unit = db.Column(db.String(20))
+    
+    # 通道的静态元数据（JSON格式），例如 {'pin': 'A0', 'type': 'analog_input'}
+    extra_data = db.Column(db.JSON)
+    
+    # (device_id, sensor_type, unit, extra_data) 规范化后的SHA-1，用于唯一约束和查找
+    channel_key = db.Column(db.String(40), unique=True, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # 关联传感器数据
+    readings = db.relationship('SensorData', back_populates='channel', lazy=True, cascade='all, delete-orphan')
+    
+    # 进程内的 channel_key -> id 缓存（通道创建后不会修改）
+    _id_cache = {}
+    _id_cache_lock = threading.Lock()
+    _id_cache_limit = 100000
+    
+    def __repr__(self):
+        return f'<Channel {self.id}: {self.device_id}/{self.sensor_type}>'
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'device_id': self.device_id,
+            'sensor_type': self.sensor_type,
+            'unit': self.unit,
+            'metadata': self.extra_data,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+    
+    @staticmethod
+    def make_key(device_id, sensor_type, unit=None, metadata=None):
+        """计算通道的规范化键"""
+        canonical = json.dumps(
+            [device_id, sensor_type, unit, metadata],
+            sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str
+        )
+        return hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+    
+    @classmethod
+    def for_device(cls, device_id, sensor_type=None):
+        """设备的通道（可按传感器类型过滤），按通道ID索引"""
+        query = cls.query.filter_by(device_id=device_id)
+        if sensor_type:
+            query = query.filter_by(sensor_type=sensor_type)
+        return {channel.id: channel for channel in query.all()}
+    
+    @classmethod
+    def matching(cls, device_id=None, sensor_type=None):
+        """按设备和传感器类型过滤的通道（条件为空时不过滤），按通道ID索引"""
+        query = cls.query
+        if device_id:
+            query = query.filter_by(device_id=device_id)
+        if sensor_type:
+            query = query.filter_by(sensor_type=sensor_type)
+        return {channel.id: channel for channel in query.all()}
+    
+    @classmethod
+    def for_devices(cls, device_ids):
+        """多个设备的所有通道，按通道ID索引"""
+        device_ids = list(device_ids)
+        if not device_ids:
+            return {}
+        return {channel.id: channel for channel in cls.query.filter(cls.device_id.in_(device_ids)).all()}
+    
+    @classmethod
+    def resolve_ids(cls, rows):
+        """为SensorData.build_row构建的记录查找或创建通道，返回与rows顺序一致的通道ID列表"""
+        keys = [
+            cls.make_key(row['device_id'], row['sensor_type'], row['unit'], row['extra_data'])
+            for row in rows
+        ]
+        
+        with cls._id_cache_lock:
+            ids = {key: cls._id_cache[key] for key in set(keys) if key in cls._id_cache}
+        
+        missing = {key: row for key, row in zip(keys, rows) if key not in ids}
+        if missing:
+            loaded = cls._load_ids(missing)
+            ids.update(loaded)
+            
+            # 只缓存已提交的通道，本事务新建的通道在下次查询时缓存
+            with cls._id_cache_lock:
+                if len(cls._id_cache) + len(loaded) > cls._id_cache_limit:
+                    cls._id_cache.clear()
+                cls._id_cache.update(loaded)
+            
+            created = {key: row for key, row in missing.items() if key not in ids}
+            if created:
+                ids.update(cls._create(created))
+        
+        return [ids[key] for key in keys]
+    
+    @classmethod
+    def _load_ids(cls, keyed_rows):
+        """按channel_key批量查询已有通道"""
+        result = db.session.query(cls.channel_key, cls.id).filter(
+            cls.channel_key.in_(list(keyed_rows))
+        ).all()
+        return dict(result)
+    
+    @classmethod
+    def _create(cls, keyed_rows):
+        """创建新通道；并发创建导致唯一约束冲突时回退到查询"""
+        values = [
+            {
+                'device_id': row['device_id'],
+                'sensor_type': row['sensor_type'],
+                'unit': row['unit'],
+                'extra_data': row['extra_data'],
+                'channel_key': key,
+                'created_at': datetime.utcnow()
+            }
+            for key, row in keyed_rows.items()
+        ]
+        try:
+            with db.session.begin_nested():
+                db.session.execute(cls.__table__.insert(), values)
+        except IntegrityError:
+            # 其他请求已创建部分通道，逐个插入剩余通道
+            for value in values:
+                try:
+                    with db.session.begin_nested():
+                        db.session.execute(cls.__table__.insert(), [value])
+                except IntegrityError:
+                    pass
+        return cls._load_ids(keyed_rows)
+    
+    @classmethod
+    def clear_cache(cls):
+        """清空通道ID缓存（迁移或测试后调用）"""
+        with cls._id_cache_lock:
+            cls._id_cache.clear()
@@ -0,0 +1,89 @@
+from sqlalchemy.dialects import mysql, sqlite
+from src.models import db
+
+class CurrentValue(db.Model):
+    """每个 (设备, 传感器类型) 的最新读数，写入传感器数据时在同一事务中更新"""
+    __tablename__ = 'current_values'
+    
+    device_id = db.Column(db.String(50), db.ForeignKey('devices.device_id'), primary_key=True)
+    sensor_type = db.Column(db.String(50), primary_key=True)
+    channel_id = db.Column(db.Integer, db.ForeignKey('channels.id'), nullable=False)
+    value = db.Column(db.Float, nullable=False)
+    unit = db.Column(db.String(20))
+    timestamp = db.Column(db.DateTime, nullable=False)
+    
+    def __repr__(self):
+        return f'<CurrentValue {self.device_id}: {self.sensor_type}={self.value}{self.unit}>'
+    
+    def to_dict(self):
+        return {
+            'value': self.value,
+            'unit': self.unit,
+            'timestamp': self.timestamp.isoformat() if self.timestamp else None
+        }
+    
+    def to_reading_dict(self, metadata=None):
+        """与SensorData.to_dict格式一致的字典（id为None）"""
+        return {
+            'id': None,
+            'device_id': self.device_id,
+            'sensor_type': self.sensor_type,
+            'value': self.value,
+            'unit': self.unit,
+            'timestamp': self.timestamp.isoformat() if self.timestamp else None,
+            'metadata': metadata
+        }
+    
+    @classmethod
+    def update_many(cls, rows, channel_ids):
+        """用SensorData.build_row构建的记录更新最新值（不提交）；只有时间不早于已保存值的记录会覆盖"""
+        latest = {}
+        for channel_id, row in zip(channel_ids, rows):
+            key = (row['device_id'], row['sensor_type'])
+            if key not in latest or row['timestamp'] >= latest[key]['timestamp']:
+                latest[key] = {
+                    'device_id': row['device_id'],
+                    'sensor_type': row['sensor_type'],
+                    'channel_id': channel_id,
+                    'value': row['value'],
+                    'unit': row['unit'],
+                    'timestamp': row['timestamp']
+                }
+        if not latest:
+            return 0
+        
+        table = cls.__table__
+        if db.engine.dialect.name == 'mysql':
+            statement = mysql.insert(table)
+            new = statement.inserted
+            newer = new.timestamp >= table.c.timestamp
+            # MySQL按顺序执行赋值，timestamp最后更新
+            statement = statement.on_duplicate_key_update([
+                (column, db.case((newer, new[column]), else_=table.c[column]))
+                for column in ('channel_id', 'value', 'unit', 'timestamp')
+            ])
+        else:
+            statement = sqlite.insert(table)
+            new = statement.excluded
+            statement = statement.on_conflict_do_update(
+                index_elements=['device_id', 'sensor_type'],
+                set_={column: new[column] for column in ('channel_id', 'value', 'unit', 'timestamp')},
+                where=new.timestamp >= table.c.timestamp
+            )
+        # 按主键顺序加锁，并发的批量写入不会因加锁顺序相反而死锁（MySQL）
+        db.session.execute(statement, [latest[key] for key in sorted(latest)])
+        return len(latest)
+    
+    @classmethod
+    def for_device(cls, device_id):
+        """设备每种传感器的最新值（一次主键范围查询），按传感器类型索引"""
+        return {value.sensor_type: value for value in cls.query.filter_by(device_id=device_id).all()}
+    
+    @classmethod
+    def for_devices(cls, device_ids):
+        """多个设备每种传感器的最新值，返回 {device_id: {sensor_type: 最新值字典}}"""
+        result = {device_id: {} for device_id in device_ids}
+        if result:
+            for value in cls.query.filter(cls.device_id.in_(list(result))).all():
+                result[value.device_id][value.sensor_type] = value.to_dict()
+        return result
@@ -1,5 +1,11 @@
 from datetime import datetime
 from src.models import db
+from src.services.device_cache import DeviceInfo, device_cache
+from src.services.device_stats import device_stats
+from src.services.presence import presence
+
+# 叠加在线状态时每条IN查询最多包含的设备数
+STATUS_OVERLAY_CHUNK = 500
 
 class Device(db.Model):
     __tablename__ = 'devices'
@@ -17,8 +23,14 @@ class Device(db.Model):
     # 设备配置信息（JSON格式存储）
     config = db.Column(db.JSON)
     
-    # 关联传感器数据
-    sensor_data = db.relationship('SensorData', backref='device', lazy=True, cascade='all, delete-orphan')
+    # 配置版本，服务器端修改配置时递增（心跳上报的system_info不改变版本），用作配置接口的ETag
+    config_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    
+    # 关联传感器通道（传感器数据通过通道关联到设备）
+    channels = db.relationship('Channel', backref='device', lazy=True, cascade='all, delete-orphan')
+    
+    # 帧模式存储的传感器数据
+    frames = db.relationship('SensorFrame', backref='device', lazy='dynamic', cascade='all, delete-orphan')
     
     def __repr__(self):
         return f'<Device {self.device_id}: {self.name}>'
@@ -30,32 +42,176 @@ class Device(db.Model):
             'device_type': self.device_type,
             'name': self.name,
             'description': self.description,
-            'status': self.status,
-            'last_seen': self.last_seen.isoformat() if self.last_seen else None,
+            'status': self.current_status,
+            'last_seen': self.current_last_seen.isoformat() if self.current_last_seen else None,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None,
-            'config': self.config
+            'config': self.get_config()
         }
     
+    @property
+    def current_status(self):
+        """设备状态（优先使用内存中尚未写回的在线状态）"""
+        entry = presence.get(self.device_id)
+        return entry[0] if entry else self.status
+    
+    @property
+    def current_last_seen(self):
+        """最后在线时间（优先使用内存中尚未写回的值）"""
+        entry = presence.get(self.device_id)
+        return entry[1] if entry else self.last_seen
+    
+    def get_config(self):
+        """设备配置（合并心跳上报但尚未写回的配置信息）"""
+        entry = presence.get(self.device_id)
+        if entry and entry[2]:
+            return {**(self.config or {}), **entry[2]}
+        return self.config
+    
     def update_status(self, status):
-        """更新设备状态和最后在线时间"""
+        """更新设备状态和最后在线时间；状态改变时设备统计缓存失效"""
+        changed = self.status != status
+        presence.discard(self.device_id)
         self.status = status
         self.last_seen = datetime.utcnow()
         self.updated_at = datetime.utcnow()
         db.session.commit()
+        device_cache.invalidate(self.device_id)
+        if changed:
+            device_stats.invalidate()
+    
+    def update_config(self, config):
+        """保存设备配置、递增配置版本并使设备注册表缓存失效"""
+        self.config = config
+        self.config_version = Device.config_version + 1
+        self.updated_at = datetime.utcnow()
+        db.session.commit()
+        device_cache.invalidate(self.device_id)
+    
+    def touch(self, config_patch=None):
+        """记录设备在线（心跳/数据上传），由在线状态跟踪器批量写回"""
+        if presence.enabled:
+            presence.record(self.device_id, 'online', config_patch)
+            return
+        if config_patch:
+            self.config = {**(self.config or {}), **config_patch}
+        self.update_status('online')
+    
+    @classmethod
+    def mark_seen(cls, device_id, config_patch=None):
+        """按设备ID记录设备在线，启用在线状态跟踪时不访问数据库"""
+        if presence.enabled:
+            presence.record(device_id, 'online', config_patch)
+            return
+        device = cls.get_by_device_id(device_id)
+        if device:
+            device.touch(config_patch)
+    
+    @classmethod
+    def get_config_version(cls, device_id):
+        """只查询设备的配置版本（不加载配置），设备不存在时返回None"""
+        return db.session.query(cls.config_version).filter_by(device_id=device_id).scalar()
+    
+    @classmethod
+    def lookup(cls, device_id):
+        """通过设备注册表缓存获取设备基本信息（DeviceInfo），设备不存在时返回None"""
+        return cls.lookup_many([device_id]).get(device_id)
+    
+    @classmethod
+    def lookup_many(cls, device_ids):
+        """批量获取设备基本信息，未命中缓存的设备用一次IN查询加载，返回 {device_id: DeviceInfo}"""
+        result = {}
+        missing = []
+        for device_id in set(device_ids):
+            hit, info = device_cache.get(device_id)
+            if hit:
+                result[device_id] = info
+            else:
+                missing.append(device_id)
+        
+        if missing:
+            rows = db.session.query(
+                cls.device_id, cls.device_type, cls.status
+            ).filter(cls.device_id.in_(missing)).all()
+            for device_id, device_type, status in rows:
+                info = DeviceInfo(device_id, device_type, status)
+                device_cache.put(info)
+                result[device_id] = info
+            for device_id in missing:
+                if device_id not in result:
+                    device_cache.put_missing(device_id)
+        
+        # 叠加内存中尚未写回的在线状态（负缓存命中的设备值为None）
+        result = {device_id: info for device_id, info in result.items() if info is not None}
+        for device_id, info in result.items():
+            entry = presence.get(device_id)
+            if entry and entry[0] != info.status:
+                result[device_id] = info._replace(status=entry[0])
+        return result
     
     @classmethod
     def get_by_device_id(cls, device_id):
         """根据设备ID获取设备"""
         return cls.query.filter_by(device_id=device_id).first()
     
+    @classmethod
+    def touch_many(cls, device_ids, status='online'):
+        """批量更新设备状态和最后在线时间（不提交，随数据写入一起提交）"""
+        device_ids = set(device_ids)
+        if not device_ids:
+            return 0
+        if presence.enabled:
+            presence.record_many(device_ids, status)
+            return len(device_ids)
+        now = datetime.utcnow()
+        return cls.query.filter(cls.device_id.in_(device_ids)).update(
+            {'status': status, 'last_seen': now, 'updated_at': now},
+            synchronize_session=False
+        )
+    
     @classmethod
     def get_online_devices(cls, device_type=None):
         """获取在线设备"""
-        query = cls.query.filter_by(status='online')
+        query = cls.query
         if device_type:
             query = query.filter_by(device_type=device_type)
-        return query.all()
+        return cls.filter_by_status(query, 'online')
+    
+    @classmethod
+    def filter_by_status(cls, query, status):
+        """按状态过滤设备，叠加内存中尚未写回的在线状态（不在请求中写回，只额外加载状态尚未写回且数据库中状态不同的设备）"""
+        devices = query.filter_by(status=status).all()
+        found = {device.device_id for device in devices}
+        changed = [
+            device_id for device_id, entry in presence.pending().items()
+            if entry[0] == status and device_id not in found
+        ]
+        for i in range(0, len(changed), STATUS_OVERLAY_CHUNK):
+            devices.extend(query.filter(cls.device_id.in_(changed[i:i + STATUS_OVERLAY_CHUNK])).all())
+        devices = [device for device in devices if device.current_status == status]
+        devices.sort(key=lambda device: device.id)
+        return devices
+    
+    @classmethod
+    def count_by_status(cls, status):
+        """统计指定状态的设备数量（内存中的在线状态由后台线程写回，最多滞后PRESENCE_FLUSH_INTERVAL秒）"""
+        return cls.query.filter_by(status=status).count()
+    
+    @classmethod
+    def get_stats(cls):
+        """用一条条件聚合查询统计设备总数、在线数和各类型数量（查询语句固定不变；在线数最多滞后PRESENCE_FLUSH_INTERVAL秒）"""
+        total, online, microbit, esp32 = db.session.query(
+            db.func.count(cls.id),
+            db.func.sum(db.case((cls.status == 'online', 1), else_=0)),
+            db.func.sum(db.case((cls.device_type == 'microbit', 1), else_=0)),
+            db.func.sum(db.case((cls.device_type == 'esp32', 1), else_=0))
+        ).one()
+        return {
+            'total': total,
+            'online': int(online or 0),
+            'microbit': int(microbit or 0),
+            'esp32': int(esp32 or 0)
+        }
     
     @classmethod
     def register_device(cls, device_id, device_type, name, description=None, config=None):
@@ -66,8 +222,11 @@ class Device(db.Model):
             existing_device.name = name
             existing_device.description = description
             existing_device.config = config
+            existing_device.config_version = cls.config_version + 1
             existing_device.updated_at = datetime.utcnow()
             db.session.commit()
+            presence.discard(device_id)
+            device_cache.invalidate(device_id)
             return existing_device
         else:
             # 创建新设备
@@ -80,5 +239,7 @@ class Device(db.Model):
             )
             db.session.add(new_device)
             db.session.commit()
+            device_cache.invalidate(device_id)
+            device_stats.invalidate()
             return new_device
 
@@ -0,0 +1,86 @@
+from datetime import datetime
+from src.models import db
+
+class DeviceCommand(db.Model):
+    """发往设备的控制命令队列，设备确认执行后才会移出待处理列表"""
+    __tablename__ = 'device_commands'
+    __table_args__ = (
+        # 按设备查询待处理命令（按ID顺序）
+        db.Index('ix_device_commands_pending', 'device_id', 'status', 'id'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    device_id = db.Column(db.String(50), db.ForeignKey('devices.device_id'), nullable=False)
+    action = db.Column(db.String(50), nullable=False)
+    parameters = db.Column(db.JSON)
+    status = db.Column(db.Enum('pending', 'acked', name='command_status'), nullable=False, default='pending')
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # 第一次和最近一次下发时间、下发次数（未确认的命令会重复下发）
+    first_delivered_at = db.Column(db.DateTime)
+    last_delivered_at = db.Column(db.DateTime)
+    delivery_count = db.Column(db.Integer, nullable=False, default=0)
+    acked_at = db.Column(db.DateTime)
+    
+    def __repr__(self):
+        return f'<DeviceCommand {self.id} {self.device_id}: {self.action} ({self.status})>'
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'device_id': self.device_id,
+            'action': self.action,
+            'parameters': self.parameters or {},
+            'status': self.status,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'delivery_count': self.delivery_count,
+            'acked_at': self.acked_at.isoformat() if self.acked_at else None
+        }
+    
+    @classmethod
+    def enqueue(cls, device_id, action, parameters=None):
+        """将命令加入设备队列并提交"""
+        command = cls(device_id=device_id, action=action, parameters=parameters, status='pending')
+        db.session.add(command)
+        db.session.commit()
+        return command
+    
+    @classmethod
+    def get_pending(cls, device_id, limit):
+        """设备尚未确认的命令（按ID顺序，使用待处理索引）"""
+        return cls.query.filter_by(device_id=device_id, status='pending').order_by(cls.id).limit(limit).all()
+    
+    @classmethod
+    def mark_delivered(cls, commands):
+        """记录本次下发（一条UPDATE，提交），返回命令的字典列表
+        
+        在提交前序列化：提交后对象过期，再调用to_dict()每条命令都要重新查询一次
+        """
+        if not commands:
+            return []
+        now = datetime.utcnow()
+        ids = [command.id for command in commands]
+        result = [command.to_dict() for command in commands]
+        for item in result:
+            item['delivery_count'] += 1
+        cls.query.filter(cls.id.in_(ids)).update({
+            'first_delivered_at': db.func.coalesce(cls.first_delivered_at, now),
+            'last_delivered_at': now,
+            'delivery_count': cls.delivery_count + 1
+        }, synchronize_session=False)
+        db.session.commit()
+        return result
+    
+    @classmethod
+    def ack_many(cls, device_id, command_ids):
+        """批量确认设备已执行的命令（一条UPDATE，提交），返回确认的数量"""
+        command_ids = list(set(command_ids))
+        if not command_ids:
+            return 0
+        count = cls.query.filter(
+            cls.device_id == device_id,
+            cls.status == 'pending',
+            cls.id.in_(command_ids)
+        ).update({'status': 'acked', 'acked_at': datetime.utcnow()}, synchronize_session=False)
+        db.session.commit()
+        return count
@@ -0,0 +1,248 @@
+import bisect
+import functools
+import itertools
+import os
+import sys
+import zlib
+from array import array
+from datetime import datetime, timedelta
+from flask import current_app
+from src.models import db
+from src.models.sensor_frame import SensorFrame
+from src.models.sensor_rollup import EPOCH, add_to_bucket, epoch_seconds
+
+# 每个通道每天的数据块：时间戳（Unix微秒，差分编码的int64列）和数值（float64列）依次存放后整体zlib压缩
+ARCHIVE_COMPRESS_LEVEL = 6
+
+# 进程内缓存的已解压数据块数量
+ARCHIVE_BLOCK_CACHE_SIZE = 256
+
+MICROSECOND = timedelta(microseconds=1)
+DAY = timedelta(days=1)
+
+
+def archive_root():
+    """归档文件根目录"""
+    return current_app.config['ARCHIVE_PATH']
+
+
+def to_micros(timestamp):
+    return (timestamp - EPOCH) // MICROSECOND
+
+
+def encode_block(timestamps, values):
+    """将按时间排序的 (时间戳, 数值) 编码为压缩的列式数据块"""
+    micros = [to_micros(timestamp) for timestamp in timestamps]
+    deltas = array('q', micros[:1] + [b - a for a, b in zip(micros, micros[1:])])
+    values = array('d', values)
+    if sys.byteorder == 'big':
+        deltas.byteswap()
+        values.byteswap()
+    return zlib.compress(deltas.tobytes() + values.tobytes(), ARCHIVE_COMPRESS_LEVEL)
+
+
+@functools.lru_cache(maxsize=ARCHIVE_BLOCK_CACHE_SIZE)
+def _read_block(path, offset, length, count):
+    """读取并解码一个数据块，返回 (时间戳元组, 数值元组)；归档文件写入后不再修改，可以按位置缓存"""
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        raw = zlib.decompress(f.read(length))
+    deltas = array('q')
+    deltas.frombytes(raw[:8 * count])
+    values = array('d')
+    values.frombytes(raw[8 * count:])
+    if sys.byteorder == 'big':
+        deltas.byteswap()
+        values.byteswap()
+    timestamps = tuple(EPOCH + timedelta(microseconds=micros) for micros in itertools.accumulate(deltas))
+    return timestamps, tuple(values)
+
+
+class ArchiveSegment(db.Model):
+    """冷数据归档清单：每行对应归档文件中一个通道一天的数据块，保存块内读数的 count/sum/min/max/last"""
+    __tablename__ = 'archive_segments'
+    __table_args__ = (
+        db.Index('ix_archive_segments_channel_day', 'channel_id', 'day'),
+        db.Index('ix_archive_segments_day', 'day'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    channel_id = db.Column(db.Integer, db.ForeignKey('channels.id'), nullable=False)
+    day = db.Column(db.Date, nullable=False)
+    
+    # 相对ARCHIVE_PATH的文件路径和块在文件中的位置
+    path = db.Column(db.String(255), nullable=False)
+    offset = db.Column(db.BigInteger, nullable=False)
+    length = db.Column(db.Integer, nullable=False)
+    
+    count = db.Column(db.Integer, nullable=False)
+    sum = db.Column(db.Float, nullable=False)
+    min = db.Column(db.Float, nullable=False)
+    max = db.Column(db.Float, nullable=False)
+    first_time = db.Column(db.DateTime, nullable=False)
+    last_time = db.Column(db.DateTime, nullable=False)
+    last_value = db.Column(db.Float, nullable=False)
+    
+    # 块内读数归档前是否都已压缩到汇总表（启用汇总表时读取汇总表的时间段可以跳过该块）
+    compacted = db.Column(db.Boolean, nullable=False, default=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<ArchiveSegment {self.id} channel {self.channel_id}@{self.day}: {self.count} readings>'
+    
+    def read(self):
+        """解码数据块，返回 (时间戳元组, 数值元组)"""
+        return _read_block(os.path.join(archive_root(), self.path), self.offset, self.length, self.count)
+    
+    @classmethod
+    def write_file(cls, relative_path, blocks, day, compacted):
+        """写入一个归档文件并构建清单记录（不加入会话）
+        
+        blocks为 {channel_id: [(时间戳, 排序键, 数值), ...]}；文件先写入临时文件再原子替换，
+        清单记录提交前文件不会被读取
+        """
+        path = os.path.join(archive_root(), relative_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        
+        segments = []
+        offset = 0
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            for channel_id in sorted(blocks):
+                items = sorted(blocks[channel_id], key=lambda item: (item[0], item[1]))
+                timestamps = [item[0] for item in items]
+                values = [item[2] for item in items]
+                data = encode_block(timestamps, values)
+                f.write(data)
+                segments.append(cls(
+                    channel_id=channel_id,
+                    day=day,
+                    path=relative_path,
+                    offset=offset,
+                    length=len(data),
+                    count=len(items),
+                    sum=float(sum(values)),
+                    min=min(values),
+                    max=max(values),
+                    first_time=timestamps[0],
+                    last_time=timestamps[-1],
+                    last_value=values[-1],
+                    compacted=compacted
+                ))
+                offset += len(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+        return segments
+    
+    @classmethod
+    def overlapping(cls, channel_ids, start_time, end_time, uncompacted_only=False):
+        """与 [start_time, end_time] 有交集的数据块；channel_ids为None时包括所有通道"""
+        query = cls.query.filter(
+            cls.day >= start_time.date(),
+            cls.day <= end_time.date(),
+            cls.first_time <= end_time,
+            cls.last_time >= start_time
+        )
+        if channel_ids is not None:
+            query = query.filter(cls.channel_id.in_(list(channel_ids)))
+        if uncompacted_only:
+            query = query.filter(cls.compacted.is_(False))
+        return query.order_by(cls.day, cls.id).all()
+    
+    @classmethod
+    def _readings(cls, segment, channel, start_time, end_time):
+        """数据块中时间在 [start_time, end_time] 内的读数（SensorData对象，id为None）"""
+        readings = []
+        timestamps, values = segment.read()
+        # 块内读数按时间排序，二分查找范围
+        for pos in range(bisect.bisect_left(timestamps, start_time), bisect.bisect_right(timestamps, end_time)):
+            reading = SensorFrame.make_reading(channel, values[pos], timestamps[pos])
+            reading.archive_id = segment.id
+            reading.archive_pos = pos
+            readings.append(reading)
+        return readings
+    
+    @classmethod
+    def get_readings(cls, channels, start_time, end_time):
+        """归档中属于channels且时间在 [start_time, end_time] 内的读数"""
+        readings = []
+        for segment in cls.overlapping(channels, start_time, end_time):
+            readings.extend(cls._readings(segment, channels[segment.channel_id], start_time, end_time))
+        return readings
+    
+    @classmethod
+    def get_page(cls, channels, limit, page_key, start_time=None, end_time=None, cursor=None):
+        """按page_key倒序返回cursor之后的最多limit条归档读数；按天从新到旧读取，凑够limit条后不再读取更早的天"""
+        upper = end_time
+        if cursor and (upper is None or cursor[0] < upper):
+            upper = cursor[0]
+        
+        query = db.session.query(cls.day).filter(cls.channel_id.in_(list(channels)))
+        if start_time:
+            query = query.filter(cls.day >= start_time.date())
+        if upper:
+            query = query.filter(cls.day <= upper.date())
+        days = [day for day, in query.distinct().order_by(cls.day.desc())]
+        
+        readings = []
+        for day in days:
+            day_start = datetime.combine(day, datetime.min.time())
+            window_start = max(start_time, day_start) if start_time else day_start
+            window_end = min(upper, day_start + DAY - MICROSECOND) if upper else day_start + DAY - MICROSECOND
+            for segment in cls.overlapping(channels, window_start, window_end):
+                readings.extend(
+                    reading for reading in cls._readings(segment, channels[segment.channel_id], window_start, window_end)
+                    if cursor is None or page_key(reading) < cursor
+                )
+            # 每个数据块只包含一天的读数，更早的天排在这一天之后
+            if len(readings) >= limit:
+                break
+        readings.sort(key=page_key, reverse=True)
+        return readings[:limit]
+    
+    @classmethod
+    def add_to_buckets(cls, stats, channels, seconds, ranges, uncompacted_only=False):
+        """将 [起点, 终点) 时间范围内的归档读数合并到时间桶统计中
+        
+        完整落在范围内且不跨时间桶的数据块直接使用清单中的统计，不读取文件
+        """
+        for start, stop in ranges:
+            end = stop - MICROSECOND
+            for segment in cls.overlapping(channels, start, end, uncompacted_only):
+                whole = start <= segment.first_time and segment.last_time < stop
+                if whole and (not seconds or seconds % 86400 == 0):
+                    bucket_start = epoch_seconds(segment.first_time) // seconds * seconds if seconds else 0
+                    add_to_bucket(
+                        stats, (segment.channel_id, bucket_start), segment.count, segment.sum,
+                        segment.min, segment.max, segment.last_value, segment.last_time
+                    )
+                    continue
+                timestamps, values = segment.read()
+                for pos in range(bisect.bisect_left(timestamps, start), bisect.bisect_left(timestamps, stop)):
+                    timestamp, value = timestamps[pos], values[pos]
+                    bucket_start = epoch_seconds(timestamp) // seconds * seconds if seconds else 0
+                    add_to_bucket(stats, (segment.channel_id, bucket_start), 1, value, value, value, value, timestamp)
+    
+    @classmethod
+    def iter_export(cls, channels, start_time=None, end_time=None, chunk_size=10000):
+        """按 (天, 通道, 时间) 顺序逐块读取归档读数，每块chunk_size条 (device_id, sensor_type, timestamp, value, unit)"""
+        query = cls.query.filter(cls.channel_id.in_(list(channels)))
+        if start_time:
+            query = query.filter(cls.day >= start_time.date(), cls.last_time >= start_time)
+        if end_time:
+            query = query.filter(cls.day <= end_time.date(), cls.first_time <= end_time)
+        
+        chunk = []
+        for segment in query.order_by(cls.day, cls.channel_id, cls.id).yield_per(1000):
+            channel = channels[segment.channel_id]
+            timestamps, values = segment.read()
+            first = bisect.bisect_left(timestamps, start_time) if start_time else 0
+            last = bisect.bisect_right(timestamps, end_time) if end_time else len(timestamps)
+            for pos in range(first, last):
+                chunk.append((channel.device_id, channel.sensor_type, timestamps[pos], values[pos], channel.unit))
+                if len(chunk) >= chunk_size:
+                    yield chunk
+                    chunk = []
+        if chunk:
+            yield chunk
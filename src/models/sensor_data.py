@@ -1,22 +1,65 @@
-from datetime import datetime
-from src.models import db
+from datetime import datetime, timedelta
+from sqlalchemy.orm import lazyload
+from sqlalchemy.orm.attributes import set_committed_value
+from src.models import db, union_all_chunks
+from src.models.channel import Channel
+from src.models.current_value import CurrentValue
+from src.models.sensor_archive import ArchiveSegment
+from src.models.sensor_frame import ARCHIVE_SOURCE, FRAME_SOURCE, ROW_SOURCE, SensorFrame, frames_enabled
+from src.models.sensor_rollup import (
+    FRAMES_WATERMARK, ROWS_WATERMARK, RollupWatermark, SensorRollup, add_to_bucket, merge_buckets, rollups_enabled,
+    split_window
+)
+from src.services.live_stream import live_stream
+
+# 查询参数的结束时间包含在内，内部按半开区间 [start, end + 1微秒) 处理
+END_INCLUSIVE = timedelta(microseconds=1)
+
+# 读取汇总表期间压缩进度被推进时的最多尝试次数，仍不一致时直接扫描原始数据
+ROLLUP_READ_ATTEMPTS = 3
 
 class SensorData(db.Model):
     __tablename__ = 'sensor_data'
+    __table_args__ = (
+        # 按通道取最新值、时间范围查询、按 (timestamp, id) 翻页和求平均值都只需扫描这一个索引
+        db.Index('ix_sensor_data_channel_time', 'channel_id', 'timestamp', 'id', 'value'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
-    device_id = db.Column(db.String(50), db.ForeignKey('devices.device_id'), nullable=False, index=True)
-    sensor_type = db.Column(db.String(50), nullable=False)  # temperature, humidity, light, accelerometer, etc.
+    # 设备ID、传感器类型、单位和元数据保存在channels表中
+    channel_id = db.Column(db.Integer, db.ForeignKey('channels.id'), nullable=False)
     value = db.Column(db.Float, nullable=False)
-    unit = db.Column(db.String(20))  # °C, %, lux, g, etc.
     timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     
-    # 额外的数据字段（JSON格式）
-    extra_data = db.Column(db.JSON)
+    channel = db.relationship('Channel', back_populates='readings', lazy='joined')
+    
+    # 从帧展开的读数所在的帧ID和帧内位置（按行存储的数据为None）
+    frame_id = None
+    frame_pos = None
+    
+    # 从归档读取的读数所在的清单记录ID和块内位置（未归档的数据为None）
+    archive_id = None
+    archive_pos = None
     
     def __repr__(self):
         return f'<SensorData {self.device_id}: {self.sensor_type}={self.value}{self.unit}>'
     
+    @property
+    def device_id(self):
+        return self.channel.device_id if self.channel else None
+    
+    @property
+    def sensor_type(self):
+        return self.channel.sensor_type if self.channel else None
+    
+    @property
+    def unit(self):
+        return self.channel.unit if self.channel else None
+    
+    @property
+    def extra_data(self):
+        return self.channel.extra_data if self.channel else None
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -31,45 +74,385 @@ class SensorData(db.Model):
     @classmethod
     def add_data(cls, device_id, sensor_type, value, unit=None, metadata=None):
         """添加传感器数据"""
+        row = cls.build_row(device_id, sensor_type, value, unit, metadata)
+        channel_id = Channel.resolve_ids([row])[0]
+        CurrentValue.update_many([row], [channel_id])
+        if frames_enabled():
+            SensorFrame.add_many([row], [channel_id])
+            db.session.commit()
+            if live_stream.active:
+                live_stream.publish([cls.row_to_dict(row)])
+            return SensorFrame.make_reading(db.session.get(Channel, channel_id), value, row['timestamp'])
+        
         data = cls(
-            device_id=device_id,
-            sensor_type=sensor_type,
+            channel_id=channel_id,
             value=value,
-            unit=unit,
-            extra_data=metadata
+            timestamp=row['timestamp']
         )
         db.session.add(data)
         db.session.commit()
+        # 没有订阅者时不构建读数字典，也不因读取data.id重新加载提交后过期的对象
+        if live_stream.active:
+            live_stream.publish([{**cls.row_to_dict(row), 'id': data.id}])
         return data
     
     @classmethod
-    def get_latest_data(cls, device_id, sensor_type=None, limit=10):
-        """获取最新的传感器数据"""
-        query = cls.query.filter_by(device_id=device_id)
-        if sensor_type:
-            query = query.filter_by(sensor_type=sensor_type)
-        return query.order_by(cls.timestamp.desc()).limit(limit).all()
+    def build_row(cls, device_id, sensor_type, value, unit=None, metadata=None, timestamp=None):
+        """构建一条待批量写入的传感器数据记录"""
+        return {
+            'device_id': device_id,
+            'sensor_type': sensor_type,
+            'value': value,
+            'unit': unit,
+            'extra_data': metadata,
+            'timestamp': timestamp or datetime.utcnow()
+        }
     
     @classmethod
-    def get_data_by_time_range(cls, device_id, start_time, end_time, sensor_type=None):
-        """根据时间范围获取数据"""
-        query = cls.query.filter(
-            cls.device_id == device_id,
+    def add_many(cls, rows):
+        """在单个事务中批量写入传感器数据（executemany，一次提交）并更新最新值表；帧模式下同一设备同一时刻的记录合并为一帧"""
+        if rows:
+            channel_ids = Channel.resolve_ids(rows)
+            CurrentValue.update_many(rows, channel_ids)
+            if frames_enabled():
+                SensorFrame.add_many(rows, channel_ids)
+            else:
+                db.session.execute(cls.__table__.insert(), [
+                    {'channel_id': channel_id, 'value': row['value'], 'timestamp': row['timestamp']}
+                    for channel_id, row in zip(channel_ids, rows)
+                ])
+        db.session.commit()
+        # 提交后推送给实时订阅者（没有订阅者时不构建读数字典）
+        if live_stream.active:
+            live_stream.publish([cls.row_to_dict(row) for row in rows])
+        return len(rows)
+    
+    @staticmethod
+    def row_to_dict(row):
+        """将build_row构建的记录转换为与to_dict一致的格式"""
+        return {
+            'id': row.get('id'),
+            'device_id': row['device_id'],
+            'sensor_type': row['sensor_type'],
+            'value': row['value'],
+            'unit': row['unit'],
+            'timestamp': row['timestamp'].isoformat() if row['timestamp'] else None,
+            'metadata': row['extra_data']
+        }
+    
+    @staticmethod
+    def page_key(reading):
+        """读数的排序键 (timestamp, 来源, id, 帧内位置取负)；按此键倒序排列，同一时刻按行存储的数据排在帧之前，归档的数据排在最后"""
+        if reading.archive_id is not None:
+            return (reading.timestamp, ARCHIVE_SOURCE, reading.archive_id, -reading.archive_pos)
+        if reading.frame_id is not None:
+            return (reading.timestamp, FRAME_SOURCE, reading.frame_id, -reading.frame_pos)
+        return (reading.timestamp, ROW_SOURCE, reading.id, 0)
+    
+    @classmethod
+    def _newest_first(cls, readings, limit=None):
+        """合并按行存储和帧展开的读数，按page_key倒序"""
+        readings = sorted(readings, key=cls.page_key, reverse=True)
+        return readings[:limit] if limit is not None else readings
+    
+    @classmethod
+    def _load_with_channels(cls, query, channels):
+        """执行只查询sensor_data的语句，并关联已加载的通道"""
+        readings = query.options(lazyload(cls.channel)).all()
+        for reading in readings:
+            set_committed_value(reading, 'channel', channels[reading.channel_id])
+        return readings
+    
+    @classmethod
+    def page_query(cls, channel_ids, limit, start_time=None, end_time=None, cursor=None):
+        """按 (timestamp, id) 倒序取cursor之后的limit条数据；多个通道时每个通道单独按索引取limit条后合并，避免对整个设备的数据排序"""
+        conditions = []
+        if start_time:
+            conditions.append(cls.timestamp >= start_time)
+        if end_time:
+            conditions.append(cls.timestamp <= end_time)
+        if cursor:
+            timestamp, source, last_id, _ = cursor
+            if source == ROW_SOURCE:
+                conditions.append(db.or_(
+                    cls.timestamp < timestamp,
+                    db.and_(cls.timestamp == timestamp, cls.id < last_id)
+                ))
+            else:
+                # 同一时刻按行存储的数据排在帧和归档数据之前，已经返回过
+                conditions.append(cls.timestamp < timestamp)
+        
+        ordering = (cls.timestamp.desc(), cls.id.desc())
+        if len(channel_ids) == 1:
+            return cls.query.filter(cls.channel_id == channel_ids[0], *conditions).order_by(*ordering).limit(limit)
+        
+        per_channel = [
+            db.select(cls.id, cls.timestamp).where(
+                cls.channel_id == channel_id, *conditions
+            ).order_by(*ordering).limit(limit).subquery().select()
+            for channel_id in channel_ids
+        ]
+        candidates = db.union_all(*per_channel).subquery('candidates')
+        top = db.select(candidates.c.id).order_by(
+            candidates.c.timestamp.desc(), candidates.c.id.desc()
+        ).limit(limit).subquery('top')
+        return cls.query.join(top, cls.id == top.c.id).order_by(*ordering)
+    
+    @classmethod
+    def range_query(cls, channel_ids, start_time, end_time):
+        """指定通道在时间范围内的数据，按 (channel_id, timestamp) 索引范围扫描"""
+        return cls.query.filter(
+            cls.channel_id.in_(channel_ids),
             cls.timestamp >= start_time,
             cls.timestamp <= end_time
+        ).order_by(cls.timestamp.desc(), cls.id.desc())
+    
+    @classmethod
+    def get_latest_data(cls, device_id, sensor_type=None, limit=10):
+        """获取最新的传感器数据（包含帧模式写入的数据）"""
+        channels = Channel.for_device(device_id, sensor_type)
+        if not channels:
+            return []
+        rows = cls._load_with_channels(cls.page_query(list(channels), limit), channels)
+        frames, _ = SensorFrame.get_page(device_id, channels, limit)
+        return cls._newest_first(rows + frames, limit) if frames else rows
+    
+    @classmethod
+    def latest_queries(cls, channel_ids, limit):
+        """每个通道最新limit条数据的查询：每个通道单独按索引倒序取limit条后UNION ALL，不对设备的全部历史排序；按设备取前limit条由调用方合并"""
+        per_channel = [
+            db.select(cls.id).where(cls.channel_id == channel_id).order_by(
+                cls.timestamp.desc(), cls.id.desc()
+            ).limit(limit).subquery().select()
+            for channel_id in channel_ids
+        ]
+        return [
+            cls.query.join(top, cls.id == top.c.id)
+            for top in (union.subquery('top') for union in union_all_chunks(per_channel))
+        ]
+    
+    @classmethod
+    def get_latest_for_devices(cls, device_ids, limit=10):
+        """用少量UNION ALL查询（按绑定参数数量分组）获取多个设备各自最新的limit条数据（包含帧模式写入的数据），返回 {device_id: [数据]}"""
+        device_ids = list(set(device_ids))
+        result = {device_id: [] for device_id in device_ids}
+        channels = Channel.for_devices(device_ids)
+        if not channels:
+            return result
+        
+        readings = []
+        for query in cls.latest_queries(list(channels), limit):
+            readings.extend(cls._load_with_channels(query, channels))
+        readings.extend(SensorFrame.get_latest_for_devices(device_ids, channels, limit))
+        for reading in readings:
+            result[reading.device_id].append(reading)
+        return {device_id: cls._newest_first(items, limit) for device_id, items in result.items()}
+    
+    @classmethod
+    def get_page(cls, device_id, limit, sensor_type=None, start_time=None, end_time=None, cursor=None):
+        """按page_key倒序分页读取数据（包含帧模式写入和已归档的数据），返回 (数据, 下一页游标)；没有更多数据时游标为None
+
+        帧扫描达到上限时本页只包含扫描范围内的数据（可能少于limit条），下一页游标为扫描停止的位置；
+        归档只读取本页可能包含的时间范围：行和帧已凑满一页时从这一页最早的时间开始，通常不会读取任何数据块
+        """
+        channels = Channel.for_device(device_id, sensor_type)
+        if not channels:
+            return [], None
+        
+        # 多取一条判断是否还有下一页
+        rows = cls._load_with_channels(
+            cls.page_query(list(channels), limit + 1, start_time, end_time, cursor), channels
         )
-        if sensor_type:
-            query = query.filter_by(sensor_type=sensor_type)
-        return query.order_by(cls.timestamp.desc()).all()
+        frames, frames_stop = SensorFrame.get_page(device_id, channels, limit + 1, start_time, end_time, cursor)
+        readings = cls._newest_first(rows + frames)
+        if frames_stop is not None:
+            readings = [reading for reading in readings if cls.page_key(reading) > frames_stop]
+        
+        # 早于第limit+1条（或帧扫描停止位置）的归档读数不会进入本页
+        bounds = [start_time]
+        if len(readings) > limit:
+            bounds.append(readings[limit].timestamp)
+        if frames_stop is not None:
+            bounds.append(frames_stop[0])
+        lower = max((bound for bound in bounds if bound is not None), default=None)
+        archived = ArchiveSegment.get_page(channels, limit + 1, cls.page_key, lower, end_time, cursor)
+        if archived:
+            readings = cls._newest_first(readings + archived)
+            if frames_stop is not None:
+                readings = [reading for reading in readings if cls.page_key(reading) > frames_stop]
+        
+        page = readings[:limit]
+        if len(readings) > limit:
+            return page, cls.page_key(page[-1])
+        return page, frames_stop
     
     @classmethod
-    def get_average_value(cls, device_id, sensor_type, start_time, end_time):
-        """获取指定时间范围内的平均值"""
-        result = db.session.query(db.func.avg(cls.value)).filter(
-            cls.device_id == device_id,
-            cls.sensor_type == sensor_type,
-            cls.timestamp >= start_time,
-            cls.timestamp <= end_time
-        ).scalar()
-        return float(result) if result else None
+    def get_data_by_time_range(cls, device_id, start_time, end_time, sensor_type=None):
+        """根据时间范围获取数据（包含帧模式写入和已归档的数据）"""
+        channels = Channel.for_device(device_id, sensor_type)
+        if not channels:
+            return []
+        rows = cls._load_with_channels(cls.range_query(list(channels), start_time, end_time), channels)
+        others = SensorFrame.get_readings_by_time_range(device_id, channels, start_time, end_time)
+        others += ArchiveSegment.get_readings(channels, start_time, end_time)
+        return cls._newest_first(rows + others) if others else rows
+    
+    @classmethod
+    def iter_readings(cls, device_id, sensor_type=None, start_time=None, end_time=None, cursor=None, chunk_size=1000):
+        """按page_key倒序逐块读取cursor之后的所有数据，内存占用与总条数无关"""
+        while True:
+            page, cursor = cls.get_page(device_id, chunk_size, sensor_type, start_time, end_time, cursor)
+            yield from page
+            if cursor is None:
+                return
+    
+    @classmethod
+    def iter_export(cls, device_id=None, sensor_type=None, start_time=None, end_time=None, chunk_size=10000):
+        """以服务端游标逐块读取导出数据（包含帧模式写入和已归档的数据），内存占用与总条数无关
+        
+        每块为最多chunk_size条 (device_id, sensor_type, timestamp, value, unit)；按行存储的数据按 (通道, 时间) 顺序，
+        帧模式写入的数据在其后按 (设备, 时间) 顺序，已归档的数据最后按 (天, 通道, 时间) 顺序
+        """
+        channels = Channel.matching(device_id, sensor_type)
+        if not channels:
+            return
+        
+        query = db.select(cls.channel_id, cls.timestamp, cls.value)
+        if device_id or sensor_type:
+            query = query.where(cls.channel_id.in_(list(channels)))
+        if start_time:
+            query = query.where(cls.timestamp >= start_time)
+        if end_time:
+            query = query.where(cls.timestamp <= end_time)
+        # 与 (channel_id, timestamp, id, value) 索引顺序一致，无需排序
+        query = query.order_by(cls.channel_id, cls.timestamp, cls.id)
+        
+        result = db.session.execute(query.execution_options(stream_results=True, yield_per=chunk_size))
+        for partition in result.partitions():
+            # 导出开始后新建的通道不在本次导出范围内
+            yield [
+                (channel.device_id, channel.sensor_type, timestamp, value, channel.unit)
+                for channel, timestamp, value in (
+                    (channels.get(channel_id), timestamp, value) for channel_id, timestamp, value in partition
+                )
+                if channel is not None
+            ]
+        
+        yield from SensorFrame.iter_export(device_id, channels, start_time, end_time, chunk_size)
+        yield from ArchiveSegment.iter_export(channels, start_time, end_time, chunk_size)
+    
+    @classmethod
+    def _bucket_start(cls, seconds):
+        """时间桶起点（Unix秒）的SQL表达式"""
+        if db.engine.dialect.name == 'mysql':
+            epoch = db.func.timestampdiff(db.literal_column('SECOND'), '1970-01-01 00:00:00', cls.timestamp)
+        else:
+            epoch = db.cast(db.func.strftime('%s', cls.timestamp), db.Integer)
+        return (epoch // seconds) * seconds
+    
+    @classmethod
+    def _add_raw_buckets(cls, stats, device_id, channels, seconds, ranges, min_ids=None, with_last=False):
+        """在SQL中按 (通道, 时间桶) 聚合 [起点, 终点) 时间范围内的原始数据，并合并帧模式写入和已归档的数据
 
+        channels为None时读取所有通道；seconds为None时整个时间范围为一个桶；
+        指定min_ids（RollupWatermark.get_all）时只读取尚未压缩到汇总表的数据（归档前未压缩的数据块）
+        """
+        if not ranges:
+            return
+        conditions = [db.or_(*[db.and_(cls.timestamp >= start, cls.timestamp < stop) for start, stop in ranges])]
+        if channels is not None:
+            conditions.append(cls.channel_id.in_(list(channels)))
+        if min_ids:
+            conditions.append(cls.id > min_ids[ROWS_WATERMARK])
+        
+        if seconds:
+            bucket = cls._bucket_start(seconds).label('bucket')
+            group_by = (cls.channel_id, bucket)
+        else:
+            bucket = db.literal(0).label('bucket')
+            group_by = (cls.channel_id,)
+        grouped = db.session.query(
+            cls.channel_id,
+            bucket,
+            db.func.count(cls.value).label('count'),
+            db.func.sum(cls.value).label('sum'),
+            db.func.min(cls.value).label('min'),
+            db.func.max(cls.value).label('max'),
+            db.func.max(cls.timestamp).label('last_time')
+        ).filter(*conditions).group_by(*group_by)
+        
+        partial = {}
+        for row in grouped:
+            partial[(row.channel_id, int(row.bucket))] = [row.count, float(row.sum), row.min, row.max, None, row.last_time]
+        
+        # 每个桶最后一条数据：按桶内最大时间戳关联回sensor_data，同一时刻取id最大的一条
+        if with_last and partial:
+            latest = grouped.subquery()
+            last_rows = db.session.query(latest.c.channel_id, latest.c.bucket, cls.value).join(
+                latest, db.and_(cls.channel_id == latest.c.channel_id, cls.timestamp == latest.c.last_time)
+            ).order_by(cls.id)
+            for channel_id, bucket_start, value in last_rows:
+                partial[(channel_id, int(bucket_start))][4] = value
+        
+        for key, values in partial.items():
+            add_to_bucket(stats, key, *values)
+        
+        SensorFrame.add_to_buckets(
+            stats, device_id, channels, seconds, ranges, min_ids[FRAMES_WATERMARK] if min_ids else None
+        )
+        ArchiveSegment.add_to_buckets(stats, channels, seconds, ranges, uncompacted_only=bool(min_ids))
+    
+    @classmethod
+    def _aggregate(cls, device_id, channels, seconds, start_time, end_time, with_last=False):
+        """按时间桶聚合 [start_time, end_time] 内的读数，返回 {(channel_id, 桶起点): 统计}
+
+        与汇总粒度对齐的部分读取汇总表，再加上尚未压缩的数据；两端不对齐的部分读取原始数据
+
+        先读取压缩进度，再读取进度之后的原始数据和汇总表，最后确认进度未变：压缩线程在两次读取之间提交时，
+        部分读数可能同时计入或都未计入两边（SQLite和READ COMMITTED下每条语句看到的数据不同），需要重新读取
+        """
+        stop = end_time + END_INCLUSIVE
+        stats = {}
+        if not rollups_enabled():
+            cls._add_raw_buckets(stats, device_id, channels, seconds, [(start_time, stop)], with_last=with_last)
+            return stats
+        
+        segments = split_window(start_time, stop, seconds)
+        edges = [(start, end) for res, start, end in segments if res is None]
+        rolled = [segment for segment in segments if segment[0] is not None]
+        cls._add_raw_buckets(stats, device_id, channels, seconds, edges, with_last=with_last)
+        if not rolled:
+            return stats
+        
+        ranges = [(start, end) for _, start, end in rolled]
+        for _ in range(ROLLUP_READ_ATTEMPTS):
+            min_ids = RollupWatermark.get_all()
+            partial = {}
+            cls._add_raw_buckets(partial, device_id, channels, seconds, ranges, min_ids, with_last)
+            SensorRollup.add_to_buckets(partial, list(channels) if channels is not None else None, rolled, seconds)
+            if RollupWatermark.get_all() == min_ids:
+                merge_buckets(stats, partial)
+                return stats
+        
+        # 压缩进度持续推进，对齐部分也直接扫描原始数据
+        cls._add_raw_buckets(stats, device_id, channels, seconds, ranges, with_last=with_last)
+        return stats
+    
+    @classmethod
+    def get_buckets(cls, device_id, seconds, start_time, end_time, sensor_type=None, with_last=False):
+        """按时间桶聚合（包含帧模式写入的数据），返回 (通道字典, {(channel_id, 桶起点): 统计})"""
+        channels = Channel.for_device(device_id, sensor_type)
+        if not channels:
+            return {}, {}
+        return channels, cls._aggregate(device_id, channels, seconds, start_time, end_time, with_last)
+    
+    @classmethod
+    def get_channel_stats(cls, start_time, end_time, device_id=None, sensor_type=None):
+        """时间范围内每个通道的 count/sum/min/max，返回 (通道字典, {channel_id: 统计})；未指定设备时统计所有通道，通道字典为None"""
+        channels = None
+        if device_id is not None:
+            channels = Channel.for_device(device_id, sensor_type)
+            if not channels:
+                return {}, {}
+        stats = cls._aggregate(device_id, channels, None, start_time, end_time)
+        return channels, {channel_id: bucket for (channel_id, _), bucket in stats.items()}
@@ -0,0 +1,227 @@
+import struct
+from datetime import datetime
+from flask import current_app
+from sqlalchemy.orm.attributes import set_committed_value
+from src.models import db, union_all_chunks
+from src.models.channel import Channel
+from src.models.sensor_rollup import add_to_bucket, epoch_seconds
+
+# 帧内每个读数打包为 (通道ID: uint32, 数值: float64)
+FRAME_PAIR = struct.Struct('<Id')
+
+# 倒序扫描帧时每批读取的行数
+FRAME_SCAN_BATCH = 200
+
+# 分页时每次最多扫描的帧数；按传感器类型过滤且近期的帧中没有匹配读数时，不会扫描设备的全部历史
+FRAME_SCAN_MAX = 5000
+
+# 分页排序键中的数据来源，同一时刻按行存储的数据排在帧之前，归档的数据排在最后
+ROW_SOURCE = 1
+FRAME_SOURCE = 0
+ARCHIVE_SOURCE = -1
+
+
+def frames_enabled():
+    """是否以帧模式存储传感器数据"""
+    return current_app.config.get('SENSOR_STORAGE_MODE', 'rows') == 'frames'
+
+
+class SensorFrame(db.Model):
+    """传感器数据帧：同一设备同一时刻上传的所有读数合并为一行"""
+    __tablename__ = 'sensor_frames'
+    __table_args__ = (
+        db.Index('ix_sensor_frames_device_time', 'device_id', 'timestamp'),
+        db.Index('ix_sensor_frames_timestamp', 'timestamp'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    device_id = db.Column(db.String(50), db.ForeignKey('devices.device_id'), nullable=False)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    channel_count = db.Column(db.Integer, nullable=False)
+    
+    # 打包的 (channel_id, value) 数组，见FRAME_PAIR
+    payload = db.Column(db.LargeBinary, nullable=False)
+    
+    def __repr__(self):
+        return f'<SensorFrame {self.device_id}@{self.timestamp}: {self.channel_count} readings>'
+    
+    @staticmethod
+    def pack(pairs):
+        """将 (channel_id, value) 列表打包为二进制"""
+        return b''.join(FRAME_PAIR.pack(channel_id, value) for channel_id, value in pairs)
+    
+    @classmethod
+    def add_many(cls, rows, channel_ids):
+        """按 (device_id, timestamp) 将记录合并为帧写入（不提交）"""
+        frames = {}
+        for channel_id, row in zip(channel_ids, rows):
+            frames.setdefault((row['device_id'], row['timestamp']), []).append((channel_id, row['value']))
+        
+        db.session.execute(cls.__table__.insert(), [
+            {
+                'device_id': device_id,
+                'timestamp': timestamp,
+                'channel_count': len(pairs),
+                'payload': cls.pack(pairs)
+            }
+            for (device_id, timestamp), pairs in frames.items()
+        ])
+        return len(frames)
+    
+    @staticmethod
+    def make_reading(channel, value, timestamp, frame_id=None, frame_pos=0):
+        """构建不加入会话的SensorData对象，to_dict输出与按行存储一致（id为None）"""
+        from src.models.sensor_data import SensorData
+        reading = SensorData(channel_id=channel.id, value=value, timestamp=timestamp)
+        set_committed_value(reading, 'channel', channel)
+        reading.frame_id = frame_id
+        reading.frame_pos = frame_pos
+        return reading
+    
+    @classmethod
+    def _expand(cls, frame_id, timestamp, payload, channels):
+        """展开一帧中属于指定通道的读数"""
+        return [
+            cls.make_reading(channels[channel_id], value, timestamp, frame_id, pos)
+            for pos, (channel_id, value) in enumerate(FRAME_PAIR.iter_unpack(payload))
+            if channel_id in channels
+        ]
+    
+    @classmethod
+    def get_page(cls, device_id, channels, limit, start_time=None, end_time=None, cursor=None):
+        """按 (timestamp, id) 倒序展开帧，返回 (cursor之后属于channels的最多limit条读数, 扫描停止位置)
+
+        扫描FRAME_SCAN_MAX帧后仍不足limit条时停止，扫描停止位置为最后一帧的排序键（该帧已全部扫描），
+        下一页应从此处继续；扫描完所有帧时为None
+        """
+        query = db.select(cls.id, cls.timestamp, cls.payload).where(cls.device_id == device_id)
+        if start_time:
+            query = query.where(cls.timestamp >= start_time)
+        if end_time:
+            query = query.where(cls.timestamp <= end_time)
+        
+        last_frame_id, last_rank = None, None
+        if cursor:
+            timestamp, source, last_id, rank = cursor
+            if source == ROW_SOURCE:
+                # 同一时刻的帧排在按行存储的数据之后，尚未返回
+                query = query.where(cls.timestamp <= timestamp)
+            elif source == ARCHIVE_SOURCE:
+                # 同一时刻归档的数据排在帧之后，帧已经返回过
+                query = query.where(cls.timestamp < timestamp)
+            else:
+                query = query.where(db.or_(
+                    cls.timestamp < timestamp,
+                    db.and_(cls.timestamp == timestamp, cls.id <= last_id)
+                ))
+                last_frame_id, last_rank = last_id, rank
+        
+        readings = []
+        scanned = 0
+        stop_key = None
+        result = db.session.execute(
+            query.order_by(cls.timestamp.desc(), cls.id.desc()).limit(FRAME_SCAN_MAX).execution_options(
+                yield_per=FRAME_SCAN_BATCH
+            )
+        )
+        try:
+            for frame_id, timestamp, payload in result:
+                expanded = cls._expand(frame_id, timestamp, payload, channels)
+                if frame_id == last_frame_id:
+                    # 跳过游标所在帧中已经返回的读数
+                    expanded = [reading for reading in expanded if -reading.frame_pos < last_rank]
+                readings.extend(expanded)
+                if len(readings) >= limit:
+                    break
+                scanned += 1
+                if scanned >= FRAME_SCAN_MAX:
+                    # 帧内位置取负后小于所有读数，表示整帧已扫描
+                    stop_key = (timestamp, FRAME_SOURCE, frame_id, -(len(payload) // FRAME_PAIR.size))
+        finally:
+            result.close()
+        return readings[:limit], stop_key
+    
+    @classmethod
+    def latest_queries(cls, device_ids, limit):
+        """每个设备最新limit帧的查询：每个设备单独按 (device_id, timestamp) 索引倒序取limit帧后UNION ALL，不对设备的全部历史排序"""
+        per_device = [
+            db.select(cls.id).where(cls.device_id == device_id).order_by(
+                cls.timestamp.desc(), cls.id.desc()
+            ).limit(limit).subquery().select()
+            for device_id in device_ids
+        ]
+        return [
+            db.select(cls.id, cls.timestamp, cls.payload).join(top, cls.id == top.c.id)
+            for top in (union.subquery('top') for union in union_all_chunks(per_device))
+        ]
+    
+    @classmethod
+    def get_latest_for_devices(cls, device_ids, channels, limit):
+        """展开每个设备最新的limit帧中属于channels的读数（每帧至少包含一条读数）"""
+        readings = []
+        for statement in cls.latest_queries(device_ids, limit):
+            for frame_id, timestamp, payload in db.session.execute(statement):
+                readings.extend(cls._expand(frame_id, timestamp, payload, channels))
+        return readings
+    
+    @classmethod
+    def iter_export(cls, device_id, channels, start_time=None, end_time=None, chunk_size=10000):
+        """以服务端游标按 (设备, 时间) 顺序展开帧，每块最多chunk_size条 (device_id, sensor_type, timestamp, value, unit)"""
+        query = db.select(cls.timestamp, cls.payload)
+        if device_id:
+            query = query.where(cls.device_id == device_id)
+        if start_time:
+            query = query.where(cls.timestamp >= start_time)
+        if end_time:
+            query = query.where(cls.timestamp <= end_time)
+        query = query.order_by(cls.device_id, cls.timestamp, cls.id)
+        
+        chunk = []
+        result = db.session.execute(query.execution_options(stream_results=True, yield_per=chunk_size))
+        for timestamp, payload in result:
+            for channel_id, value in FRAME_PAIR.iter_unpack(payload):
+                channel = channels.get(channel_id)
+                if channel is not None:
+                    chunk.append((channel.device_id, channel.sensor_type, timestamp, value, channel.unit))
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+    
+    @classmethod
+    def get_readings_by_time_range(cls, device_id, channels, start_time, end_time):
+        """展开时间范围内的所有帧中属于channels的读数"""
+        frames = db.session.query(cls.id, cls.timestamp, cls.payload).filter(
+            cls.device_id == device_id,
+            cls.timestamp >= start_time,
+            cls.timestamp <= end_time
+        ).order_by(cls.timestamp.desc(), cls.id.desc()).all()
+        
+        readings = []
+        for frame_id, timestamp, payload in frames:
+            readings.extend(cls._expand(frame_id, timestamp, payload, channels))
+        return readings
+    
+    @classmethod
+    def add_to_buckets(cls, stats, device_id, channels, seconds, ranges, min_id=None):
+        """将 [起点, 终点) 时间范围内的帧展开后合并到SensorData.get_buckets的时间桶统计中
+
+        device_id和channels为None时读取所有设备的所有通道；seconds为None时整个时间范围为一个桶；
+        指定min_id时只读取ID大于它的帧（尚未压缩到汇总表的帧）
+        """
+        if not ranges:
+            return
+        query = db.session.query(cls.timestamp, cls.payload).filter(db.or_(*[
+            db.and_(cls.timestamp >= start, cls.timestamp < stop) for start, stop in ranges
+        ]))
+        if device_id is not None:
+            query = query.filter(cls.device_id == device_id)
+        if min_id:
+            query = query.filter(cls.id > min_id)
+        
+        for timestamp, payload in query.order_by(cls.timestamp, cls.id).yield_per(FRAME_SCAN_BATCH):
+            bucket_start = epoch_seconds(timestamp) // seconds * seconds if seconds else 0
+            for channel_id, value in FRAME_PAIR.iter_unpack(payload):
+                if channels is None or channel_id in channels:
+                    add_to_bucket(stats, (channel_id, bucket_start), 1, value, value, value, value, timestamp)
@@ -0,0 +1,206 @@
+import calendar
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy.dialects import mysql, sqlite
+from sqlalchemy.exc import IntegrityError
+from src.models import db
+
+# 汇总粒度（秒），从粗到细
+ROLLUP_RESOLUTIONS = (86400, 3600, 60)
+
+# 压缩进度的数据来源
+ROWS_WATERMARK = 'rows'
+FRAMES_WATERMARK = 'frames'
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def rollups_enabled():
+    """是否维护并读取汇总表"""
+    return current_app.config.get('ROLLUP_ENABLED', True)
+
+
+def epoch_seconds(timestamp):
+    """UTC时间对应的Unix秒（舍去微秒）"""
+    return calendar.timegm(timestamp.timetuple())
+
+
+def add_to_bucket(stats, key, count, total, minimum, maximum, last, last_time):
+    """将一组读数的 count/sum/min/max/last 合并到时间桶统计中"""
+    bucket = stats.get(key)
+    if bucket is None:
+        stats[key] = {
+            'count': count, 'sum': total, 'min': minimum, 'max': maximum,
+            'last_time': last_time, 'last': last
+        }
+        return
+    bucket['count'] += count
+    bucket['sum'] += total
+    bucket['min'] = min(bucket['min'], minimum)
+    bucket['max'] = max(bucket['max'], maximum)
+    if bucket['last_time'] is None or (last_time is not None and last_time >= bucket['last_time']):
+        bucket['last_time'] = last_time
+        bucket['last'] = last
+
+
+def merge_buckets(stats, other):
+    """将另一组时间桶统计合并到stats中"""
+    for key, bucket in other.items():
+        add_to_bucket(
+            stats, key, bucket['count'], bucket['sum'], bucket['min'], bucket['max'], bucket['last'], bucket['last_time']
+        )
+
+
+def _floor(timestamp, seconds):
+    return EPOCH + timedelta(seconds=epoch_seconds(timestamp) // seconds * seconds)
+
+
+def _ceil(timestamp, seconds):
+    floor = _floor(timestamp, seconds)
+    return floor if floor == timestamp else floor + timedelta(seconds=seconds)
+
+
+def split_window(start, stop, seconds=None):
+    """将 [start, stop) 拆分为 (粒度, 起点, 终点) 段，对齐部分尽量使用粗粒度汇总，粒度为None的边缘段需要读取原始数据
+    
+    seconds为查询的时间桶大小，只使用能整除它的汇总粒度，使每个汇总桶完整落在一个查询桶内
+    """
+    resolutions = [res for res in ROLLUP_RESOLUTIONS if not seconds or seconds % res == 0]
+    
+    def split(start, stop, resolutions):
+        for i, res in enumerate(resolutions):
+            aligned_start, aligned_stop = _ceil(start, res), _floor(stop, res)
+            if aligned_start < aligned_stop:
+                finer = resolutions[i + 1:]
+                return split(start, aligned_start, finer) + [(res, aligned_start, aligned_stop)] + split(aligned_stop, stop, finer)
+        return [(None, start, stop)] if start < stop else []
+    
+    return split(start, stop, resolutions)
+
+
+class RollupWatermark(db.Model):
+    """汇总表的压缩进度：已合并到汇总表的sensor_data / sensor_frames最大ID"""
+    __tablename__ = 'rollup_watermarks'
+    
+    source = db.Column(db.String(20), primary_key=True)
+    last_id = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    @classmethod
+    def get_all(cls):
+        """各数据来源的压缩进度，尚未压缩时为0"""
+        marks = dict(db.session.query(cls.source, cls.last_id).all())
+        return {source: marks.get(source, 0) for source in (ROWS_WATERMARK, FRAMES_WATERMARK)}
+    
+    @classmethod
+    def advance(cls, source, last_id, new_id):
+        """将进度从last_id推进到new_id（不提交）；其他进程已推进时返回False，调用方应回滚"""
+        if last_id == 0 and not db.session.get(cls, source):
+            try:
+                with db.session.begin_nested():
+                    db.session.add(cls(source=source, last_id=new_id, updated_at=datetime.utcnow()))
+            except IntegrityError:
+                return False
+            return True
+        result = db.session.execute(cls.__table__.update().where(
+            cls.source == source, cls.last_id == last_id
+        ).values(last_id=new_id, updated_at=datetime.utcnow()))
+        return result.rowcount == 1
+
+
+class SensorRollup(db.Model):
+    """按通道预聚合的分钟/小时/天汇总，由后台压缩线程增量维护"""
+    __tablename__ = 'sensor_rollups'
+    __table_args__ = (
+        # 统计接口不按通道过滤，按 (粒度, 时间) 范围扫描
+        db.Index('ix_sensor_rollups_resolution_time', 'resolution', 'bucket_start'),
+    )
+    
+    channel_id = db.Column(db.Integer, db.ForeignKey('channels.id'), primary_key=True)
+    resolution = db.Column(db.Integer, primary_key=True)
+    bucket_start = db.Column(db.DateTime, primary_key=True)
+    count = db.Column(db.Integer, nullable=False)
+    sum = db.Column(db.Float, nullable=False)
+    min = db.Column(db.Float, nullable=False)
+    max = db.Column(db.Float, nullable=False)
+    last = db.Column(db.Float)
+    last_time = db.Column(db.DateTime)
+    
+    def __repr__(self):
+        return f'<SensorRollup {self.channel_id}/{self.resolution}s@{self.bucket_start}: {self.count}>'
+    
+    @staticmethod
+    def accumulate(stats, channel_id, timestamp, value):
+        """将一条读数累加到各粒度的汇总桶中，键为 (channel_id, 粒度, 桶起点)"""
+        epoch = epoch_seconds(timestamp)
+        for res in ROLLUP_RESOLUTIONS:
+            bucket_start = EPOCH + timedelta(seconds=epoch // res * res)
+            add_to_bucket(stats, (channel_id, res, bucket_start), 1, value, value, value, value, timestamp)
+    
+    @classmethod
+    def merge(cls, stats):
+        """将accumulate得到的汇总增量合并到汇总表（不提交），已有的桶在数据库中原子累加"""
+        if not stats:
+            return 0
+        table = cls.__table__
+        values = [
+            {
+                'channel_id': channel_id, 'resolution': res, 'bucket_start': bucket_start,
+                'count': bucket['count'], 'sum': bucket['sum'], 'min': bucket['min'], 'max': bucket['max'],
+                'last': bucket['last'], 'last_time': bucket['last_time']
+            }
+            for (channel_id, res, bucket_start), bucket in stats.items()
+        ]
+        
+        if db.engine.dialect.name == 'mysql':
+            statement = mysql.insert(table)
+            new = statement.inserted
+            # MySQL按顺序执行赋值，last需要在last_time更新之前比较
+            statement = statement.on_duplicate_key_update([
+                ('last', db.case((new.last_time >= table.c.last_time, new.last), else_=table.c.last)),
+                ('last_time', db.func.greatest(table.c.last_time, new.last_time)),
+                ('count', table.c.count + new.count),
+                ('sum', table.c.sum + new.sum),
+                ('min', db.func.least(table.c.min, new.min)),
+                ('max', db.func.greatest(table.c.max, new.max)),
+            ])
+        else:
+            statement = sqlite.insert(table)
+            new = statement.excluded
+            statement = statement.on_conflict_do_update(
+                index_elements=['channel_id', 'resolution', 'bucket_start'],
+                set_={
+                    'last': db.case((new.last_time >= table.c.last_time, new.last), else_=table.c.last),
+                    'last_time': db.func.max(table.c.last_time, new.last_time),
+                    'count': table.c.count + new.count,
+                    'sum': table.c.sum + new.sum,
+                    'min': db.func.min(table.c.min, new.min),
+                    'max': db.func.max(table.c.max, new.max),
+                }
+            )
+        db.session.execute(statement, values)
+        return len(values)
+    
+    @classmethod
+    def add_to_buckets(cls, stats, channel_ids, segments, seconds=None):
+        """将汇总段中的汇总合并到查询的时间桶统计中（键为 (channel_id, 桶起点Unix秒)，seconds为None时整个时间范围为一个桶）
+        
+        channel_ids为None时读取所有通道；segments为split_window返回的汇总段
+        """
+        if not segments:
+            return
+        query = db.session.query(
+            cls.channel_id, cls.bucket_start, cls.count, cls.sum, cls.min, cls.max, cls.last, cls.last_time
+        ).filter(db.or_(*[
+            db.and_(cls.resolution == res, cls.bucket_start >= start, cls.bucket_start < stop)
+            for res, start, stop in segments
+        ]))
+        if channel_ids is not None:
+            query = query.filter(cls.channel_id.in_(channel_ids))
+        
+        for row in query:
+            bucket_start = epoch_seconds(row.bucket_start) // seconds * seconds if seconds else 0
+            add_to_bucket(
+                stats, (row.channel_id, bucket_start),
+                row.count, row.sum, row.min, row.max, row.last, row.last_time
+            )
@@ -0,0 +1,21 @@
+from flask import Blueprint, Response, request, jsonify
+from src.services.dashboard_snapshot import dashboard_snapshot
+
+dashboard_bp = Blueprint('dashboard', __name__)
+
+@dashboard_bp.route('/dashboard/snapshot', methods=['GET'])
+def get_dashboard_snapshot():
+    """仪表板快照：设备统计、设备列表和每个设备各传感器的最新读数（固定两条查询，短TTL缓存）"""
+    try:
+        body, etag = dashboard_snapshot.get()
+        
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = Response(body, mimetype='application/json')
+        response.set_etag(etag)
+        response.cache_control.private = True
+        response.cache_control.max_age = dashboard_snapshot.ttl
+        return response
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
@@ -1,11 +1,113 @@
-from flask import Blueprint, request, jsonify
+import json
+from flask import Blueprint, Response, request, jsonify, current_app, stream_with_context
 from datetime import datetime, timedelta
 from src.models import db
+from src.models.channel import Channel
+from src.models.current_value import CurrentValue
 from src.models.sensor_data import SensorData
 from src.models.device import Device
+from src.services.ingest_buffer import ingest_buffer
+from src.utils.compression import RequestBodyError
+from src.utils.export import EXPORT_FORMATS, ExportFormatError, check_format, encode_chunks
+from src.utils.pagination import encode_cursor, get_cursor, get_page_size, stream_page, wants_stream
+from src.utils.payload import ack_response, wants_minimal_response
+from src.utils.timestamps import parse_time
 
 data_bp = Blueprint('data', __name__)
 
+# 聚合查询支持的时间桶（秒）和聚合函数
+AGGREGATE_BUCKETS = {'1m': 60, '5m': 300, '1h': 3600, '1d': 86400}
+AGGREGATE_FUNCTIONS = ('avg', 'min', 'max', 'count', 'last')
+EPOCH = datetime(1970, 1, 1)
+
+def _build_reading_row(item):
+    """校验一条通用格式的传感器数据并构建待写入记录，返回 (记录, 错误信息列表)"""
+    if not isinstance(item, dict):
+        return None, ['Item must be an object']
+    
+    missing_fields = [field for field in ('device_id', 'sensor_type', 'value') if field not in item]
+    if missing_fields:
+        return None, [f'Missing field {field}' for field in missing_fields]
+    
+    if not isinstance(item['device_id'], str):
+        return None, ['Invalid device_id']
+    
+    try:
+        row = SensorData.build_row(
+            device_id=item['device_id'],
+            sensor_type=item['sensor_type'],
+            value=float(item['value']),
+            unit=item.get('unit'),
+            metadata=item.get('metadata')
+        )
+    except Exception as e:
+        return None, [str(e)]
+    return row, []
+
+def _write_readings(rows):
+    """在单个事务中写入一批已验证的记录，每个设备只更新一次在线状态"""
+    Device.touch_many(row['device_id'] for row in rows)
+    SensorData.add_many(rows)
+
+def _bucket_response(device_id, sensor_type, start_time, end_time):
+    """按时间桶聚合传感器数据，每个通道返回一个序列"""
+    bucket = request.args.get('bucket')
+    if bucket not in AGGREGATE_BUCKETS:
+        return jsonify({'success': False, 'error': f'bucket must be one of: {", ".join(AGGREGATE_BUCKETS)}'}), 400
+    
+    aggregates = [name.strip() for name in request.args.get('agg', 'avg').split(',') if name.strip()]
+    invalid = [name for name in aggregates if name not in AGGREGATE_FUNCTIONS]
+    if invalid or not aggregates:
+        return jsonify({'success': False, 'error': f'agg must be a list of: {", ".join(AGGREGATE_FUNCTIONS)}'}), 400
+    
+    # 未指定时间范围时默认最近24小时
+    if not start_time or not end_time:
+        end_time = datetime.utcnow()
+        start_time = end_time - timedelta(hours=24)
+    
+    seconds = AGGREGATE_BUCKETS[bucket]
+    max_buckets = current_app.config['DATA_QUERY_MAX_BUCKETS']
+    if (end_time - start_time).total_seconds() / seconds > max_buckets:
+        return jsonify({
+            'success': False,
+            'error': f'Time range contains more than {max_buckets} buckets, use a larger bucket'
+        }), 400
+    
+    channels, stats = SensorData.get_buckets(
+        device_id, seconds, start_time, end_time, sensor_type, with_last='last' in aggregates
+    )
+    
+    series = {}
+    for (channel_id, bucket_start), bucket_stats in sorted(stats.items(), key=lambda item: item[0][1]):
+        point = {'timestamp': (EPOCH + timedelta(seconds=bucket_start)).isoformat()}
+        for name in aggregates:
+            if name == 'avg':
+                point['avg'] = bucket_stats['sum'] / bucket_stats['count']
+            else:
+                point[name] = bucket_stats[name]
+        series.setdefault(channel_id, []).append(point)
+    
+    data = []
+    for channel_id, points in series.items():
+        channel = channels[channel_id]
+        data.append({
+            'sensor_type': channel.sensor_type,
+            'unit': channel.unit,
+            'metadata': channel.extra_data,
+            'points': points
+        })
+    
+    return jsonify({
+        'success': True,
+        'device_id': device_id,
+        'bucket': bucket,
+        'agg': aggregates,
+        'start_time': start_time.isoformat(),
+        'end_time': end_time.isoformat(),
+        'data': data,
+        'count': sum(len(item['points']) for item in data)
+    })
+
 @data_bp.route('/data', methods=['POST'])
 def add_sensor_data():
     """添加传感器数据（通用接口）"""
@@ -20,12 +122,30 @@ def add_sensor_data():
                 return jsonify({'success': False, 'error': f'Missing field: {field}'}), 400
         
         # 验证设备是否存在
-        device = Device.get_by_device_id(data['device_id'])
-        if not device:
+        if not Device.lookup(data['device_id']):
             return jsonify({'success': False, 'error': 'Device not found'}), 404
         
         # 更新设备状态为在线
-        device.update_status('online')
+        Device.mark_seen(data['device_id'])
+        
+        # 启用写缓冲或只需确认时不经过ORM，避免提交后刷新和序列化整行
+        minimal = wants_minimal_response()
+        if ingest_buffer.enabled or minimal:
+            row = SensorData.build_row(
+                device_id=data['device_id'],
+                sensor_type=data['sensor_type'],
+                value=float(data['value']),
+                unit=data.get('unit'),
+                metadata=data.get('metadata')
+            )
+            buffered = ingest_buffer.write([row])
+            if minimal:
+                return ack_response(202 if buffered else 201)
+            return jsonify({
+                'success': True,
+                'message': 'Data accepted' if buffered else 'Data added successfully',
+                'data': SensorData.row_to_dict(row)
+            }), 202 if buffered else 201
         
         # 添加传感器数据
         sensor_data = SensorData.add_data(
@@ -42,6 +162,8 @@ def add_sensor_data():
             'data': sensor_data.to_dict()
         }), 201
         
+    except RequestBodyError as e:
+        return jsonify({'success': False, 'error': str(e)}), e.status_code
     except ValueError as e:
         return jsonify({'success': False, 'error': 'Invalid value format'}), 400
     except Exception as e:
@@ -59,39 +181,40 @@ def add_batch_sensor_data():
         if not isinstance(data_list, list):
             return jsonify({'success': False, 'error': 'data_list must be an array'}), 400
         
-        added_data = []
         errors = []
+        pending = []
         
+        # 校验字段并构建记录（此阶段不访问数据库）
         for i, item in enumerate(data_list):
-            try:
-                required_fields = ['device_id', 'sensor_type', 'value']
-                for field in required_fields:
-                    if field not in item:
-                        errors.append(f'Item {i}: Missing field {field}')
-                        continue
-                
-                # 验证设备是否存在
-                device = Device.get_by_device_id(item['device_id'])
-                if not device:
-                    errors.append(f'Item {i}: Device {item["device_id"]} not found')
-                    continue
-                
-                # 添加传感器数据
-                sensor_data = SensorData.add_data(
-                    device_id=item['device_id'],
-                    sensor_type=item['sensor_type'],
-                    value=float(item['value']),
-                    unit=item.get('unit'),
-                    metadata=item.get('metadata')
-                )
-                added_data.append(sensor_data.to_dict())
-                
-                # 更新设备状态
-                device.update_status('online')
-                
-            except Exception as e:
-                errors.append(f'Item {i}: {str(e)}')
+            row, item_errors = _build_reading_row(item)
+            if item_errors:
+                errors.extend((i, f'Item {i}: {error}') for error in item_errors)
+                continue
+            pending.append((i, row))
+        
+        # 一次IN查询验证所有设备是否存在
+        devices = Device.lookup_many(row['device_id'] for _, row in pending)
+        
+        rows = []
+        for i, row in pending:
+            if row['device_id'] not in devices:
+                errors.append((i, f'Item {i}: Device {row["device_id"]} not found'))
+                continue
+            rows.append(row)
+        # 保持错误按条目顺序输出
+        errors = [message for _, message in sorted(errors, key=lambda error: error[0])]
         
+        # 单个事务写入全部数据，每个设备只更新一次在线状态
+        _write_readings(rows)
+        
+        if wants_minimal_response():
+            return ack_response(
+                added_count=len(rows),
+                error_count=len(errors),
+                errors=errors
+            )
+        
+        added_data = [SensorData.row_to_dict(row) for row in rows]
         return jsonify({
             'success': True,
             'message': f'Processed {len(data_list)} items',
@@ -101,9 +224,112 @@ def add_batch_sensor_data():
             'errors': errors
         })
         
+    except RequestBodyError as e:
+        return jsonify({'success': False, 'error': str(e)}), e.status_code
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@data_bp.route('/data/stream', methods=['POST'])
+def stream_sensor_data():
+    """流式添加传感器数据（NDJSON，每行一条与 /data 相同格式的记录，按批写入）"""
+    batch_size = current_app.config.get('STREAM_BATCH_SIZE', 500)
+    max_line_bytes = current_app.config.get('STREAM_MAX_LINE_BYTES', 65536)
+    max_errors = current_app.config.get('STREAM_MAX_ERRORS', 100)
+    
+    ranges = []
+    errors = []
+    totals = {'accepted': 0, 'rejected': 0}
+    batch = {'start_line': None, 'end_line': None, 'rejected': 0, 'rows': []}
+    
+    def reject(line_no, message):
+        batch['rejected'] += 1
+        if len(errors) < max_errors:
+            errors.append(f'Line {line_no}: {message}')
+    
+    def flush_batch():
+        """验证本批设备并写入，记录本批的行号范围和计数"""
+        if batch['start_line'] is None:
+            return
+        pending = batch['rows']
+        devices = Device.lookup_many(row['device_id'] for _, row in pending)
+        rows = []
+        for line_no, row in pending:
+            if row['device_id'] not in devices:
+                reject(line_no, f'Device {row["device_id"]} not found')
+                continue
+            rows.append(row)
+        _write_readings(rows)
+        
+        ranges.append({
+            'start_line': batch['start_line'],
+            'end_line': batch['end_line'],
+            'accepted': len(rows),
+            'rejected': batch['rejected']
+        })
+        totals['accepted'] += len(rows)
+        totals['rejected'] += batch['rejected']
+        batch.update({'start_line': None, 'end_line': None, 'rejected': 0, 'rows': []})
+    
+    try:
+        stream = request.stream
+        line_no = 0
+        while True:
+            line = stream.readline(max_line_bytes + 1)
+            if not line:
+                break
+            line_no += 1
+            
+            # 超长行：丢弃到行尾
+            too_long = len(line) > max_line_bytes
+            while line and not line.endswith(b'\n') and len(line) > max_line_bytes:
+                line = stream.readline(max_line_bytes + 1)
+            
+            if not too_long and not line.strip():
+                continue
+            
+            if batch['start_line'] is None:
+                batch['start_line'] = line_no
+            batch['end_line'] = line_no
+            
+            if too_long:
+                reject(line_no, f'Line exceeds {max_line_bytes} bytes')
+            else:
+                try:
+                    item = json.loads(line)
+                except ValueError:
+                    reject(line_no, 'Invalid JSON')
+                else:
+                    row, item_errors = _build_reading_row(item)
+                    if item_errors:
+                        reject(line_no, ', '.join(item_errors))
+                    else:
+                        batch['rows'].append((line_no, row))
+            
+            if batch['end_line'] - batch['start_line'] + 1 >= batch_size:
+                flush_batch()
+        
+        flush_batch()
+        
+        return jsonify({
+            'success': True,
+            'message': f'Processed {line_no} lines',
+            'accepted_count': totals['accepted'],
+            'rejected_count': totals['rejected'],
+            'ranges': ranges,
+            'errors': errors,
+            'errors_truncated': totals['rejected'] > len(errors)
+        })
+        
+    except Exception as e:
+        db.session.rollback()
+        # 已提交的批次保持有效，客户端可根据ranges从中断处续传
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'accepted_count': totals['accepted'],
+            'ranges': ranges
+        }), e.status_code if isinstance(e, RequestBodyError) else 500
+
 @data_bp.route('/data/query', methods=['GET'])
 def query_sensor_data():
     """查询传感器数据"""
@@ -112,32 +338,86 @@ def query_sensor_data():
         sensor_type = request.args.get('sensor_type')
         start_time = request.args.get('start_time')
         end_time = request.args.get('end_time')
-        limit = int(request.args.get('limit', 100))
+        limit = get_page_size(100)
         
         if not device_id:
             return jsonify({'success': False, 'error': 'device_id is required'}), 400
         
         # 验证设备是否存在
-        device = Device.get_by_device_id(device_id)
-        if not device:
+        if not Device.lookup(device_id):
             return jsonify({'success': False, 'error': 'Device not found'}), 404
         
+        try:
+            cursor = get_cursor()
+        except ValueError:
+            return jsonify({'success': False, 'error': 'Invalid cursor'}), 400
+        
+        start_dt = end_dt = None
         if start_time and end_time:
             # 时间范围查询
             try:
-                start_dt = datetime.fromisoformat(start_time.replace('Z', '+00:00'))
-                end_dt = datetime.fromisoformat(end_time.replace('Z', '+00:00'))
-                data = SensorData.get_data_by_time_range(device_id, start_dt, end_dt, sensor_type)
+                start_dt = parse_time(start_time)
+                end_dt = parse_time(end_time)
             except ValueError:
                 return jsonify({'success': False, 'error': 'Invalid datetime format'}), 400
-        else:
-            # 获取最新数据
-            data = SensorData.get_latest_data(device_id, sensor_type, limit)
+        
+        # bucket=1m|5m|1h|1d 时返回按时间桶聚合的序列
+        if request.args.get('bucket'):
+            return _bucket_response(device_id, sensor_type, start_dt, end_dt)
+        
+        # stream=1 时逐块查询并流式输出全部数据
+        if wants_stream():
+            readings = SensorData.iter_readings(
+                device_id, sensor_type, start_dt, end_dt, cursor,
+                chunk_size=current_app.config['DATA_QUERY_MAX_PAGE_SIZE']
+            )
+            return stream_page(readings, SensorData.page_key)
+        
+        # 按时间倒序分页，next_cursor为null时没有更多数据
+        data, next_key = SensorData.get_page(device_id, limit, sensor_type, start_dt, end_dt, cursor)
         
         return jsonify({
             'success': True,
             'data': [item.to_dict() for item in data],
-            'count': len(data)
+            'count': len(data),
+            'next_cursor': encode_cursor(next_key) if next_key else None
+        })
+        
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@data_bp.route('/data/export', methods=['GET'])
+def export_sensor_data():
+    """批量导出传感器数据（format=csv|parquet|arrow），以服务端游标逐块读取并流式编码"""
+    try:
+        fmt = request.args.get('format', 'csv')
+        device_id = request.args.get('device_id')
+        sensor_type = request.args.get('sensor_type')
+        
+        try:
+            check_format(fmt)
+        except ExportFormatError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        
+        if device_id and not Device.lookup(device_id):
+            return jsonify({'success': False, 'error': 'Device not found'}), 404
+        
+        try:
+            start_dt = parse_time(request.args['start_time']) if request.args.get('start_time') else None
+            end_dt = parse_time(request.args['end_time']) if request.args.get('end_time') else None
+        except ValueError:
+            return jsonify({'success': False, 'error': 'Invalid datetime format'}), 400
+        
+        chunks = SensorData.iter_export(
+            device_id, sensor_type, start_dt, end_dt,
+            chunk_size=current_app.config['EXPORT_CHUNK_SIZE']
+        )
+        mimetype, extension = EXPORT_FORMATS[fmt]
+        filename = f"sensor_data_{device_id or 'all'}.{extension}"
+        
+        # 响应头发出后出错时连接会被中断，客户端会收到不完整的传输
+        return Response(stream_with_context(encode_chunks(fmt, chunks)), mimetype=mimetype, headers={
+            'Content-Disposition': f'attachment; filename="{filename}"'
         })
         
     except Exception as e:
@@ -150,18 +430,19 @@ def get_latest_data():
         device_type = request.args.get('device_type')  # microbit, esp32
         
         # 获取设备列表
-        query = Device.query.filter_by(status='online')
-        if device_type:
-            query = query.filter_by(device_type=device_type)
-        devices = query.all()
+        devices = Device.get_online_devices(device_type)
+        
+        # 一次查询获取所有设备的最新数据，另一次查询获取每种传感器的最新值
+        device_ids = [device.device_id for device in devices]
+        latest = SensorData.get_latest_for_devices(device_ids, limit=5)
+        current_values = CurrentValue.for_devices(device_ids)
         
         result = {}
         for device in devices:
-            # 获取每个设备的最新数据
-            latest_data = SensorData.get_latest_data(device.device_id, limit=5)
             result[device.device_id] = {
                 'device_info': device.to_dict(),
-                'latest_data': [item.to_dict() for item in latest_data]
+                'latest_data': [item.to_dict() for item in latest[device.device_id]],
+                'current_values': current_values[device.device_id]
             }
         
         return jsonify({
@@ -181,37 +462,29 @@ def get_data_statistics():
         end_time = datetime.utcnow()
         start_time = end_time - timedelta(hours=hours)
         
-        # 统计总数据量
-        total_records = SensorData.query.filter(
-            SensorData.timestamp >= start_time,
-            SensorData.timestamp <= end_time
-        ).count()
-        
-        # 按设备类型统计
-        device_stats = db.session.query(
-            Device.device_type,
-            db.func.count(SensorData.id).label('record_count')
-        ).join(SensorData, Device.device_id == SensorData.device_id).filter(
-            SensorData.timestamp >= start_time,
-            SensorData.timestamp <= end_time
-        ).group_by(Device.device_type).all()
-        
-        # 按传感器类型统计
-        sensor_stats = db.session.query(
-            SensorData.sensor_type,
-            db.func.count(SensorData.id).label('record_count')
-        ).filter(
-            SensorData.timestamp >= start_time,
-            SensorData.timestamp <= end_time
-        ).group_by(SensorData.sensor_type).all()
+        # 对齐的整天/小时/分钟读取汇总表，只有两端不足一分钟的部分扫描原始数据
+        _, channel_stats = SensorData.get_channel_stats(start_time, end_time)
+        
+        total_records = 0
+        by_device_type = {}
+        by_sensor_type = {}
+        if channel_stats:
+            channel_types = db.session.query(Channel.id, Channel.sensor_type, Device.device_type).join(
+                Device, Device.device_id == Channel.device_id
+            ).filter(Channel.id.in_(list(channel_stats))).all()
+            for channel_id, sensor_type, device_type in channel_types:
+                count = channel_stats[channel_id]['count']
+                total_records += count
+                by_device_type[device_type] = by_device_type.get(device_type, 0) + count
+                by_sensor_type[sensor_type] = by_sensor_type.get(sensor_type, 0) + count
         
         return jsonify({
             'success': True,
             'time_range_hours': hours,
             'statistics': {
                 'total_records': total_records,
-                'by_device_type': {stat[0]: stat[1] for stat in device_stats},
-                'by_sensor_type': {stat[0]: stat[1] for stat in sensor_stats}
+                'by_device_type': by_device_type,
+                'by_sensor_type': by_sensor_type
             }
         })
         
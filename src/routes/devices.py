@@ -1,8 +1,10 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 from datetime import datetime, timedelta
-from src.models import db
 from src.models.device import Device
+from src.models.current_value import CurrentValue
 from src.models.sensor_data import SensorData
+from src.services.device_stats import device_stats
+from src.utils.pagination import encode_cursor, get_cursor, get_page_size, stream_page, wants_stream
 
 devices_bp = Blueprint('devices', __name__)
 
@@ -17,9 +19,9 @@ def get_devices():
         if device_type:
             query = query.filter_by(device_type=device_type)
         if status:
-            query = query.filter_by(status=status)
-            
-        devices = query.all()
+            devices = Device.filter_by_status(query, status)
+        else:
+            devices = query.all()
         return jsonify({
             'success': True,
             'data': [device.to_dict() for device in devices],
@@ -68,28 +70,41 @@ def update_device_status(device_id):
 def get_device_data(device_id):
     """获取设备传感器数据"""
     try:
-        device = Device.get_by_device_id(device_id)
-        if not device:
+        if not Device.lookup(device_id):
             return jsonify({'success': False, 'error': 'Device not found'}), 404
             
         # 获取查询参数
         sensor_type = request.args.get('sensor_type')
-        limit = int(request.args.get('limit', 50))
+        limit = get_page_size(50)
         hours = request.args.get('hours')  # 获取最近N小时的数据
         
+        try:
+            cursor = get_cursor()
+        except ValueError:
+            return jsonify({'success': False, 'error': 'Invalid cursor'}), 400
+        
+        start_time = end_time = None
         if hours:
             # 获取指定时间范围的数据
             end_time = datetime.utcnow()
             start_time = end_time - timedelta(hours=int(hours))
-            data = SensorData.get_data_by_time_range(device_id, start_time, end_time, sensor_type)
-        else:
-            # 获取最新数据
-            data = SensorData.get_latest_data(device_id, sensor_type, limit)
+        
+        # stream=1 时逐块查询并流式输出全部数据
+        if wants_stream():
+            readings = SensorData.iter_readings(
+                device_id, sensor_type, start_time, end_time, cursor,
+                chunk_size=current_app.config['DATA_QUERY_MAX_PAGE_SIZE']
+            )
+            return stream_page(readings, SensorData.page_key)
+        
+        # 按时间倒序分页，next_cursor为null时没有更多数据
+        data, next_key = SensorData.get_page(device_id, limit, sensor_type, start_time, end_time, cursor)
             
         return jsonify({
             'success': True,
             'data': [item.to_dict() for item in data],
-            'count': len(data)
+            'count': len(data),
+            'next_cursor': encode_cursor(next_key) if next_key else None
         })
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -98,26 +113,33 @@ def get_device_data(device_id):
 def get_device_data_summary(device_id):
     """获取设备数据统计摘要"""
     try:
-        device = Device.get_by_device_id(device_id)
-        if not device:
+        if not Device.lookup(device_id):
             return jsonify({'success': False, 'error': 'Device not found'}), 404
             
         hours = int(request.args.get('hours', 24))
         end_time = datetime.utcnow()
         start_time = end_time - timedelta(hours=hours)
         
-        # 获取所有传感器类型
-        sensor_types = db.session.query(SensorData.sensor_type).filter_by(device_id=device_id).distinct().all()
-        sensor_types = [st[0] for st in sensor_types]
+        # 一次读取所有通道在时间范围内的汇总，按传感器类型合并
+        channels, channel_stats = SensorData.get_channel_stats(start_time, end_time, device_id)
+        totals = {}
+        for channel in channels.values():
+            totals.setdefault(channel.sensor_type, [0.0, 0])
+        for channel_id, stats in channel_stats.items():
+            total = totals[channels[channel_id].sensor_type]
+            total[0] += stats['sum']
+            total[1] += stats['count']
+        
+        # 最新值直接读取current_values表
+        current_values = CurrentValue.for_device(device_id)
         
         summary = {}
-        for sensor_type in sensor_types:
-            avg_value = SensorData.get_average_value(device_id, sensor_type, start_time, end_time)
-            latest_data = SensorData.get_latest_data(device_id, sensor_type, 1)
-            
+        for sensor_type, (total, count) in totals.items():
+            current = current_values.get(sensor_type)
+            channel = channels.get(current.channel_id) if current else None
             summary[sensor_type] = {
-                'average': avg_value,
-                'latest': latest_data[0].to_dict() if latest_data else None
+                'average': total / count if count else None,
+                'latest': current.to_reading_dict(channel.extra_data if channel else None) if current else None
             }
             
         return jsonify({
@@ -133,19 +155,17 @@ def get_device_data_summary(device_id):
 def get_devices_stats():
     """获取设备统计信息"""
     try:
-        total_devices = Device.query.count()
-        online_devices = Device.query.filter_by(status='online').count()
-        microbit_devices = Device.query.filter_by(device_type='microbit').count()
-        esp32_devices = Device.query.filter_by(device_type='esp32').count()
+        # 与健康检查共享的缓存统计（一条条件聚合查询）
+        stats = device_stats.get()
         
         return jsonify({
             'success': True,
             'stats': {
-                'total_devices': total_devices,
-                'online_devices': online_devices,
-                'offline_devices': total_devices - online_devices,
-                'microbit_devices': microbit_devices,
-                'esp32_devices': esp32_devices
+                'total_devices': stats['total'],
+                'online_devices': stats['online'],
+                'offline_devices': stats['total'] - stats['online'],
+                'microbit_devices': stats['microbit'],
+                'esp32_devices': stats['esp32']
             }
         })
     except Exception as e:
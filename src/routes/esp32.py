@@ -1,11 +1,24 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, make_response
 from datetime import datetime
 from src.models import db
 from src.models.device import Device
+from src.models.current_value import CurrentValue
+from src.models.device_command import DeviceCommand
 from src.models.sensor_data import SensorData
+from src.services.command_notifier import command_notifier
+from src.services.ingest_buffer import ingest_buffer
+from src.utils.compression import RequestBodyError
+from src.utils.payload import UPLOAD_CONTENT_TYPES, ack_response, get_upload_data, wants_minimal_response
 
 esp32_bp = Blueprint('esp32', __name__)
 
+# 心跳写入配置的字段不递增配置版本，配置接口不返回这些字段（通过设备状态接口查看），保证ETag与响应内容一致
+HEARTBEAT_CONFIG_KEYS = ('system_info', 'last_heartbeat')
+
+def server_config(device):
+    """设备配置中由服务器端维护、受配置版本控制的部分"""
+    return {key: value for key, value in (device.get_config() or {}).items() if key not in HEARTBEAT_CONFIG_KEYS}
+
 @esp32_bp.route('/register', methods=['POST'])
 def register_esp32():
     """注册ESP32设备"""
@@ -65,7 +78,8 @@ def register_esp32():
             'message': 'ESP32 device registered successfully',
             'device': device.to_dict(),
             'server_time': datetime.utcnow().isoformat(),
-            'assigned_id': device_id
+            'assigned_id': device_id,
+            'upload_formats': UPLOAD_CONTENT_TYPES
         })
         
     except Exception as e:
@@ -87,22 +101,17 @@ def esp32_heartbeat():
         if not device_id:
             return jsonify({'success': False, 'error': 'device_id is required'}), 400
         
-        device = Device.get_by_device_id(device_id)
-        if not device:
+        if not Device.lookup(device_id):
             return jsonify({'success': False, 'error': 'Device not registered'}), 404
         
-        # 更新设备状态和系统信息
-        device.update_status('online')
-        
-        # 如果提供了系统信息，更新配置
+        # 更新设备状态和系统信息（记录在内存中，由在线状态跟踪器批量写回）
+        config_patch = None
         if system_info:
-            current_config = device.config or {}
-            current_config.update({
+            config_patch = {
                 'system_info': system_info,
                 'last_heartbeat': datetime.utcnow().isoformat()
-            })
-            device.config = current_config
-            db.session.commit()
+            }
+        Device.mark_seen(device_id, config_patch)
         
         return jsonify({
             'success': True,
@@ -119,22 +128,23 @@ def esp32_heartbeat():
 def upload_esp32_data():
     """上传ESP32传感器数据"""
     try:
-        data = request.get_json() or {}
+        data = get_upload_data()
         
         device_id = data.get('device_id')
         if not device_id:
             return jsonify({'success': False, 'error': 'device_id is required'}), 400
         
         # 验证设备
-        device = Device.get_by_device_id(device_id)
+        device = Device.lookup(device_id)
         if not device or device.device_type != 'esp32':
             return jsonify({'success': False, 'error': 'Invalid ESP32 device'}), 404
         
         # 更新设备状态
-        device.update_status('online')
+        Device.mark_seen(device_id)
         
-        # 处理传感器数据
-        added_data = []
+        # 处理传感器数据（同一次上传的读数使用相同时间戳，帧模式下合并为一帧）
+        rows = []
+        timestamp = datetime.utcnow()
         
         # 环境传感器数据
         sensor_mappings = {
@@ -148,87 +158,96 @@ def upload_esp32_data():
         
         for sensor_type, unit in sensor_mappings.items():
             if sensor_type in data:
-                sensor_data = SensorData.add_data(
+                rows.append(SensorData.build_row(
                     device_id=device_id,
                     sensor_type=sensor_type,
                     value=float(data[sensor_type]),
-                    unit=unit
-                )
-                added_data.append(sensor_data.to_dict())
+                    unit=unit,
+                    timestamp=timestamp
+                ))
         
         # 运动传感器
         if 'motion' in data:
-            sensor_data = SensorData.add_data(
+            rows.append(SensorData.build_row(
                 device_id=device_id,
                 sensor_type='motion',
                 value=1 if data['motion'] else 0,
-                unit='bool'
-            )
-            added_data.append(sensor_data.to_dict())
+                unit='bool',
+                timestamp=timestamp
+            ))
         
         # 距离传感器
         if 'distance' in data:
-            sensor_data = SensorData.add_data(
+            rows.append(SensorData.build_row(
                 device_id=device_id,
                 sensor_type='distance',
                 value=float(data['distance']),
-                unit='cm'
-            )
-            added_data.append(sensor_data.to_dict())
+                unit='cm',
+                timestamp=timestamp
+            ))
         
         # 模拟输入
         if 'analog_inputs' in data and isinstance(data['analog_inputs'], dict):
             for pin, value in data['analog_inputs'].items():
-                sensor_data = SensorData.add_data(
+                rows.append(SensorData.build_row(
                     device_id=device_id,
                     sensor_type=f'analog_pin_{pin}',
                     value=float(value),
                     unit='V',
-                    metadata={'pin': pin, 'type': 'analog_input'}
-                )
-                added_data.append(sensor_data.to_dict())
+                    metadata={'pin': pin, 'type': 'analog_input'},
+                    timestamp=timestamp
+                ))
         
         # 数字输入
         if 'digital_inputs' in data and isinstance(data['digital_inputs'], dict):
             for pin, value in data['digital_inputs'].items():
-                sensor_data = SensorData.add_data(
+                rows.append(SensorData.build_row(
                     device_id=device_id,
                     sensor_type=f'digital_pin_{pin}',
                     value=1 if value else 0,
                     unit='bool',
-                    metadata={'pin': pin, 'type': 'digital_input'}
-                )
-                added_data.append(sensor_data.to_dict())
+                    metadata={'pin': pin, 'type': 'digital_input'},
+                    timestamp=timestamp
+                ))
         
         # 系统状态
         if 'system_status' in data:
             status = data['system_status']
             if 'free_heap' in status:
-                sensor_data = SensorData.add_data(
+                rows.append(SensorData.build_row(
                     device_id=device_id,
                     sensor_type='free_heap',
                     value=float(status['free_heap']),
-                    unit='bytes'
-                )
-                added_data.append(sensor_data.to_dict())
+                    unit='bytes',
+                    timestamp=timestamp
+                ))
             
             if 'wifi_rssi' in status:
-                sensor_data = SensorData.add_data(
+                rows.append(SensorData.build_row(
                     device_id=device_id,
                     sensor_type='wifi_rssi',
                     value=float(status['wifi_rssi']),
-                    unit='dBm'
-                )
-                added_data.append(sensor_data.to_dict())
+                    unit='dBm',
+                    timestamp=timestamp
+                ))
+        
+        # 同一次上传的数据合并写入（启用写缓冲时进入组提交队列）
+        ingest_buffer.write(rows)
+        
+        # 设备客户端默认只返回精简确认
+        if wants_minimal_response(default=True):
+            return ack_response(data_count=len(rows))
         
         return jsonify({
             'success': True,
-            'message': f'Uploaded {len(added_data)} sensor readings',
+            'message': f'Uploaded {len(rows)} sensor readings',
             'device_id': device_id,
-            'data_count': len(added_data),
+            'data_count': len(rows),
             'server_time': datetime.utcnow().isoformat()
         })
         
+    except RequestBodyError as e:
+        return jsonify({'success': False, 'error': str(e)}), e.status_code
     except ValueError as e:
         return jsonify({'success': False, 'error': 'Invalid data format'}), 400
     except Exception as e:
@@ -247,7 +266,7 @@ def control_esp32():
             return jsonify({'success': False, 'error': 'device_id and action are required'}), 400
         
         # 验证设备
-        device = Device.get_by_device_id(device_id)
+        device = Device.lookup(device_id)
         if not device or device.device_type != 'esp32':
             return jsonify({'success': False, 'error': 'Invalid ESP32 device'}), 404
         
@@ -276,17 +295,19 @@ def control_esp32():
             if param not in data:
                 return jsonify({'success': False, 'error': f'Missing parameter: {param}'}), 400
         
-        # 构建控制命令
+        # 写入设备命令队列，并唤醒正在长轮询该设备命令的请求
+        parameters = {param: data[param] for param in required_params if param in data}
+        command = DeviceCommand.enqueue(device_id, action, parameters)
+        command_notifier.notify(device_id)
+        
         control_data = {
+            'command_id': command.id,
             'action': action,
-            'timestamp': datetime.utcnow().isoformat(),
+            'timestamp': command.created_at.isoformat(),
             'device_id': device_id,
-            'parameters': {param: data[param] for param in required_params if param in data}
+            'parameters': parameters
         }
         
-        # 在实际应用中，这里可以通过MQTT、WebSocket或其他方式将命令推送给ESP32
-        # 目前返回命令信息供ESP32轮询获取
-        
         return jsonify({
             'success': True,
             'message': f'Control command "{action}" queued for device',
@@ -296,43 +317,119 @@ def control_esp32():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@esp32_bp.route('/config/<device_id>', methods=['GET', 'PUT'])
-def esp32_config(device_id):
-    """获取或更新ESP32设备配置"""
+@esp32_bp.route('/commands/<device_id>', methods=['GET', 'POST'])
+def poll_esp32_commands(device_id):
+    """长轮询ESP32设备的待处理命令
+    
+    查询参数 wait 为最长等待秒数（默认0，不超过COMMAND_MAX_WAIT），没有命令时请求会挂起到有命令或超时；
+    ack 为上一批已执行命令的ID（逗号分隔，POST时也可在JSON的ack列表中提供），在查询前批量确认。
+    未确认的命令会在下一次轮询时重新下发。同时挂起的请求达到COMMAND_MAX_WAITERS个时立即返回空列表和retry_after。
+    """
     try:
-        device = Device.get_by_device_id(device_id)
-        if not device or device.device_type != 'esp32':
+        info = Device.lookup(device_id)
+        if not info or info.device_type != 'esp32':
             return jsonify({'success': False, 'error': 'Invalid ESP32 device'}), 404
         
-        if request.method == 'GET':
-            # 获取配置
+        wait = request.args.get('wait', 0, type=float) or 0
+        
+        ack_ids = [int(command_id) for command_id in request.args.get('ack', '').split(',') if command_id.strip()]
+        if request.method == 'POST':
+            data = request.get_json(silent=True) or {}
+            ack_ids.extend(int(command_id) for command_id in data.get('ack', []))
+        
+        acked = DeviceCommand.ack_many(device_id, ack_ids)
+        
+        # 长轮询本身说明设备在线
+        Device.mark_seen(device_id)
+        
+        commands = command_notifier.poll(
+            device_id,
+            lambda: DeviceCommand.get_pending(device_id, command_notifier.batch_size),
+            wait
+        )
+        if commands is None:
+            # 挂起的长轮询已达上限：立即返回空列表，设备在retry_after秒后再轮询
             return jsonify({
                 'success': True,
                 'device_id': device_id,
-                'config': device.config or {},
+                'commands': [],
+                'count': 0,
+                'acked': acked,
+                'retry_after': command_notifier.recheck_interval,
                 'server_time': datetime.utcnow().isoformat()
             })
         
-        elif request.method == 'PUT':
-            # 更新配置
-            data = request.get_json() or {}
-            new_config = data.get('config', {})
-            
-            # 合并配置
-            current_config = device.config or {}
-            current_config.update(new_config)
-            current_config['last_config_update'] = datetime.utcnow().isoformat()
+        delivered = DeviceCommand.mark_delivered(commands)
+        
+        return jsonify({
+            'success': True,
+            'device_id': device_id,
+            'commands': delivered,
+            'count': len(delivered),
+            'acked': acked,
+            'server_time': datetime.utcnow().isoformat()
+        })
+        
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid command id in ack'}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@esp32_bp.route('/config/<device_id>', methods=['GET', 'PUT'])
+def esp32_config(device_id):
+    """获取或更新ESP32设备配置"""
+    try:
+        info = Device.lookup(device_id)
+        if not info or info.device_type != 'esp32':
+            return jsonify({'success': False, 'error': 'Invalid ESP32 device'}), 404
+        
+        if request.method == 'GET':
+            # 配置版本未变化时返回304，只查询版本列，不加载和序列化配置
+            version = Device.get_config_version(device_id)
+            if version is not None and request.if_none_match.contains_weak(str(version)):
+                response = make_response('', 304)
+                response.set_etag(str(version), weak=True)
+                return response
             
-            device.config = current_config
-            device.updated_at = datetime.utcnow()
-            db.session.commit()
+            device = Device.get_by_device_id(device_id)
+            if not device:
+                return jsonify({'success': False, 'error': 'Invalid ESP32 device'}), 404
             
-            return jsonify({
+            # 获取配置
+            response = jsonify({
                 'success': True,
-                'message': 'Configuration updated',
                 'device_id': device_id,
-                'config': device.config
+                'config': server_config(device),
+                'config_version': device.config_version,
+                'server_time': datetime.utcnow().isoformat()
             })
+            response.set_etag(str(device.config_version), weak=True)
+            return response
+        
+        # 更新配置
+        device = Device.get_by_device_id(device_id)
+        if not device:
+            return jsonify({'success': False, 'error': 'Invalid ESP32 device'}), 404
+        
+        data = request.get_json() or {}
+        new_config = data.get('config', {})
+        
+        # 合并配置
+        current_config = dict(device.get_config() or {})
+        current_config.update(new_config)
+        current_config['last_config_update'] = datetime.utcnow().isoformat()
+        
+        device.update_config(current_config)
+        
+        response = jsonify({
+            'success': True,
+            'message': 'Configuration updated',
+            'device_id': device_id,
+            'config': server_config(device),
+            'config_version': device.config_version
+        })
+        response.set_etag(str(device.config_version), weak=True)
+        return response
             
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -345,25 +442,16 @@ def get_esp32_status(device_id):
         if not device or device.device_type != 'esp32':
             return jsonify({'success': False, 'error': 'Invalid ESP32 device'}), 404
         
-        # 获取最新传感器数据
-        latest_data = SensorData.get_latest_data(device_id, limit=20)
-        
-        # 按传感器类型组织数据
+        # 每种传感器的最新值（current_values表一次主键范围查询）
         sensor_readings = {}
         system_status = {}
         
-        for data_point in latest_data:
-            reading_info = {
-                'value': data_point.value,
-                'unit': data_point.unit,
-                'timestamp': data_point.timestamp.isoformat()
-            }
-            
+        for sensor_type, current in CurrentValue.for_device(device_id).items():
             # 区分系统状态和传感器数据
-            if data_point.sensor_type in ['free_heap', 'wifi_rssi']:
-                system_status[data_point.sensor_type] = reading_info
+            if sensor_type in ['free_heap', 'wifi_rssi']:
+                system_status[sensor_type] = current.to_dict()
             else:
-                sensor_readings[data_point.sensor_type] = reading_info
+                sensor_readings[sensor_type] = current.to_dict()
         
         return jsonify({
             'success': True,
@@ -382,12 +470,13 @@ def list_esp32_devices():
     try:
         devices = Device.query.filter_by(device_type='esp32').all()
         
+        # 一次查询获取所有设备的最新数据
+        latest = SensorData.get_latest_for_devices([device.device_id for device in devices], limit=10)
+        
         device_list = []
         for device in devices:
             device_info = device.to_dict()
-            # 添加最新数据
-            latest_data = SensorData.get_latest_data(device.device_id, limit=10)
-            device_info['latest_readings'] = [data.to_dict() for data in latest_data]
+            device_info['latest_readings'] = [data.to_dict() for data in latest[device.device_id]]
             device_list.append(device_info)
         
         return jsonify({
@@ -417,13 +506,11 @@ def esp32_firmware_update():
             return jsonify({'success': False, 'error': 'Invalid ESP32 device'}), 404
         
         # 更新固件版本信息
-        current_config = device.config or {}
+        current_config = dict(device.get_config() or {})
         current_config['firmware_version'] = firmware_version
         current_config['last_firmware_update'] = datetime.utcnow().isoformat()
         
-        device.config = current_config
-        device.updated_at = datetime.utcnow()
-        db.session.commit()
+        device.update_config(current_config)
         
         return jsonify({
             'success': True,
@@ -2,7 +2,11 @@ from flask import Blueprint, request, jsonify
 from datetime import datetime
 from src.models import db
 from src.models.device import Device
+from src.models.current_value import CurrentValue
 from src.models.sensor_data import SensorData
+from src.services.ingest_buffer import ingest_buffer
+from src.utils.compression import RequestBodyError
+from src.utils.payload import UPLOAD_CONTENT_TYPES, ack_response, get_upload_data, wants_minimal_response
 
 microbit_bp = Blueprint('microbit', __name__)
 
@@ -48,7 +52,8 @@ def register_microbit():
             'success': True,
             'message': 'Device registered successfully',
             'device': device.to_dict(),
-            'server_time': datetime.utcnow().isoformat()
+            'server_time': datetime.utcnow().isoformat(),
+            'upload_formats': UPLOAD_CONTENT_TYPES
         })
         
     except Exception as e:
@@ -68,12 +73,11 @@ def microbit_heartbeat():
         if not device_id:
             return jsonify({'success': False, 'error': 'device_id is required'}), 400
         
-        device = Device.get_by_device_id(device_id)
-        if not device:
+        if not Device.lookup(device_id):
             return jsonify({'success': False, 'error': 'Device not registered'}), 404
         
         # 更新设备状态
-        device.update_status('online')
+        Device.mark_seen(device_id)
         
         return jsonify({
             'success': True,
@@ -89,42 +93,43 @@ def microbit_heartbeat():
 def upload_microbit_data():
     """上传micro:bit传感器数据"""
     try:
-        data = request.get_json() or {}
+        data = get_upload_data()
         
         device_id = data.get('device_id')
         if not device_id:
             return jsonify({'success': False, 'error': 'device_id is required'}), 400
         
         # 验证设备
-        device = Device.get_by_device_id(device_id)
+        device = Device.lookup(device_id)
         if not device or device.device_type != 'microbit':
             return jsonify({'success': False, 'error': 'Invalid micro:bit device'}), 404
         
         # 更新设备状态
-        device.update_status('online')
+        Device.mark_seen(device_id)
         
-        # 处理传感器数据
-        added_data = []
+        # 处理传感器数据（同一次上传的读数使用相同时间戳，帧模式下合并为一帧）
+        rows = []
+        timestamp = datetime.utcnow()
         
         # 温度数据
         if 'temperature' in data:
-            sensor_data = SensorData.add_data(
+            rows.append(SensorData.build_row(
                 device_id=device_id,
                 sensor_type='temperature',
                 value=float(data['temperature']),
-                unit='°C'
-            )
-            added_data.append(sensor_data.to_dict())
+                unit='°C',
+                timestamp=timestamp
+            ))
         
         # 光照数据
         if 'light' in data:
-            sensor_data = SensorData.add_data(
+            rows.append(SensorData.build_row(
                 device_id=device_id,
                 sensor_type='light',
                 value=float(data['light']),
-                unit='lux'
-            )
-            added_data.append(sensor_data.to_dict())
+                unit='lux',
+                timestamp=timestamp
+            ))
         
         # 加速度计数据
         if 'accelerometer' in data:
@@ -133,60 +138,69 @@ def upload_microbit_data():
                 # 分别存储X, Y, Z轴数据
                 for axis in ['x', 'y', 'z']:
                     if axis in accel_data:
-                        sensor_data = SensorData.add_data(
+                        rows.append(SensorData.build_row(
                             device_id=device_id,
                             sensor_type=f'accelerometer_{axis}',
                             value=float(accel_data[axis]),
-                            unit='g'
-                        )
-                        added_data.append(sensor_data.to_dict())
+                            unit='g',
+                            timestamp=timestamp
+                        ))
             else:
                 # 存储加速度计总值
-                sensor_data = SensorData.add_data(
+                rows.append(SensorData.build_row(
                     device_id=device_id,
                     sensor_type='accelerometer',
                     value=float(accel_data),
-                    unit='g'
-                )
-                added_data.append(sensor_data.to_dict())
+                    unit='g',
+                    timestamp=timestamp
+                ))
         
         # 指南针数据
         if 'compass' in data:
-            sensor_data = SensorData.add_data(
+            rows.append(SensorData.build_row(
                 device_id=device_id,
                 sensor_type='compass',
                 value=float(data['compass']),
-                unit='°'
-            )
-            added_data.append(sensor_data.to_dict())
+                unit='°',
+                timestamp=timestamp
+            ))
         
         # 按钮状态
         if 'button_a' in data:
-            sensor_data = SensorData.add_data(
+            rows.append(SensorData.build_row(
                 device_id=device_id,
                 sensor_type='button_a',
                 value=1 if data['button_a'] else 0,
-                unit='bool'
-            )
-            added_data.append(sensor_data.to_dict())
+                unit='bool',
+                timestamp=timestamp
+            ))
         
         if 'button_b' in data:
-            sensor_data = SensorData.add_data(
+            rows.append(SensorData.build_row(
                 device_id=device_id,
                 sensor_type='button_b',
                 value=1 if data['button_b'] else 0,
-                unit='bool'
-            )
-            added_data.append(sensor_data.to_dict())
+                unit='bool',
+                timestamp=timestamp
+            ))
+        
+        # 同一次上传的数据合并写入（启用写缓冲时进入组提交队列）
+        ingest_buffer.write(rows)
+        
+        # 设备客户端默认只返回精简确认
+        if wants_minimal_response(default=True):
+            return ack_response(data_count=len(rows))
         
         return jsonify({
             'success': True,
-            'message': f'Uploaded {len(added_data)} sensor readings',
+            'message': f'Uploaded {len(rows)} sensor readings',
             'device_id': device_id,
-            'data_count': len(added_data),
+            'data_count': len(rows),
             'server_time': datetime.utcnow().isoformat()
         })
         
+    except RequestBodyError as e:
+        return jsonify({'success': False, 'error': str(e)}), e.status_code
     except ValueError as e:
         return jsonify({'success': False, 'error': 'Invalid data format'}), 400
     except Exception as e:
@@ -205,7 +219,7 @@ def send_microbit_command():
             return jsonify({'success': False, 'error': 'device_id and command are required'}), 400
         
         # 验证设备
-        device = Device.get_by_device_id(device_id)
+        device = Device.lookup(device_id)
         if not device or device.device_type != 'microbit':
             return jsonify({'success': False, 'error': 'Invalid micro:bit device'}), 404
         
@@ -258,17 +272,11 @@ def get_microbit_status(device_id):
         if not device or device.device_type != 'microbit':
             return jsonify({'success': False, 'error': 'Invalid micro:bit device'}), 404
         
-        # 获取最新传感器数据
-        latest_data = SensorData.get_latest_data(device_id, limit=10)
-        
-        # 按传感器类型组织数据
-        sensor_readings = {}
-        for data_point in latest_data:
-            sensor_readings[data_point.sensor_type] = {
-                'value': data_point.value,
-                'unit': data_point.unit,
-                'timestamp': data_point.timestamp.isoformat()
-            }
+        # 每种传感器的最新值（current_values表一次主键范围查询）
+        sensor_readings = {
+            sensor_type: current.to_dict()
+            for sensor_type, current in CurrentValue.for_device(device_id).items()
+        }
         
         return jsonify({
             'success': True,
@@ -286,12 +294,13 @@ def list_microbit_devices():
     try:
         devices = Device.query.filter_by(device_type='microbit').all()
         
+        # 一次查询获取所有设备的最新数据
+        latest = SensorData.get_latest_for_devices([device.device_id for device in devices], limit=5)
+        
         device_list = []
         for device in devices:
             device_info = device.to_dict()
-            # 添加最新数据
-            latest_data = SensorData.get_latest_data(device.device_id, limit=5)
-            device_info['latest_readings'] = [data.to_dict() for data in latest_data]
+            device_info['latest_readings'] = [data.to_dict() for data in latest[device.device_id]]
             device_list.append(device_info)
         
         return jsonify({
@@ -0,0 +1,55 @@
+from flask import Blueprint, Response, request, jsonify
+from src.models.device import Device
+from src.services.live_stream import live_stream
+
+stream_bp = Blueprint('stream', __name__)
+
+def _sse_event(event, data):
+    """编码一条SSE事件（data为已编码的JSON字符串）"""
+    return f'event: {event}\ndata: {data}\n\n'
+
+@stream_bp.route('/readings', methods=['GET'])
+def stream_readings():
+    """以Server-Sent Events推送新写入的传感器读数
+    
+    可选查询参数 device_id、sensor_type 过滤读数。每条读数为一个 reading 事件，
+    连接消费过慢导致读数被丢弃时发送 dropped 事件，空闲时定期发送注释行保持连接。
+    """
+    if not live_stream.enabled:
+        return jsonify({'success': False, 'error': 'Live stream is disabled'}), 503
+    
+    device_id = request.args.get('device_id') or None
+    sensor_type = request.args.get('sensor_type') or None
+    
+    if device_id and not Device.lookup(device_id):
+        return jsonify({'success': False, 'error': 'Device not found'}), 404
+    
+    subscription = live_stream.subscribe(device_id, sensor_type)
+    if subscription is None:
+        return jsonify({'success': False, 'error': 'Too many stream subscribers'}), 503
+    
+    keepalive = live_stream.keepalive
+    
+    def generate():
+        try:
+            # 断线后浏览器3秒后自动重连
+            yield 'retry: 3000\n\n'
+            while not subscription.closed:
+                messages, dropped = subscription.get_batch(keepalive)
+                if dropped:
+                    yield _sse_event('dropped', f'{{"count": {dropped}}}')
+                if messages:
+                    yield ''.join(_sse_event('reading', message) for message in messages)
+                elif not dropped:
+                    yield ': keepalive\n\n'
+        finally:
+            live_stream.unsubscribe(subscription)
+    
+    # 生成器不使用请求上下文，数据库会话在返回响应时即释放
+    response = Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    # 连接在生成器开始执行前关闭时也取消订阅
+    response.call_on_close(lambda: live_stream.unsubscribe(subscription))
+    return response
@@ -0,0 +1,210 @@
+"""
+传感器数据冷归档
+后台线程按天将早于ARCHIVE_AFTER_DAYS的sensor_data和sensor_frames移入本地压缩列式文件，
+archive_segments清单与删除原始数据在同一事务中提交，查询时透明合并热数据和归档数据
+"""
+import atexit
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from src.models import db
+from src.models.sensor_archive import ArchiveSegment, archive_root
+from src.models.sensor_data import SensorData
+from src.models.sensor_frame import FRAME_PAIR, SensorFrame
+from src.models.sensor_rollup import FRAMES_WATERMARK, ROWS_WATERMARK, RollupWatermark, rollups_enabled
+
+# 删除已归档数据时每条语句的ID数量
+ARCHIVE_DELETE_CHUNK = 1000
+
+
+class SensorArchiver:
+    """冷数据归档：每批最多读取一天的batch_size行，写入一个归档文件后删除原始数据"""
+    
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = False
+        self.after_days = 30
+        self.interval = 3600
+        self.batch_size = 100000
+        
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._stats = {
+            'runs': 0,
+            'rows_archived': 0,
+            'frames_archived': 0,
+            'readings_archived': 0,
+            'files_written': 0,
+            'bytes_written': 0,
+            'conflicts': 0,
+            'last_run_ms': 0.0,
+            'max_run_ms': 0.0
+        }
+        
+        if app is not None:
+            self.init_app(app)
+    
+    def init_app(self, app):
+        """读取配置并在启用时启动后台归档线程"""
+        self.app = app
+        self.enabled = app.config.get('ARCHIVE_ENABLED', False)
+        self.after_days = app.config.get('ARCHIVE_AFTER_DAYS', 30)
+        self.interval = app.config.get('ARCHIVE_INTERVAL', 3600)
+        self.batch_size = app.config.get('ARCHIVE_BATCH_SIZE', 100000)
+        app.extensions['sensor_archiver'] = self
+        
+        if self.enabled:
+            self.start()
+            atexit.register(self.stop)
+    
+    def start(self):
+        """启动后台归档线程"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='sensor-archiver', daemon=True)
+        self._thread.start()
+    
+    def stop(self, timeout=30):
+        """停止归档线程（当前批次完成或回滚后退出）"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+    
+    def archive(self, now=None):
+        """归档所有早于ARCHIVE_AFTER_DAYS天（按UTC整天计算）的数据，返回本次归档的读数数量"""
+        if self.app is None:
+            return 0
+        
+        started = time.perf_counter()
+        total = 0
+        with self.app.app_context():
+            today = datetime.combine((now or datetime.utcnow()).date(), datetime.min.time())
+            cutoff = today - timedelta(days=self.after_days)
+            for source in (ROWS_WATERMARK, FRAMES_WATERMARK):
+                while not self._stop_event.is_set():
+                    try:
+                        count, more = self._archive_batch(source, cutoff)
+                    except Exception as e:
+                        db.session.rollback()
+                        print(f"⚠ 数据归档失败 ({source}): {e}")
+                        break
+                    total += count
+                    if not more:
+                        break
+        
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self._stats['runs'] += 1
+            self._stats['last_run_ms'] = elapsed_ms
+            self._stats['max_run_ms'] = max(self._stats['max_run_ms'], elapsed_ms)
+        return total
+    
+    def stats(self):
+        """返回归档次数、读数数量、写入文件和删除冲突等计数器"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats['enabled'] = self.enabled
+        stats['after_days'] = self.after_days
+        stats['interval'] = self.interval
+        return stats
+    
+    @staticmethod
+    def _model(source):
+        return SensorData if source == ROWS_WATERMARK else SensorFrame
+    
+    def _conditions(self, source, cutoff):
+        """可以归档的数据：早于cutoff，启用汇总表时还需已压缩到汇总表"""
+        model = self._model(source)
+        conditions = [model.timestamp < cutoff]
+        if rollups_enabled():
+            conditions.append(model.id <= RollupWatermark.get_all()[source])
+        return conditions
+    
+    def _fetch(self, source, cutoff):
+        """读取最早一天中的一批数据，返回 (天, [(id, timestamp, [(pos, channel_id, value), ...]), ...])"""
+        model = self._model(source)
+        conditions = self._conditions(source, cutoff)
+        first = db.session.query(db.func.min(model.timestamp)).filter(*conditions).scalar()
+        if first is None:
+            return None, []
+        
+        day_start = datetime.combine(first.date(), datetime.min.time())
+        conditions += [model.timestamp >= day_start, model.timestamp < day_start + timedelta(days=1)]
+        if source == ROWS_WATERMARK:
+            rows = db.session.query(
+                SensorData.id, SensorData.timestamp, SensorData.channel_id, SensorData.value
+            ).filter(*conditions).order_by(SensorData.id).limit(self.batch_size).all()
+            return first.date(), [(row_id, timestamp, [(0, channel_id, value)]) for row_id, timestamp, channel_id, value in rows]
+        
+        frames = db.session.query(
+            SensorFrame.id, SensorFrame.timestamp, SensorFrame.payload
+        ).filter(*conditions).order_by(SensorFrame.id).limit(self.batch_size).all()
+        return first.date(), [
+            (frame_id, timestamp, [(pos, channel_id, value) for pos, (channel_id, value) in enumerate(FRAME_PAIR.iter_unpack(payload))])
+            for frame_id, timestamp, payload in frames
+        ]
+    
+    def _archive_batch(self, source, cutoff):
+        """归档一批数据，返回 (读数数量, 是否可能还有更多数据)"""
+        day, batch = self._fetch(source, cutoff)
+        if not batch:
+            db.session.rollback()
+            return 0, False
+        
+        # 每个通道的读数按 (时间, ID, 帧内位置) 排序，与分页顺序一致
+        blocks = {}
+        for item_id, timestamp, pairs in batch:
+            for pos, channel_id, value in pairs:
+                blocks.setdefault(channel_id, []).append((timestamp, (item_id, pos), value))
+        readings = sum(len(items) for items in blocks.values())
+        
+        ids = [item[0] for item in batch]
+        # 文件名带随机后缀，多个进程同时归档同一批数据时互不覆盖
+        relative_path = os.path.join(
+            f'{day:%Y}', f'{day:%m}', f'{day:%Y-%m-%d}-{source}-{ids[0]}-{uuid.uuid4().hex[:8]}.bin'
+        )
+        segments = ArchiveSegment.write_file(relative_path, blocks, day, compacted=rollups_enabled())
+        path = os.path.join(archive_root(), relative_path)
+        
+        try:
+            db.session.add_all(segments)
+            model = self._model(source)
+            deleted = 0
+            for i in range(0, len(ids), ARCHIVE_DELETE_CHUNK):
+                deleted += db.session.query(model).filter(
+                    model.id.in_(ids[i:i + ARCHIVE_DELETE_CHUNK])
+                ).delete(synchronize_session=False)
+            if deleted != len(ids):
+                # 其他进程已归档（删除）了其中的数据
+                db.session.rollback()
+                os.remove(path)
+                with self._lock:
+                    self._stats['conflicts'] += 1
+                return 0, False
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            os.remove(path)
+            raise
+        
+        with self._lock:
+            self._stats['rows_archived' if source == ROWS_WATERMARK else 'frames_archived'] += len(ids)
+            self._stats['readings_archived'] += readings
+            self._stats['files_written'] += 1
+            self._stats['bytes_written'] += os.path.getsize(path)
+        return readings, True
+    
+    def _run(self):
+        """后台线程：按固定间隔归档"""
+        while not self._stop_event.wait(self.interval):
+            self.archive()
+
+
+# 全局数据归档实例，在create_app中通过init_app初始化
+sensor_archiver = SensorArchiver()
@@ -0,0 +1,113 @@
+"""
+设备命令通知
+控制命令写入队列后唤醒正在长轮询该设备命令的请求，命令在亚秒级内送达而不需要设备频繁轮询
+"""
+import threading
+import time
+
+
+class CommandNotifier:
+    """进程内按设备计数的命令通知；其他进程写入的命令由长轮询请求定期复查数据库发现"""
+    
+    def __init__(self, app=None):
+        self.max_wait = 30
+        self.recheck_interval = 5
+        self.batch_size = 20
+        self.max_waiters = 50
+        
+        self._cond = threading.Condition()
+        self._versions = {}  # device_id -> 已通知的命令次数
+        self._waiting = 0
+        self._long_polls = 0
+        self._stats = {
+            'notifications': 0,
+            'polls': 0,
+            'wakeups': 0,
+            'timeouts': 0,
+            'rejected': 0
+        }
+        
+        if app is not None:
+            self.init_app(app)
+    
+    def init_app(self, app):
+        """读取长轮询配置"""
+        self.max_wait = app.config.get('COMMAND_MAX_WAIT', 30)
+        self.recheck_interval = app.config.get('COMMAND_RECHECK_INTERVAL', 5)
+        self.batch_size = app.config.get('COMMAND_BATCH_SIZE', 20)
+        self.max_waiters = app.config.get('COMMAND_MAX_WAITERS', 50)
+        app.extensions['command_notifier'] = self
+    
+    def version(self, device_id):
+        """设备当前的通知计数，在查询待处理命令之前读取，避免查询和等待之间的通知丢失"""
+        with self._cond:
+            return self._versions.get(device_id, 0)
+    
+    def notify(self, device_id):
+        """设备有新命令时调用，唤醒等待该设备的请求"""
+        with self._cond:
+            self._versions[device_id] = self._versions.get(device_id, 0) + 1
+            self._stats['notifications'] += 1
+            self._cond.notify_all()
+    
+    def wait(self, device_id, version, timeout):
+        """等待设备的通知计数变化或超时，返回是否收到通知"""
+        with self._cond:
+            self._waiting += 1
+            try:
+                notified = self._cond.wait_for(lambda: self._versions.get(device_id, 0) != version, timeout)
+            finally:
+                self._waiting -= 1
+            self._stats['wakeups' if notified else 'timeouts'] += 1
+            return notified
+    
+    def poll(self, device_id, fetch, wait):
+        """长轮询：fetch() 返回待处理命令，为空时最多等待wait秒（不超过COMMAND_MAX_WAIT）
+        
+        每个挂起的请求占用一个工作线程，同时挂起的请求已达COMMAND_MAX_WAITERS个时不查询也不等待，返回None
+        """
+        wait = max(0, min(wait, self.max_wait))
+        with self._cond:
+            self._stats['polls'] += 1
+            if wait > 0:
+                if self._long_polls >= self.max_waiters:
+                    self._stats['rejected'] += 1
+                    return None
+                self._long_polls += 1
+        try:
+            return self._poll(device_id, fetch, wait)
+        finally:
+            if wait > 0:
+                with self._cond:
+                    self._long_polls -= 1
+    
+    def _poll(self, device_id, fetch, wait):
+        from src.models import db
+        
+        deadline = time.monotonic() + wait
+        while True:
+            version = self.version(device_id)
+            commands = fetch()
+            remaining = deadline - time.monotonic()
+            if commands or remaining <= 0:
+                return commands
+            # 结束当前事务再等待：不占用连接，且复查时能看到其他进程写入的命令
+            db.session.rollback()
+            if self.recheck_interval > 0:
+                remaining = min(remaining, self.recheck_interval)
+            self.wait(device_id, version, remaining)
+    
+    def stats(self):
+        """返回通知和长轮询计数器"""
+        with self._cond:
+            stats = dict(self._stats)
+            stats['waiting'] = self._waiting
+            stats['long_polls'] = self._long_polls
+        stats['max_wait'] = self.max_wait
+        stats['max_waiters'] = self.max_waiters
+        stats['recheck_interval'] = self.recheck_interval
+        return stats
+
+
+# 全局命令通知实例，在create_app中通过init_app初始化
+command_notifier = CommandNotifier()
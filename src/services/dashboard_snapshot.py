@@ -0,0 +1,105 @@
+"""
+仪表板快照缓存
+设备统计、设备列表和每个设备各传感器的最新读数用固定数量的查询一次构建，
+编码后的响应体和ETag在短TTL内由所有仪表板共享
+"""
+import hashlib
+import json
+import threading
+import time
+
+
+class DashboardSnapshotCache:
+    """缓存编码后的仪表板快照；过期后只有一个请求重新构建，其他请求等待其结果"""
+    
+    def __init__(self, app=None):
+        self.ttl = 2
+        
+        self._lock = threading.Lock()
+        self._value = None  # (响应体, ETag)
+        self._expires_at = 0.0
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'last_build_ms': 0.0
+        }
+        
+        if app is not None:
+            self.init_app(app)
+    
+    def init_app(self, app):
+        """读取缓存配置"""
+        self.ttl = app.config.get('DASHBOARD_SNAPSHOT_TTL', 2)
+        app.extensions['dashboard_snapshot'] = self
+        self.invalidate()
+    
+    def get(self):
+        """返回 (JSON响应体, ETag)，缓存过期时重新构建"""
+        with self._lock:
+            if self._value is not None and self._expires_at > time.monotonic():
+                self._stats['hits'] += 1
+                return self._value
+            
+            self._stats['misses'] += 1
+            started = time.perf_counter()
+            value = self._encode(self.build())
+            self._stats['last_build_ms'] = (time.perf_counter() - started) * 1000
+            if self.ttl > 0:
+                self._value = value
+                self._expires_at = time.monotonic() + self.ttl
+            return value
+    
+    def invalidate(self):
+        """使缓存失效"""
+        with self._lock:
+            self._value = None
+            self._expires_at = 0.0
+    
+    @staticmethod
+    def build():
+        """构建快照：一条查询加载所有设备，一条查询加载所有设备的最新读数，设备统计由设备列表计算"""
+        from src.models.current_value import CurrentValue
+        from src.models.device import Device
+        
+        devices = Device.query.order_by(Device.id).all()
+        latest = CurrentValue.for_devices([device.device_id for device in devices])
+        
+        device_list = []
+        stats = {'total_devices': 0, 'online_devices': 0, 'microbit_devices': 0, 'esp32_devices': 0}
+        for device in devices:
+            device_info = device.to_dict()
+            device_info['latest'] = latest[device.device_id]
+            device_list.append(device_info)
+            
+            stats['total_devices'] += 1
+            if device_info['status'] == 'online':
+                stats['online_devices'] += 1
+            if device.device_type in ('microbit', 'esp32'):
+                stats[f'{device.device_type}_devices'] += 1
+        stats['offline_devices'] = stats['total_devices'] - stats['online_devices']
+        
+        return {
+            'success': True,
+            'stats': stats,
+            'devices': device_list,
+            'count': len(device_list)
+        }
+    
+    @staticmethod
+    def _encode(snapshot):
+        """编码响应体，ETag为内容摘要（数据未变化时保持不变）"""
+        body = json.dumps(snapshot, sort_keys=True, separators=(',', ':')).encode('utf-8')
+        return body, hashlib.sha1(body).hexdigest()
+    
+    def stats(self):
+        """返回命中/未命中计数器"""
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        stats['ttl'] = self.ttl
+        return stats
+
+
+# 全局仪表板快照缓存实例，在create_app中通过init_app初始化
+dashboard_snapshot = DashboardSnapshotCache()
@@ -0,0 +1,130 @@
+"""
+设备注册表缓存
+进程内缓存device_id到设备基本信息的映射，减少入库路径上的设备查询
+"""
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+
+# 缓存中保存的设备基本信息
+DeviceInfo = namedtuple('DeviceInfo', ['device_id', 'device_type', 'status'])
+
+
+class DeviceRegistryCache:
+    """带TTL的LRU缓存，注册、配置更新和固件更新时显式失效
+    
+    同时维护一个有界的负缓存，记录最近查询过但不存在的device_id，
+    未注册设备的重复请求无需访问数据库即可拒绝；负缓存条目过期后重新查询数据库，
+    其他进程注册的设备最多在negative_ttl秒内被拒绝
+    """
+    
+    def __init__(self, app=None):
+        self.enabled = False
+        self.max_size = 10000
+        self.ttl = 60
+        self.negative_max_size = 10000
+        self.negative_ttl = 3
+        
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # device_id -> (DeviceInfo, expires_at)
+        self._negative = OrderedDict()  # device_id -> expires_at
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'invalidations': 0,
+            'negative_hits': 0,
+            'negative_evictions': 0
+        }
+        
+        if app is not None:
+            self.init_app(app)
+    
+    def init_app(self, app):
+        """读取缓存配置"""
+        self.enabled = app.config.get('DEVICE_CACHE_ENABLED', True)
+        self.max_size = app.config.get('DEVICE_CACHE_SIZE', 10000)
+        self.ttl = app.config.get('DEVICE_CACHE_TTL', 60)
+        self.negative_max_size = app.config.get('DEVICE_NEGATIVE_CACHE_SIZE', 10000)
+        self.negative_ttl = app.config.get('DEVICE_NEGATIVE_CACHE_TTL', 3)
+        app.extensions['device_cache'] = self
+        self.clear()
+    
+    def get(self, device_id):
+        """从缓存读取设备信息，返回 (命中与否, DeviceInfo)，命中负缓存时返回 (True, None)"""
+        if not self.enabled:
+            return False, None
+        
+        now = time.monotonic()
+        with self._lock:
+            expires_at = self._negative.get(device_id)
+            if expires_at is not None:
+                if expires_at > now:
+                    self._stats['negative_hits'] += 1
+                    return True, None
+                del self._negative[device_id]
+            
+            entry = self._entries.get(device_id)
+            if entry is None or entry[1] <= now:
+                if entry is not None:
+                    del self._entries[device_id]
+                self._stats['misses'] += 1
+                return False, None
+            self._entries.move_to_end(device_id)
+            self._stats['hits'] += 1
+            return True, entry[0]
+    
+    def put(self, info):
+        """写入设备信息，超出容量时淘汰最久未使用的条目"""
+        if not self.enabled or info is None:
+            return
+        
+        with self._lock:
+            self._entries[info.device_id] = (info, time.monotonic() + self.ttl)
+            self._entries.move_to_end(info.device_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+    
+    def put_missing(self, device_id):
+        """记录不存在的device_id，超出容量时淘汰最早的条目"""
+        if not self.enabled or self.negative_max_size <= 0:
+            return
+        
+        with self._lock:
+            self._negative[device_id] = time.monotonic() + self.negative_ttl
+            self._negative.move_to_end(device_id)
+            while len(self._negative) > self.negative_max_size:
+                self._negative.popitem(last=False)
+                self._stats['negative_evictions'] += 1
+    
+    def invalidate(self, device_id):
+        """使单个设备的缓存（包括负缓存）失效"""
+        with self._lock:
+            self._entries.pop(device_id, None)
+            self._negative.pop(device_id, None)
+            self._stats['invalidations'] += 1
+    
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+            self._negative.clear()
+    
+    def stats(self):
+        """返回命中/未命中等计数器"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._entries)
+            stats['negative_size'] = len(self._negative)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        stats['enabled'] = self.enabled
+        stats['max_size'] = self.max_size
+        stats['ttl'] = self.ttl
+        return stats
+
+
+# 全局设备注册表缓存实例，在create_app中通过init_app初始化
+device_cache = DeviceRegistryCache()
@@ -0,0 +1,68 @@
+"""
+设备统计缓存
+设备统计接口和健康检查共享一次条件聚合查询的结果，在短TTL内不再访问数据库；
+聚合语句与在线设备数量无关，内存中的在线状态由后台线程写回，在线数最多滞后PRESENCE_FLUSH_INTERVAL秒
+"""
+import threading
+import time
+
+
+class DeviceStatsCache:
+    """缓存Device.get_stats的结果；过期后只有一个请求重新查询，其他请求等待其结果"""
+    
+    def __init__(self, app=None):
+        self.ttl = 5
+        
+        self._lock = threading.Lock()
+        self._value = None
+        self._expires_at = 0.0
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'invalidations': 0
+        }
+        
+        if app is not None:
+            self.init_app(app)
+    
+    def init_app(self, app):
+        """读取缓存配置"""
+        self.ttl = app.config.get('DEVICE_STATS_CACHE_TTL', 5)
+        app.extensions['device_stats'] = self
+        self.invalidate()
+    
+    def get(self):
+        """返回设备统计 {'total', 'online', 'microbit', 'esp32'}，缓存过期时重新查询"""
+        from src.models.device import Device
+        
+        with self._lock:
+            if self._value is not None and self._expires_at > time.monotonic():
+                self._stats['hits'] += 1
+                return dict(self._value)
+            
+            self._stats['misses'] += 1
+            value = Device.get_stats()
+            if self.ttl > 0:
+                self._value = value
+                self._expires_at = time.monotonic() + self.ttl
+            return dict(value)
+    
+    def invalidate(self):
+        """使缓存失效（设备注册后调用）"""
+        with self._lock:
+            self._value = None
+            self._expires_at = 0.0
+            self._stats['invalidations'] += 1
+    
+    def stats(self):
+        """返回命中/未命中计数器"""
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        stats['ttl'] = self.ttl
+        return stats
+
+
+# 全局设备统计缓存实例，在create_app中通过init_app初始化
+device_stats = DeviceStatsCache()
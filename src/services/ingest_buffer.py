@@ -0,0 +1,278 @@
+"""
+传感器数据写缓冲
+汇集并发请求的传感器数据，按批量大小或等待时间分组提交到数据库
+"""
+import atexit
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy.exc import DataError, IntegrityError
+
+from src.models import db
+from src.models.sensor_data import SensorData
+
+# 逐条写入可以找出无法写入的记录的错误；其他错误（数据库不可用、连接断开等）整批稍后重试
+DATA_ERRORS = (IntegrityError, DataError)
+
+
+class IngestBuffer:
+    """进程内写缓冲（write-behind），多个请求的数据合并为一次事务提交"""
+    
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = False
+        self.max_batch = 1000
+        self.max_delay = 0.2
+        self.max_queue = 10000
+        self.retries = 3
+        self.retry_backoff = 0.1
+        self.dead_letter_path = None
+        
+        self._cond = threading.Condition()
+        self._pending = []
+        self._oldest = None
+        self._thread = None
+        self._stopping = False
+        self._stats = {
+            'flush_count': 0,
+            'rows_flushed': 0,
+            'last_flush_size': 0,
+            'max_flush_size': 0,
+            'last_flush_ms': 0.0,
+            'max_flush_ms': 0.0,
+            'total_flush_ms': 0.0,
+            'failed_rows': 0,
+            'retried_batches': 0,
+            'row_fallbacks': 0,
+            'requeued_rows': 0,
+            'dead_letter_rows': 0,
+            'overflow_count': 0
+        }
+        
+        if app is not None:
+            self.init_app(app)
+    
+    def init_app(self, app):
+        """读取配置并在启用时启动后台刷新线程"""
+        self.app = app
+        self.enabled = app.config.get('INGEST_BUFFER_ENABLED', False)
+        self.max_batch = app.config.get('INGEST_BUFFER_MAX_BATCH', 1000)
+        self.max_delay = app.config.get('INGEST_BUFFER_MAX_DELAY_MS', 200) / 1000.0
+        self.max_queue = app.config.get('INGEST_BUFFER_MAX_QUEUE', 10000)
+        self.retries = app.config.get('INGEST_BUFFER_RETRIES', 3)
+        self.retry_backoff = app.config.get('INGEST_BUFFER_RETRY_BACKOFF_MS', 100) / 1000.0
+        self.dead_letter_path = app.config.get('INGEST_BUFFER_DEAD_LETTER_PATH')
+        app.extensions['ingest_buffer'] = self
+        
+        if self.enabled:
+            self.start()
+            atexit.register(self.stop)
+    
+    def start(self):
+        """启动后台刷新线程"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name='ingest-buffer', daemon=True)
+        self._thread.start()
+    
+    def stop(self, timeout=10):
+        """停止刷新线程，退出前写入所有剩余数据"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+    
+    def write(self, rows):
+        """写入SensorData.build_row构建的记录，已进入缓冲时返回True"""
+        if not rows:
+            return False
+        
+        if not self.enabled or not self._thread:
+            SensorData.add_many(rows)
+            return False
+        
+        with self._cond:
+            if len(self._pending) + len(rows) <= self.max_queue:
+                # 缓冲由空变为非空时唤醒刷新线程开始计时，达到批量大小时唤醒它立即刷新
+                first = not self._pending
+                if first:
+                    self._oldest = time.monotonic()
+                self._pending.extend(rows)
+                if first or len(self._pending) >= self.max_batch:
+                    self._cond.notify()
+                return True
+            self._stats['overflow_count'] += 1
+        
+        # 队列已满时在请求线程中同步写入，对上游形成背压
+        SensorData.add_many(rows)
+        return False
+    
+    def stats(self):
+        """返回刷新次数、批量大小和延迟等计数器"""
+        with self._cond:
+            stats = dict(self._stats)
+            stats['pending_rows'] = len(self._pending)
+        stats['enabled'] = self.enabled
+        stats['avg_flush_size'] = (
+            stats['rows_flushed'] / stats['flush_count'] if stats['flush_count'] else 0
+        )
+        stats['avg_flush_ms'] = (
+            stats['total_flush_ms'] / stats['flush_count'] if stats['flush_count'] else 0.0
+        )
+        return stats
+    
+    def _take_batch(self):
+        """取出一批待写入数据（调用方需持有锁）"""
+        batch = self._pending[:self.max_batch]
+        del self._pending[:self.max_batch]
+        self._oldest = time.monotonic() if self._pending else None
+        return batch
+    
+    def _run(self):
+        """后台线程：达到批量大小或最长等待时间后刷新"""
+        while True:
+            with self._cond:
+                while not self._stopping:
+                    if self._pending:
+                        remaining = self._oldest + self.max_delay - time.monotonic()
+                        if len(self._pending) >= self.max_batch or remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                    else:
+                        self._cond.wait()
+                
+                if self._stopping and not self._pending:
+                    return
+                batch = self._take_batch()
+            
+            self._flush(batch)
+    
+    def _flush(self, batch):
+        """在应用上下文中以单个事务写入一批数据
+        
+        失败时按指数退避重试；仍然因数据错误（IntegrityError、DataError）失败时逐条写入，只拒绝无法写入的记录，
+        无法写入的记录追加到死信文件。数据库不可用或连接断开等其他错误时不逐条写入，整批放回队列头部稍后重试
+        """
+        started = time.perf_counter()
+        with self.app.app_context():
+            error = self._write_with_retries(batch)
+            if error is None:
+                self._record_flush(len(batch), started)
+                return
+            
+            if not isinstance(error, DATA_ERRORS):
+                print(f"⚠ 写缓冲刷新失败: {error}")
+                self._retry_later(batch, error)
+                return
+            
+            print(f"⚠ 写缓冲刷新失败，逐条写入 {len(batch)} 条数据: {error}")
+            failed, retry = [], []
+            for row in batch:
+                row_error = self._write([row])
+                if row_error is None:
+                    continue
+                if isinstance(row_error, DATA_ERRORS):
+                    failed.append((row, row_error))
+                else:
+                    retry.append(row)
+        
+        with self._cond:
+            self._stats['row_fallbacks'] += 1
+        written = len(batch) - len(failed) - len(retry)
+        if written:
+            self._record_flush(written, started)
+        if failed and not self._dead_letter(failed):
+            self._requeue([row for row, _ in failed])
+        if retry:
+            self._retry_later(retry, 'database unavailable')
+    
+    def _write(self, rows):
+        """在单个事务中写入记录，返回异常（成功时为None）"""
+        try:
+            SensorData.add_many(rows)
+        except Exception as e:
+            db.session.rollback()
+            return e
+        return None
+    
+    def _write_with_retries(self, batch):
+        """写入一批数据，失败时按 retry_backoff, 2*retry_backoff, ... 重试，返回最后一次的异常（成功时为None）"""
+        error = self._write(batch)
+        for attempt in range(self.retries):
+            if error is None:
+                break
+            with self._cond:
+                self._stats['retried_batches'] += 1
+            time.sleep(self.retry_backoff * (2 ** attempt))
+            error = self._write(batch)
+        return error
+    
+    def _retry_later(self, rows, error):
+        """数据库暂时不可用时放回队列；正在停止时不再重试，保留到死信文件"""
+        if self._stopping:
+            self._dead_letter([(row, error) for row in rows])
+        else:
+            self._requeue(rows)
+    
+    def _requeue(self, rows):
+        """将未写入的记录放回队列头部，下次刷新时重试；超出max_queue的部分追加到死信文件"""
+        with self._cond:
+            room = max(self.max_queue - len(self._pending), 0)
+            requeued, overflow = rows[:room], rows[room:]
+            self._pending[:0] = requeued
+            self._oldest = time.monotonic()
+            self._stats['requeued_rows'] += len(requeued)
+            if overflow:
+                self._stats['overflow_count'] += 1
+        print(f"⚠ 写缓冲刷新失败，{len(requeued)} 条数据放回队列")
+        if overflow:
+            print(f"⚠ 写缓冲队列已满，{len(overflow)} 条数据无法放回队列")
+            self._dead_letter([(row, 'ingest buffer queue full') for row in overflow])
+    
+    def _dead_letter(self, failed):
+        """将无法写入的记录以NDJSON追加到死信文件，返回是否写入成功"""
+        with self._cond:
+            self._stats['failed_rows'] += len(failed)
+        if not self.dead_letter_path:
+            print(f"⚠ 写缓冲丢弃 {len(failed)} 条无法写入的数据（未配置死信文件）")
+            return True
+        
+        failed_at = datetime.utcnow().isoformat()
+        try:
+            os.makedirs(os.path.dirname(self.dead_letter_path) or '.', exist_ok=True)
+            with open(self.dead_letter_path, 'a', encoding='utf-8') as f:
+                for row, error in failed:
+                    f.write(json.dumps({
+                        'failed_at': failed_at,
+                        'error': str(error),
+                        'reading': SensorData.row_to_dict(row)
+                    }, ensure_ascii=False) + '\n')
+        except OSError as e:
+            print(f"⚠ 写入死信文件失败: {e}")
+            return False
+        
+        print(f"⚠ 写缓冲 {len(failed)} 条数据无法写入，已追加到 {self.dead_letter_path}")
+        with self._cond:
+            self._stats['dead_letter_rows'] += len(failed)
+        return True
+    
+    def _record_flush(self, size, started):
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._cond:
+            stats = self._stats
+            stats['flush_count'] += 1
+            stats['rows_flushed'] += size
+            stats['last_flush_size'] = size
+            stats['max_flush_size'] = max(stats['max_flush_size'], size)
+            stats['last_flush_ms'] = elapsed_ms
+            stats['max_flush_ms'] = max(stats['max_flush_ms'], elapsed_ms)
+            stats['total_flush_ms'] += elapsed_ms
+
+# 全局写缓冲实例，在create_app中通过init_app初始化
+ingest_buffer = IngestBuffer()
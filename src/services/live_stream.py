@@ -0,0 +1,160 @@
+"""
+实时读数推送
+写入传感器数据并提交后，每条读数只序列化一次并分发给所有订阅者（SSE连接）；
+每个订阅者使用有界队列，消费过慢时丢弃最旧的读数，不会阻塞写入路径
+分发只在进程内进行：多进程（如gunicorn多个worker）部署时，每个SSE连接只能收到与它同一进程写入的读数
+"""
+import json
+import threading
+from collections import deque
+
+
+class Subscription:
+    """一个订阅者的有界读数队列，可按设备和传感器类型过滤"""
+    
+    def __init__(self, device_id=None, sensor_type=None, max_queue=1000):
+        self.device_id = device_id
+        self.sensor_type = sensor_type
+        self.dropped = 0
+        
+        self._cond = threading.Condition()
+        self._queue = deque(maxlen=max_queue)
+        self._closed = False
+    
+    def matches(self, reading):
+        """读数是否符合订阅的过滤条件"""
+        return (
+            (self.device_id is None or reading['device_id'] == self.device_id) and
+            (self.sensor_type is None or reading['sensor_type'] == self.sensor_type)
+        )
+    
+    def put(self, message):
+        """加入已编码的读数，队列已满时丢弃最旧的一条，返回是否发生丢弃"""
+        with self._cond:
+            dropped = len(self._queue) == self._queue.maxlen
+            if dropped:
+                self.dropped += 1
+            self._queue.append(message)
+            self._cond.notify()
+            return dropped
+    
+    def get_batch(self, timeout):
+        """取出队列中的全部读数，队列为空时最多等待timeout秒，返回 (读数列表, 自上次以来丢弃的数量)"""
+        with self._cond:
+            if not self._queue and not self._closed:
+                self._cond.wait(timeout)
+            batch = list(self._queue)
+            self._queue.clear()
+            dropped, self.dropped = self.dropped, 0
+            return batch, dropped
+    
+    def close(self):
+        """关闭订阅，唤醒等待中的连接"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+    
+    @property
+    def closed(self):
+        return self._closed
+
+
+class ReadingBroker:
+    """进程内的读数发布/订阅，订阅者按设备ID索引，发布时只检查相关的订阅者"""
+    
+    def __init__(self, app=None):
+        self.enabled = True
+        self.max_subscribers = 100
+        self.queue_size = 1000
+        self.keepalive = 15
+        
+        self._lock = threading.Lock()
+        self._by_device = {}  # device_id（None表示所有设备）-> 订阅者集合
+        self._count = 0
+        self._stats = {
+            'published': 0,
+            'delivered': 0,
+            'dropped': 0,
+            'rejected_subscribers': 0
+        }
+        
+        if app is not None:
+            self.init_app(app)
+    
+    def init_app(self, app):
+        """读取推送配置"""
+        self.enabled = app.config.get('LIVE_STREAM_ENABLED', True)
+        self.max_subscribers = app.config.get('LIVE_STREAM_MAX_SUBSCRIBERS', 100)
+        self.queue_size = app.config.get('LIVE_STREAM_QUEUE_SIZE', 1000)
+        self.keepalive = app.config.get('LIVE_STREAM_KEEPALIVE', 15)
+        app.extensions['live_stream'] = self
+    
+    @property
+    def active(self):
+        """是否有订阅者（发布前的快速检查）"""
+        return self.enabled and self._count > 0
+    
+    def subscribe(self, device_id=None, sensor_type=None):
+        """创建订阅，超过订阅者上限时返回None"""
+        with self._lock:
+            if self._count >= self.max_subscribers:
+                self._stats['rejected_subscribers'] += 1
+                return None
+            subscription = Subscription(device_id, sensor_type, self.queue_size)
+            self._by_device.setdefault(device_id, set()).add(subscription)
+            self._count += 1
+            return subscription
+    
+    def unsubscribe(self, subscription):
+        """取消订阅（连接断开时调用）"""
+        subscription.close()
+        with self._lock:
+            subscribers = self._by_device.get(subscription.device_id)
+            if subscribers and subscription in subscribers:
+                subscribers.discard(subscription)
+                self._count -= 1
+                if not subscribers:
+                    del self._by_device[subscription.device_id]
+    
+    def publish(self, readings):
+        """发布与SensorData.to_dict格式一致的读数（写入提交后调用），每条读数只编码一次"""
+        if not self.active:
+            return 0
+        
+        delivered = dropped = 0
+        with self._lock:
+            wildcard = list(self._by_device.get(None, ()))
+            by_device = {device_id: list(subscribers) for device_id, subscribers in self._by_device.items()}
+        
+        for reading in readings:
+            subscribers = [
+                subscription
+                for subscription in wildcard + by_device.get(reading['device_id'], [])
+                if subscription.matches(reading)
+            ]
+            if not subscribers:
+                continue
+            message = json.dumps(reading)
+            for subscription in subscribers:
+                dropped += subscription.put(message)
+                delivered += 1
+        
+        with self._lock:
+            self._stats['published'] += len(readings)
+            self._stats['delivered'] += delivered
+            self._stats['dropped'] += dropped
+        return delivered
+    
+    def stats(self):
+        """返回发布、投递和丢弃计数器"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['subscribers'] = self._count
+        stats['enabled'] = self.enabled
+        stats['max_subscribers'] = self.max_subscribers
+        stats['queue_size'] = self.queue_size
+        return stats
+
+
+# 全局读数推送实例，在create_app中通过init_app初始化
+live_stream = ReadingBroker()
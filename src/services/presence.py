@@ -0,0 +1,167 @@
+"""
+设备在线状态跟踪
+心跳和数据上传只在内存中记录最后在线时间，由后台线程定期批量写入devices表
+"""
+import atexit
+import threading
+from datetime import datetime
+
+from sqlalchemy import bindparam
+
+from src.models import db
+from src.services.device_cache import device_cache
+
+
+class PresenceTracker:
+    """内存中的设备在线状态，定期以批量UPDATE写回数据库"""
+    
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = False
+        self.flush_interval = 10
+        
+        self._lock = threading.Lock()
+        self._pending = {}  # device_id -> (status, last_seen, config_patch)
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._stats = {
+            'records': 0,
+            'flush_count': 0,
+            'devices_flushed': 0,
+            'last_flush_size': 0
+        }
+        
+        if app is not None:
+            self.init_app(app)
+    
+    def init_app(self, app):
+        """读取配置并启动后台写回线程"""
+        self.app = app
+        self.enabled = app.config.get('PRESENCE_TRACKING_ENABLED', True)
+        self.flush_interval = app.config.get('PRESENCE_FLUSH_INTERVAL', 10)
+        app.extensions['presence'] = self
+        
+        if self.enabled:
+            self.start()
+            atexit.register(self.stop)
+    
+    def start(self):
+        """启动后台写回线程"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='presence-flush', daemon=True)
+        self._thread.start()
+    
+    def stop(self, timeout=10):
+        """停止写回线程，退出前写入所有未保存的状态"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+        self.flush()
+    
+    def record(self, device_id, status='online', config_patch=None):
+        """记录设备在线（不访问数据库），config_patch会在写回时合并到设备配置"""
+        now = datetime.utcnow()
+        with self._lock:
+            previous = self._pending.get(device_id)
+            if config_patch and previous and previous[2]:
+                config_patch = {**previous[2], **config_patch}
+            elif not config_patch and previous:
+                config_patch = previous[2]
+            self._pending[device_id] = (status, now, config_patch)
+            self._stats['records'] += 1
+    
+    def record_many(self, device_ids, status='online'):
+        """批量记录设备在线"""
+        for device_id in set(device_ids):
+            self.record(device_id, status)
+    
+    def get(self, device_id):
+        """返回尚未写回的 (status, last_seen, config_patch)，没有时返回None"""
+        with self._lock:
+            return self._pending.get(device_id)
+    
+    def pending(self):
+        """返回所有尚未写回的状态快照"""
+        with self._lock:
+            return dict(self._pending)
+    
+    def discard(self, device_id):
+        """丢弃设备未写回的在线状态（状态已被显式写入数据库时调用）"""
+        with self._lock:
+            entry = self._pending.pop(device_id, None)
+        return entry
+    
+    def flush(self):
+        """将内存中的在线状态批量写入devices表"""
+        snapshot = self.pending()
+        if not snapshot or self.app is None:
+            return 0
+        
+        from src.models.device import Device
+        
+        table = Device.__table__
+        statement = table.update().where(
+            table.c.device_id == bindparam('b_device_id')
+        ).values(
+            status=bindparam('b_status'),
+            last_seen=bindparam('b_last_seen'),
+            updated_at=bindparam('b_last_seen')
+        )
+        params = [
+            {'b_device_id': device_id, 'b_status': status, 'b_last_seen': last_seen}
+            for device_id, (status, last_seen, _) in snapshot.items()
+        ]
+        
+        with self.app.app_context():
+            try:
+                db.session.execute(statement, params)
+                
+                # 合并心跳附带的配置信息（只加载有配置变更的设备）
+                patches = {
+                    device_id: entry[2] for device_id, entry in snapshot.items() if entry[2]
+                }
+                if patches:
+                    devices = Device.query.filter(Device.device_id.in_(patches)).all()
+                    for device in devices:
+                        config = dict(device.config or {})
+                        config.update(patches[device.device_id])
+                        device.config = config
+                
+                db.session.commit()
+                for device_id in patches:
+                    device_cache.invalidate(device_id)
+            except Exception as e:
+                db.session.rollback()
+                print(f"⚠ 设备在线状态写回失败: {e}")
+                return 0
+        
+        # 只移除写回后没有再次更新的记录
+        with self._lock:
+            for device_id, entry in snapshot.items():
+                if self._pending.get(device_id) is entry:
+                    del self._pending[device_id]
+            self._stats['flush_count'] += 1
+            self._stats['devices_flushed'] += len(snapshot)
+            self._stats['last_flush_size'] = len(snapshot)
+        return len(snapshot)
+    
+    def stats(self):
+        """返回记录次数和写回批量等计数器"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['pending_devices'] = len(self._pending)
+        stats['enabled'] = self.enabled
+        stats['flush_interval'] = self.flush_interval
+        return stats
+    
+    def _run(self):
+        """后台线程：按固定间隔写回"""
+        while not self._stop_event.wait(self.flush_interval):
+            self.flush()
+
+
+# 全局在线状态跟踪实例，在create_app中通过init_app初始化
+presence = PresenceTracker()
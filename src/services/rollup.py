@@ -0,0 +1,179 @@
+"""
+传感器数据汇总压缩
+后台线程按ID顺序读取尚未压缩的sensor_data和sensor_frames，增量合并到分钟/小时/天汇总表
+"""
+import atexit
+import threading
+import time
+
+from src.models import db
+from src.models.sensor_data import SensorData
+from src.models.sensor_frame import FRAME_PAIR, SensorFrame
+from src.models.sensor_rollup import FRAMES_WATERMARK, ROWS_WATERMARK, RollupWatermark, SensorRollup
+
+
+class RollupCompactor:
+    """汇总表的增量压缩：每批读数与压缩进度在同一事务中提交，多个进程同时压缩时只有一个能推进进度"""
+    
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = False
+        self.interval = 10
+        self.batch_size = 5000
+        self.lag = 30
+        
+        self._lock = threading.Lock()
+        self._gaps = {}  # 数据来源 -> {ID空缺的起点: 首次发现的时间}
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._stats = {
+            'runs': 0,
+            'rows_compacted': 0,
+            'frames_compacted': 0,
+            'buckets_merged': 0,
+            'conflicts': 0,
+            'gaps_skipped': 0,
+            'last_run_ms': 0.0,
+            'max_run_ms': 0.0
+        }
+        
+        if app is not None:
+            self.init_app(app)
+    
+    def init_app(self, app):
+        """读取配置并在启用时启动后台压缩线程"""
+        self.app = app
+        self.enabled = app.config.get('ROLLUP_ENABLED', True)
+        self.interval = app.config.get('ROLLUP_COMPACT_INTERVAL', 10)
+        self.batch_size = app.config.get('ROLLUP_BATCH_SIZE', 5000)
+        self.lag = app.config.get('ROLLUP_LAG_SECONDS', 30)
+        app.extensions['rollup_compactor'] = self
+        
+        if self.enabled:
+            self.start()
+            atexit.register(self.stop)
+    
+    def start(self):
+        """启动后台压缩线程"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='rollup-compactor', daemon=True)
+        self._thread.start()
+    
+    def stop(self, timeout=10):
+        """停止压缩线程（未压缩的数据在下次启动后继续压缩，查询时会直接读取）"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+    
+    def compact(self):
+        """压缩所有已提交且之前没有未提交ID的数据，返回本次压缩的读数数量"""
+        if self.app is None:
+            return 0
+        
+        started = time.perf_counter()
+        total = 0
+        with self.app.app_context():
+            for source in (ROWS_WATERMARK, FRAMES_WATERMARK):
+                while not self._stop_event.is_set():
+                    try:
+                        count, more = self._compact_batch(source)
+                    except Exception as e:
+                        db.session.rollback()
+                        print(f"⚠ 汇总表压缩失败 ({source}): {e}")
+                        break
+                    total += count
+                    if not more:
+                        break
+        
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self._stats['runs'] += 1
+            self._stats['last_run_ms'] = elapsed_ms
+            self._stats['max_run_ms'] = max(self._stats['max_run_ms'], elapsed_ms)
+        return total
+    
+    def stats(self):
+        """返回压缩次数、读数数量和进度冲突等计数器"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats['enabled'] = self.enabled
+        stats['interval'] = self.interval
+        return stats
+    
+    def _fetch(self, source, last_id):
+        """按ID顺序读取last_id之后的一批数据，返回 (id, timestamp, [(channel_id, value), ...]) 列表"""
+        if source == ROWS_WATERMARK:
+            rows = db.session.query(
+                SensorData.id, SensorData.timestamp, SensorData.channel_id, SensorData.value
+            ).filter(SensorData.id > last_id).order_by(SensorData.id).limit(self.batch_size).all()
+            return [(row_id, timestamp, [(channel_id, value)]) for row_id, timestamp, channel_id, value in rows]
+        
+        frames = db.session.query(
+            SensorFrame.id, SensorFrame.timestamp, SensorFrame.payload
+        ).filter(SensorFrame.id > last_id).order_by(SensorFrame.id).limit(self.batch_size).all()
+        return [(frame_id, timestamp, FRAME_PAIR.iter_unpack(payload)) for frame_id, timestamp, payload in frames]
+    
+    def _compact_batch(self, source):
+        """压缩一批数据并推进进度，返回 (读数数量, 是否可能还有更多数据)
+        
+        进度只推进到第一个尚不可见的ID之前：ID较小的事务可能晚于ID较大的事务提交，跳过它会使这些数据
+        既不在汇总表中也不在进度之后的原始数据中。与读数时间无关，补传的旧数据同样适用
+        """
+        last_id = RollupWatermark.get_all()[source]
+        batch = self._fetch(source, last_id)
+        
+        # 记录本批中每个ID空缺的起点首次被发现的时间；空缺超过lag秒仍未填补时视为回滚或插入失败留下的永久空缺
+        gaps = self._gaps.setdefault(source, {})
+        now = time.monotonic()
+        previous = last_id
+        for item_id, _, _ in batch:
+            if item_id != previous + 1:
+                gaps.setdefault(previous + 1, now)
+            previous = item_id
+        
+        stats = {}
+        new_id = last_id
+        readings = 0
+        skipped = 0
+        for item_id, timestamp, pairs in batch:
+            if item_id != new_id + 1:
+                if now - gaps[new_id + 1] < self.lag:
+                    break
+                skipped += 1
+            for channel_id, value in pairs:
+                SensorRollup.accumulate(stats, channel_id, timestamp, value)
+                readings += 1
+            new_id = item_id
+        
+        if new_id == last_id:
+            db.session.rollback()
+            return 0, False
+        
+        buckets = SensorRollup.merge(stats)
+        if not RollupWatermark.advance(source, last_id, new_id):
+            # 其他进程已压缩这一批
+            db.session.rollback()
+            with self._lock:
+                self._stats['conflicts'] += 1
+            return 0, False
+        db.session.commit()
+        
+        for gap_id in [gap_id for gap_id in gaps if gap_id <= new_id]:
+            del gaps[gap_id]
+        with self._lock:
+            self._stats['gaps_skipped'] += skipped
+            self._stats['rows_compacted' if source == ROWS_WATERMARK else 'frames_compacted'] += readings
+            self._stats['buckets_merged'] += buckets
+        return readings, len(batch) == self.batch_size and new_id == batch[-1][0]
+    
+    def _run(self):
+        """后台线程：按固定间隔压缩"""
+        while not self._stop_event.wait(self.interval):
+            self.compact()
+
+
+# 全局汇总压缩实例，在create_app中通过init_app初始化
+rollup_compactor = RollupCompactor()
@@ -0,0 +1,135 @@
+"""
+请求体解压
+支持 Content-Encoding: gzip / deflate 的上传请求，流式解压并限制解压后的大小
+"""
+import io
+import zlib
+
+from werkzeug.wsgi import LimitedStream
+
+SUPPORTED_ENCODINGS = ('gzip', 'deflate')
+
+# 中间件在environ中记录原始的Content-Encoding（请求头本身会被移除）
+DECODED_ENCODING_KEY = 'iot_server.content_encoding'
+
+
+class RequestBodyError(Exception):
+    """请求体无法解码"""
+    status_code = 400
+
+
+class PayloadTooLarge(RequestBodyError):
+    """解压后的请求体超过限制"""
+    status_code = 413
+
+
+class DecompressingStream(io.RawIOBase):
+    """按块读取压缩数据并解压，解压后总大小超过max_size时抛出PayloadTooLarge"""
+    
+    def __init__(self, raw, encoding, max_size, chunk_size=64 * 1024):
+        self._raw = raw
+        self._encoding = encoding
+        self._max_size = max_size
+        self._chunk_size = chunk_size
+        self._decompressor = self._new_decompressor()
+        self._first_chunk = True
+        self._buffer = b''
+        self._total = 0
+        self._eof = False
+    
+    def _new_decompressor(self, raw_deflate=False):
+        if self._encoding == 'gzip':
+            return zlib.decompressobj(16 + zlib.MAX_WBITS)
+        # HTTP的deflate应为zlib格式，部分客户端发送不带头的原始deflate流
+        return zlib.decompressobj(-zlib.MAX_WBITS if raw_deflate else zlib.MAX_WBITS)
+    
+    def readable(self):
+        return True
+    
+    def readinto(self, b):
+        while not self._buffer and not self._eof:
+            self._fill()
+        size = min(len(b), len(self._buffer))
+        b[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+    
+    def _fill(self):
+        """解压下一块数据到缓冲区，每次最多产生chunk_size字节"""
+        decompressor = self._decompressor
+        try:
+            if decompressor.unconsumed_tail:
+                data = decompressor.decompress(decompressor.unconsumed_tail, self._chunk_size)
+            elif decompressor.eof and decompressor.unused_data:
+                # gzip允许多个成员首尾相接
+                unused = decompressor.unused_data
+                self._decompressor = decompressor = self._new_decompressor()
+                data = decompressor.decompress(unused, self._chunk_size)
+            else:
+                compressed = self._raw.read(self._chunk_size)
+                if not compressed:
+                    if not self._first_chunk and not decompressor.eof:
+                        raise RequestBodyError(f'Truncated {self._encoding} body')
+                    data = decompressor.flush()
+                    self._eof = True
+                else:
+                    data = self._decompress_chunk(compressed)
+        except zlib.error as e:
+            raise RequestBodyError(f'Invalid {self._encoding} body: {e}')
+        
+        self._total += len(data)
+        if self._total > self._max_size:
+            raise PayloadTooLarge(f'Decompressed body exceeds {self._max_size} bytes')
+        self._buffer = data
+    
+    def _decompress_chunk(self, compressed):
+        if not self._first_chunk:
+            return self._decompressor.decompress(compressed, self._chunk_size)
+        
+        self._first_chunk = False
+        try:
+            return self._decompressor.decompress(compressed, self._chunk_size)
+        except zlib.error:
+            if self._encoding != 'deflate':
+                raise
+            self._decompressor = self._new_decompressor(raw_deflate=True)
+            return self._decompressor.decompress(compressed, self._chunk_size)
+
+
+def read_decoded_body(request, streaming_paths=()):
+    """在视图函数之前读取并缓存解压后的请求体，使解码错误和超限在请求开始时抛出
+
+    streaming_paths中的接口自行流式读取请求体，不预先读取
+    """
+    if request.environ.get(DECODED_ENCODING_KEY) and request.path not in streaming_paths:
+        request.get_data(cache=True)
+
+
+class DecompressionMiddleware:
+    """WSGI中间件：将压缩的请求体替换为流式解压后的输入流"""
+    
+    def __init__(self, wsgi_app, max_size, path_limits=None):
+        self.wsgi_app = wsgi_app
+        self.max_size = max_size
+        self.path_limits = path_limits or {}
+    
+    def __call__(self, environ, start_response):
+        encoding = environ.get('HTTP_CONTENT_ENCODING', '').strip().lower()
+        if encoding not in SUPPORTED_ENCODINGS:
+            return self.wsgi_app(environ, start_response)
+        
+        raw = environ['wsgi.input']
+        if not environ.get('wsgi.input_terminated'):
+            content_length = environ.get('CONTENT_LENGTH', '')
+            raw = LimitedStream(raw, int(content_length) if content_length.isdigit() else 0)
+        
+        max_size = self.path_limits.get(environ.get('PATH_INFO'), self.max_size)
+        environ['wsgi.input'] = io.BufferedReader(
+            DecompressingStream(raw, encoding, max_size), buffer_size=64 * 1024
+        )
+        # 解压后的长度未知，由输入流自身标记结束
+        environ['wsgi.input_terminated'] = True
+        environ.pop('CONTENT_LENGTH', None)
+        environ.pop('HTTP_CONTENT_ENCODING', None)
+        environ[DECODED_ENCODING_KEY] = encoding
+        return self.wsgi_app(environ, start_response)
@@ -0,0 +1,117 @@
+"""
+传感器数据批量导出
+将SensorData.iter_export逐块读取的数据编码为CSV、Parquet或Arrow IPC流，每块编码后立即输出，不在内存中保存完整结果
+Parquet和Arrow格式需要安装可选依赖pyarrow
+"""
+import csv
+import io
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+# 导出的列（与SensorData.iter_export的元组顺序一致）
+EXPORT_COLUMNS = ('device_id', 'sensor_type', 'timestamp', 'value', 'unit')
+
+# 格式 -> (MIME类型, 文件扩展名)
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrows')
+}
+
+
+class ExportFormatError(ValueError):
+    """不支持的导出格式或缺少对应的依赖"""
+
+
+def check_format(fmt):
+    """检查导出格式是否可用"""
+    if fmt not in EXPORT_FORMATS:
+        raise ExportFormatError(f'Unsupported format. Supported: {list(EXPORT_FORMATS)}')
+    if fmt != 'csv' and pa is None:
+        raise ExportFormatError(f'Format "{fmt}" requires pyarrow')
+
+
+def encode_chunks(fmt, chunks):
+    """将数据块编码为指定格式，逐块生成bytes"""
+    check_format(fmt)
+    if fmt == 'csv':
+        return _encode_csv(chunks)
+    return _encode_columnar(fmt, chunks)
+
+
+def _encode_csv(chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(EXPORT_COLUMNS)
+    for chunk in chunks:
+        writer.writerows(
+            (device_id, sensor_type, timestamp.isoformat(), value, unit)
+            for device_id, sensor_type, timestamp, value, unit in chunk
+        )
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    # 没有数据时也输出表头
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+class _ChunkSink(io.RawIOBase):
+    """收集pyarrow写出的字节，每块编码后取出"""
+
+    def __init__(self):
+        super().__init__()
+        self._parts = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self._parts)
+        self._parts = []
+        return data
+
+
+def _schema():
+    return pa.schema([
+        ('device_id', pa.string()),
+        ('sensor_type', pa.string()),
+        ('timestamp', pa.timestamp('us')),
+        ('value', pa.float64()),
+        ('unit', pa.string())
+    ])
+
+
+def _encode_columnar(fmt, chunks):
+    """每块转换为一个RecordBatch：Parquet中为一个行组，Arrow IPC流中为一条消息"""
+    schema = _schema()
+    sink = _ChunkSink()
+    if fmt == 'parquet':
+        writer = pq.ParquetWriter(sink, schema, compression='zstd')
+    else:
+        writer = pa.ipc.new_stream(sink, schema)
+
+    try:
+        for chunk in chunks:
+            if not chunk:
+                continue
+            columns = list(zip(*chunk))
+            writer.write_batch(pa.record_batch(
+                [pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+                schema=schema
+            ))
+            data = sink.drain()
+            if data:
+                yield data
+    finally:
+        # 结束时写出Parquet文件尾或Arrow流结束标记
+        writer.close()
+    yield sink.drain()
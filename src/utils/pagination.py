@@ -0,0 +1,66 @@
+"""
+分页工具
+游标是排序键 (timestamp, 来源, id, 帧内位置) 的base64编码，客户端只需原样传回
+"""
+import base64
+import json
+from datetime import datetime
+
+from flask import current_app, request
+
+from src.utils.streaming import stream_json_list
+
+
+def encode_cursor(key):
+    """将SensorData.page_key返回的排序键编码为不透明游标"""
+    timestamp, source, last_id, rank = key
+    payload = json.dumps([timestamp.isoformat(), source, last_id, rank], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """解码游标，格式无效时抛出ValueError"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        timestamp, source, last_id, rank = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return datetime.fromisoformat(timestamp), int(source), int(last_id), int(rank)
+    except (TypeError, ValueError, UnicodeError) as e:
+        raise ValueError('Invalid cursor') from e
+
+
+def get_page_size(default):
+    """读取limit参数，限制在1到DATA_QUERY_MAX_PAGE_SIZE之间"""
+    limit = int(request.args.get('limit', default))
+    return max(1, min(limit, current_app.config.get('DATA_QUERY_MAX_PAGE_SIZE', 1000)))
+
+
+def get_cursor():
+    """读取cursor参数，未提供时返回None"""
+    cursor = request.args.get('cursor')
+    return decode_cursor(cursor) if cursor else None
+
+
+def wants_stream():
+    """stream=1 时流式返回全部数据，不受每页条数限制"""
+    return request.args.get('stream') == '1'
+
+
+def stream_page(readings, key):
+    """流式输出按key倒序的读数；指定limit时最多输出limit条，并在末尾返回下一页游标"""
+    limit = request.args.get('limit')
+    limit = int(limit) if limit else None
+    state = {'last': None, 'more': False}
+
+    def items():
+        for count, reading in enumerate(readings):
+            if limit is not None and count >= limit:
+                state['more'] = True
+                return
+            state['last'] = reading
+            yield reading.to_dict()
+
+    def trailer():
+        more = state['more'] and state['last'] is not None
+        return {'next_cursor': encode_cursor(key(state['last'])) if more else None}
+
+    return stream_json_list(items(), trailer=trailer)
@@ -0,0 +1,45 @@
+"""
+设备上传请求体解析
+"""
+from flask import jsonify, request
+
+from src.utils.sensor_frame import SENSOR_FRAME_CONTENT_TYPE, decode_sensor_frame
+
+# 设备上传接口支持的请求体格式
+UPLOAD_CONTENT_TYPES = ['application/json', SENSOR_FRAME_CONTENT_TYPE]
+
+
+def get_upload_data():
+    """按Content-Type读取上传数据（JSON或紧凑二进制帧），返回相同结构的字典"""
+    if request.mimetype == SENSOR_FRAME_CONTENT_TYPE:
+        return decode_sensor_frame(request.get_data(cache=False))
+    return request.get_json() or {}
+
+
+def _prefer_return():
+    """解析Prefer请求头中的return偏好（minimal / representation），未指定时返回None"""
+    for preference in request.headers.get('Prefer', '').split(','):
+        key, _, value = preference.strip().partition('=')
+        if key.strip().lower() == 'return':
+            return value.strip().strip('"').lower()
+    return None
+
+
+def wants_minimal_response(default=False):
+    """客户端是否只需要写入确认：Prefer: return=minimal|representation 或 ?ack=1|0"""
+    prefer = _prefer_return()
+    if prefer == 'minimal':
+        return True
+    if prefer == 'representation':
+        return False
+    ack = request.args.get('ack')
+    if ack is not None:
+        return ack.lower() in ('1', 'true', 'yes')
+    return default
+
+
+def ack_response(status=200, **fields):
+    """精简的写入确认；请求头为 Prefer: return=minimal 时返回无响应体的204"""
+    if _prefer_return() == 'minimal':
+        return '', 204
+    return jsonify({'success': True, **fields}), status
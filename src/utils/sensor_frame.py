@@ -0,0 +1,84 @@
+"""
+紧凑二进制传感器帧编解码
+设备可用 Content-Type: application/x-sensor-frame 上传数据，代替带完整字段名的JSON
+
+帧格式（小端）:
+    uint8   版本号 (FRAME_VERSION)
+    uint8   device_id长度N
+    N字节   device_id (UTF-8)
+    重复:   uint8 传感器编码 + float32 数值
+"""
+import struct
+
+SENSOR_FRAME_CONTENT_TYPE = 'application/x-sensor-frame'
+FRAME_VERSION = 1
+
+# 传感器编码 -> 解码后JSON中的字段路径
+SENSOR_CODES = {
+    0x01: ('temperature',),
+    0x02: ('humidity',),
+    0x03: ('pressure',),
+    0x04: ('light',),
+    0x05: ('uv_index',),
+    0x06: ('air_quality',),
+    0x07: ('motion',),
+    0x08: ('distance',),
+    0x10: ('system_status', 'free_heap'),
+    0x11: ('system_status', 'wifi_rssi'),
+    0x20: ('accelerometer',),
+    0x21: ('accelerometer', 'x'),
+    0x22: ('accelerometer', 'y'),
+    0x23: ('accelerometer', 'z'),
+    0x24: ('compass',),
+    0x25: ('button_a',),
+    0x26: ('button_b',),
+}
+
+# 0x40-0x7F: 模拟输入引脚，0x80-0xBF: 数字输入引脚（低6位为引脚号）
+ANALOG_PIN_BASE = 0x40
+DIGITAL_PIN_BASE = 0x80
+PIN_MASK = 0x3F
+
+_HEADER = struct.Struct('<BB')
+_RECORD = struct.Struct('<Bf')
+
+
+def decode_sensor_frame(body):
+    """将二进制帧解码为与JSON上传格式相同的字典，格式错误时抛出ValueError"""
+    if len(body) < _HEADER.size:
+        raise ValueError('Sensor frame too short')
+    
+    version, id_length = _HEADER.unpack_from(body, 0)
+    if version != FRAME_VERSION:
+        raise ValueError(f'Unsupported sensor frame version: {version}')
+    
+    offset = _HEADER.size + id_length
+    if len(body) < offset or (len(body) - offset) % _RECORD.size:
+        raise ValueError('Malformed sensor frame')
+    
+    try:
+        data = {'device_id': body[_HEADER.size:offset].decode('utf-8')}
+    except UnicodeDecodeError:
+        raise ValueError('Invalid device_id encoding')
+    
+    for code, value in _RECORD.iter_unpack(body[offset:]):
+        # float32只有约7位有效数字，去掉转换为float64时引入的尾数
+        value = float(f'{value:.7g}')
+        if code >= DIGITAL_PIN_BASE and code < DIGITAL_PIN_BASE + PIN_MASK + 1:
+            data.setdefault('digital_inputs', {})[str(code & PIN_MASK)] = value
+        elif code >= ANALOG_PIN_BASE and code < ANALOG_PIN_BASE + PIN_MASK + 1:
+            data.setdefault('analog_inputs', {})[str(code & PIN_MASK)] = value
+        elif code in SENSOR_CODES:
+            path = SENSOR_CODES[code]
+            # 同一字段不能既是标量又是分量（如0x20与0x21-0x23同时出现）
+            if path[0] in data and isinstance(data[path[0]], dict) != (len(path) > 1):
+                raise ValueError(f'Conflicting sensor codes for {path[0]}')
+            if len(path) == 1:
+                data[path[0]] = value
+            else:
+                data.setdefault(path[0], {})[path[1]] = value
+        else:
+            raise ValueError(f'Unknown sensor code: {code:#04x}')
+    
+    return data
+
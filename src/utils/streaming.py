@@ -0,0 +1,42 @@
+"""
+流式JSON响应
+逐块输出JSON数组，响应体大小不受内存限制，第一批数据查询完成即开始返回
+"""
+from flask import Response, current_app, stream_with_context
+
+# 每次写出的数组元素数
+STREAM_CHUNK_ITEMS = 200
+
+
+def stream_json_list(items, key='data', trailer=None):
+    """以 {"data": [...], "count": N, ..., "success": true} 格式流式输出items，trailer()返回的字段追加在数组之后"""
+    dumps = current_app.json.dumps
+
+    def generate():
+        yield '{' + dumps(key) + ':['
+        count = 0
+        chunk = []
+        try:
+            for item in items:
+                chunk.append(dumps(item))
+                count += 1
+                if len(chunk) >= STREAM_CHUNK_ITEMS:
+                    yield (',' if count > len(chunk) else '') + ','.join(chunk)
+                    chunk = []
+            if chunk:
+                yield (',' if count > len(chunk) else '') + ','.join(chunk)
+                chunk = []
+
+            fields = {'count': count}
+            if trailer:
+                fields.update(trailer())
+            fields['success'] = True
+        except Exception as e:
+            # 响应头已发出，无法再修改状态码，在末尾返回错误信息
+            if chunk:
+                yield (',' if count > len(chunk) else '') + ','.join(chunk)
+            fields = {'count': count, 'success': False, 'error': str(e)}
+
+        yield '],' + ','.join(dumps(name) + ':' + dumps(value) for name, value in fields.items()) + '}'
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
@@ -0,0 +1,13 @@
+"""
+时间参数解析
+接口查询参数和命令行参数共用，数据库中保存的是不带时区的UTC时间
+"""
+from datetime import datetime, timezone
+
+
+def parse_time(value):
+    """解析ISO格式时间，带时区时转换为UTC（数据库中保存的是UTC时间）"""
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
@@ -0,0 +1,75 @@
+import os
+import random
+from datetime import datetime, timedelta
+
+from src.models.sensor_archive import ArchiveSegment, _read_block, encode_block
+from src.models.sensor_data import SensorData
+from src.models.sensor_frame import SensorFrame
+from src.services.archive import sensor_archiver
+
+
+def test_encode_block_round_trip(tmp_path):
+    """列式数据块解码后得到原来的时间戳（微秒精度）和数值"""
+    start = datetime(2024, 1, 1, 12, 0, 0, 123456)
+    timestamps = [start + timedelta(microseconds=i * 1500001) for i in range(1000)]
+    values = [random.Random(i).uniform(-1e6, 1e6) for i in range(1000)]
+    data = encode_block(timestamps, values)
+    path = tmp_path / 'block.bin'
+    path.write_bytes(b'padding' + data)
+
+    assert _read_block(str(path), len(b'padding'), len(data), len(values)) == (tuple(timestamps), tuple(values))
+
+
+def snapshot(app, device_id, start, end):
+    """范围查询、导出和按天聚合的结果"""
+    with app.app_context():
+        readings = sorted(
+            (reading.timestamp, reading.sensor_type, reading.value)
+            for reading in SensorData.get_data_by_time_range(device_id, start, end)
+        )
+        exported = sorted(row for chunk in SensorData.iter_export(device_id, chunk_size=100) for row in chunk)
+        channels, buckets = SensorData.get_buckets(device_id, 86400, start, end, with_last=True)
+        daily = {
+            (channels[channel_id].sensor_type, bucket_start): (
+                stats['count'], round(stats['sum'], 6), stats['min'], stats['max'], stats['last']
+            )
+            for (channel_id, bucket_start), stats in buckets.items()
+        }
+    return readings, exported, daily
+
+
+def test_archive_round_trip(app, device_id, compactor):
+    """归档后原始表中不再有旧数据，范围查询、导出和聚合结果与归档前相同"""
+    rng = random.Random(7)
+    base = datetime.utcnow() - timedelta(days=45)
+    rows = [
+        SensorData.build_row(
+            device_id, rng.choice(['temperature', 'humidity']), rng.uniform(0, 100), 'u',
+            timestamp=base + timedelta(seconds=rng.randint(0, 5 * 86400), microseconds=rng.randint(0, 999999))
+        )
+        for _ in range(600)
+    ]
+    with app.app_context():
+        SensorData.add_many(rows[:400])
+        app.config['SENSOR_STORAGE_MODE'] = 'frames'
+        SensorData.add_many(rows[400:])
+        app.config['SENSOR_STORAGE_MODE'] = 'rows'
+        # 最近的数据不归档
+        SensorData.add_many([SensorData.build_row(device_id, 'temperature', 1.0, 'u')])
+    compactor.compact()
+
+    start, end = base - timedelta(days=1), datetime.utcnow() + timedelta(minutes=1)
+    before = snapshot(app, device_id, start, end)
+    assert len(before[0]) == 601
+
+    assert sensor_archiver.archive() == 600
+    with app.app_context():
+        assert SensorData.query.count() == 1
+        assert SensorFrame.query.count() == 0
+        segments = ArchiveSegment.query.all()
+        assert sum(segment.count for segment in segments) == 600
+        assert all(os.path.exists(os.path.join(app.config['ARCHIVE_PATH'], segment.path)) for segment in segments)
+
+    assert snapshot(app, device_id, start, end) == before
+    # 再次归档没有新的数据
+    assert sensor_archiver.archive() == 0
@@ -0,0 +1,73 @@
+import gzip
+import json
+import zlib
+
+import pytest
+
+from src.models.sensor_data import SensorData
+
+
+def stored_values(app, device_id):
+    with app.app_context():
+        return sorted(
+            (reading.sensor_type, reading.value)
+            for reading in SensorData.get_page(device_id, 1000)[0]
+        )
+
+
+@pytest.mark.parametrize('encoding, compress', [
+    ('gzip', gzip.compress),
+    ('deflate', zlib.compress),
+    ('deflate', lambda data: zlib.compress(data)[2:-4])
+])
+def test_compressed_json_upload(app, client, device_id, encoding, compress):
+    """gzip、zlib格式和不带头的原始deflate请求体都能解压"""
+    body = json.dumps({'device_id': device_id, 'sensor_type': 'temperature', 'value': 23.5}).encode('utf-8')
+    response = client.post('/api/data', data=compress(body), headers={
+        'Content-Type': 'application/json',
+        'Content-Encoding': encoding
+    })
+    assert response.status_code == 201
+    assert stored_values(app, device_id) == [('temperature', 23.5)]
+
+
+@pytest.mark.parametrize('path, payload', [
+    ('/api/data', {'sensor_type': 'temperature', 'value': 1}),
+    ('/api/esp32/heartbeat', {'system_info': {}}),
+    ('/api/esp32/data', {'temperature': 1})
+])
+def test_oversized_compressed_body_returns_413(app, client, device_id, path, payload):
+    """解压后超过MAX_DECOMPRESSED_BODY_SIZE的请求体在所有接口都返回413"""
+    app.wsgi_app.max_size = 1024
+    body = json.dumps({'device_id': device_id, **payload, 'padding': 'x' * 4096}).encode('utf-8')
+    response = client.post(path, data=gzip.compress(body), headers={
+        'Content-Type': 'application/json',
+        'Content-Encoding': 'gzip'
+    })
+    assert response.status_code == 413
+    assert response.get_json()['success'] is False
+
+
+@pytest.mark.parametrize('path', ['/api/data', '/api/esp32/heartbeat', '/api/esp32/data', '/api/microbit/register'])
+def test_corrupt_compressed_body_returns_400(client, device_id, path):
+    response = client.post(path, data=b'not gzip data', headers={
+        'Content-Type': 'application/json',
+        'Content-Encoding': 'gzip'
+    })
+    assert response.status_code == 400
+    assert response.get_json()['success'] is False
+
+
+def test_streaming_upload_uses_its_own_limit(app, client, device_id):
+    """流式导入接口不受MAX_DECOMPRESSED_BODY_SIZE限制"""
+    app.wsgi_app.max_size = 1024
+    lines = [
+        json.dumps({'device_id': device_id, 'sensor_type': 'temperature', 'value': float(i)})
+        for i in range(200)
+    ]
+    response = client.post('/api/data/stream', data=gzip.compress('\n'.join(lines).encode('utf-8')), headers={
+        'Content-Type': 'application/x-ndjson',
+        'Content-Encoding': 'gzip'
+    })
+    assert response.status_code == 200
+    assert response.get_json()['accepted_count'] == 200
@@ -0,0 +1,96 @@
+import time
+
+from sqlalchemy import event
+
+from src.models import db
+from src.models.device import Device
+from src.services.device_cache import device_cache
+
+
+def device_queries(app):
+    """记录查询devices表的语句"""
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        if 'FROM devices' in statement:
+            statements.append(statement)
+
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', record)
+    return statements
+
+
+def heartbeat(client, device_id):
+    return client.post('/api/microbit/heartbeat', json={'device_id': device_id})
+
+
+def test_unknown_device_is_rejected_from_negative_cache(app, client):
+    """未注册设备的重复请求命中负缓存，不再查询数据库"""
+    statements = device_queries(app)
+    assert heartbeat(client, 'ghost').status_code == 404
+    assert len(statements) == 1
+
+    for _ in range(5):
+        assert heartbeat(client, 'ghost').status_code == 404
+    assert len(statements) == 1
+    assert device_cache.stats()['negative_hits'] == 5
+
+
+def test_registration_invalidates_negative_cache(client):
+    """设备注册后立即可用，不等待负缓存过期"""
+    assert heartbeat(client, 'microbit_new').status_code == 404
+    assert client.post('/api/microbit/register', json={'device_id': 'microbit_new'}).get_json()['success']
+    assert heartbeat(client, 'microbit_new').status_code == 200
+
+
+def test_negative_cache_expires(app, client, monkeypatch):
+    """其他进程注册的设备（本进程的缓存未失效）在DEVICE_NEGATIVE_CACHE_TTL后可用"""
+    monkeypatch.setattr(device_cache, 'negative_ttl', 0.2)
+    assert heartbeat(client, 'microbit_other').status_code == 404
+
+    with app.app_context():
+        db.session.add(Device(device_id='microbit_other', device_type='microbit', name='other'))
+        db.session.commit()
+    assert heartbeat(client, 'microbit_other').status_code == 404
+
+    time.sleep(0.3)
+    assert heartbeat(client, 'microbit_other').status_code == 200
+
+
+def test_config_update_invalidates_cached_device(app, client, device_id):
+    """修改配置后缓存的设备立即失效，配置接口的ETag随配置版本更新"""
+    with app.app_context():
+        Device.lookup(device_id)
+        assert device_cache.get(device_id)[0]
+    etag = client.get(f'/api/esp32/config/{device_id}').headers['ETag']
+
+    response = client.put(f'/api/esp32/config/{device_id}', json={'config': {'data_interval': 5}})
+    assert response.get_json()['config_version'] == 1
+
+    with app.app_context():
+        assert device_cache.get(device_id) == (False, None)
+    response = client.get(f'/api/esp32/config/{device_id}', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.get_json()['config']['data_interval'] == 5
+
+
+def test_status_update_invalidates_device_stats(client, device_id):
+    """通过接口修改设备状态后设备统计立即更新"""
+    def online_devices():
+        return client.get('/api/devices/stats').get_json()['stats']['online_devices']
+
+    client.put(f'/api/devices/{device_id}/status', json={'status': 'offline'})
+    assert online_devices() == 0
+    assert client.put(f'/api/devices/{device_id}/status', json={'status': 'online'}).status_code == 200
+    assert online_devices() == 1
+
+
+def test_cached_lookup_skips_database(app, client, device_id):
+    """已缓存的设备在TTL内不查询数据库"""
+    with app.app_context():
+        Device.lookup(device_id)
+    statements = device_queries(app)
+    with app.app_context():
+        for _ in range(5):
+            assert Device.lookup(device_id).device_type == 'esp32'
+    assert statements == []
@@ -0,0 +1,26 @@
+from sqlalchemy import event
+
+from src.models import db
+from src.models.device_command import DeviceCommand
+
+
+def test_mark_delivered_uses_one_update(app, device_id):
+    """记录下发只执行一条UPDATE，第一次下发时间只在首次下发时写入"""
+    with app.app_context():
+        commands = [DeviceCommand.enqueue(device_id, 'restart'), DeviceCommand.enqueue(device_id, 'blink')]
+        ids = [command.id for command in commands]
+        first = DeviceCommand.mark_delivered(commands)
+        assert [item['delivery_count'] for item in first] == [1, 1]
+        first_delivered = {command.id: command.first_delivered_at for command in DeviceCommand.query.all()}
+
+        updates = []
+        event.listen(db.engine, 'before_cursor_execute', lambda conn, cursor, statement, *args: (
+            updates.append(statement) if statement.startswith('UPDATE') else None
+        ))
+        second = DeviceCommand.mark_delivered(DeviceCommand.get_pending(device_id, 10))
+        assert len(updates) == 1
+        assert [item['delivery_count'] for item in second] == [2, 2]
+        for command in DeviceCommand.query.filter(DeviceCommand.id.in_(ids)):
+            assert command.delivery_count == 2
+            assert command.first_delivered_at == first_delivered[command.id]
+            assert command.last_delivered_at > command.first_delivered_at
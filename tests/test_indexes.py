@@ -0,0 +1,12 @@
+import warnings
+
+from sqlalchemy.exc import SADeprecationWarning
+
+from src.database_migrate import check_indexes
+
+
+def test_common_queries_use_composite_indexes(app):
+    """--check-indexes 的EXPLAIN检查在新建的数据库上全部通过，且不产生弃用警告"""
+    with app.app_context(), warnings.catch_warnings():
+        warnings.simplefilter('error', SADeprecationWarning)
+        assert check_indexes()
@@ -0,0 +1,143 @@
+import time
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from src.models.sensor_data import SensorData
+from src.services.ingest_buffer import IngestBuffer
+
+
+@pytest.fixture
+def buffer(app):
+    """启用后台刷新线程的写缓冲（不注册atexit，测试结束时停止）"""
+    buffer = IngestBuffer()
+    buffer.app = app
+    buffer.enabled = True
+    buffer.dead_letter_path = app.config['INGEST_BUFFER_DEAD_LETTER_PATH']
+    yield buffer
+    buffer.stop()
+
+
+def build_rows(device_id, count):
+    return [SensorData.build_row(device_id, 'temperature', float(i), 'u') for i in range(count)]
+
+
+def stored_count(app):
+    with app.app_context():
+        return SensorData.query.count()
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_flushes_when_batch_is_full(app, device_id, buffer):
+    """缓冲达到max_batch条时立即刷新，不等待max_delay"""
+    buffer.max_batch = 50
+    buffer.max_delay = 60
+    buffer.start()
+
+    assert buffer.write(build_rows(device_id, 30))
+    time.sleep(0.1)
+    assert stored_count(app) == 0
+
+    assert buffer.write(build_rows(device_id, 20))
+    assert wait_for(lambda: stored_count(app) == 50)
+    stats = buffer.stats()
+    assert stats['flush_count'] == 1
+    assert stats['max_flush_size'] == 50
+    assert stats['pending_rows'] == 0
+
+
+def test_flushes_when_oldest_row_reaches_max_delay(app, device_id, buffer):
+    """不足一批时在最早的记录等待max_delay后刷新"""
+    buffer.max_batch = 1000
+    buffer.max_delay = 0.2
+    buffer.start()
+
+    started = time.monotonic()
+    assert buffer.write(build_rows(device_id, 3))
+    assert wait_for(lambda: stored_count(app) == 3)
+    assert time.monotonic() - started >= 0.2
+    assert buffer.stats()['flush_count'] == 1
+
+
+def test_stop_flushes_remaining_rows(app, device_id, buffer):
+    """停止时写入缓冲中剩余的全部数据"""
+    buffer.max_batch = 100
+    buffer.max_delay = 60
+    buffer.start()
+
+    assert buffer.write(build_rows(device_id, 250))
+    buffer.stop()
+    assert stored_count(app) == 250
+    assert buffer.stats()['pending_rows'] == 0
+
+
+def test_full_queue_writes_synchronously(app, device_id, buffer):
+    """队列已满时在调用线程中同步写入"""
+    buffer.max_batch = 1000
+    buffer.max_delay = 60
+    buffer.max_queue = 10
+    buffer.start()
+
+    assert buffer.write(build_rows(device_id, 8))
+    with app.app_context():
+        assert not buffer.write(build_rows(device_id, 5))
+    assert stored_count(app) == 5
+    assert buffer.stats()['overflow_count'] == 1
+
+
+def test_database_outage_requeues_without_row_fallback(app, device_id, buffer, monkeypatch):
+    """数据库不可用时整批放回队列，不逐条写入"""
+    buffer.retries = 0
+    calls = []
+
+    def unavailable(rows):
+        calls.append(len(rows))
+        raise OperationalError('INSERT', {}, Exception('database is locked'))
+
+    monkeypatch.setattr(SensorData, 'add_many', unavailable)
+    buffer._flush(build_rows(device_id, 20))
+
+    assert calls == [20]
+    stats = buffer.stats()
+    assert stats['row_fallbacks'] == 0
+    assert stats['requeued_rows'] == 20
+    assert stats['pending_rows'] == 20
+
+
+def test_data_error_writes_rows_individually(app, device_id, buffer):
+    """数据错误时逐条写入，无法写入的记录追加到死信文件"""
+    buffer.retries = 0
+    rows = build_rows(device_id, 5)
+    rows[2]['value'] = None
+    buffer._flush(rows)
+
+    assert stored_count(app) == 4
+    stats = buffer.stats()
+    assert stats['row_fallbacks'] == 1
+    assert stats['dead_letter_rows'] == 1
+    assert stats['pending_rows'] == 0
+    with open(buffer.dead_letter_path, encoding='utf-8') as f:
+        assert len(f.readlines()) == 1
+
+
+def test_requeue_respects_max_queue(app, device_id, buffer):
+    """放回队列的数据不超过max_queue，超出的部分追加到死信文件"""
+    buffer.max_batch = 1000
+    buffer.max_delay = 60
+    buffer.max_queue = 10
+    buffer.start()
+    assert buffer.write(build_rows(device_id, 6))
+    buffer._requeue(build_rows(device_id, 8))
+
+    stats = buffer.stats()
+    assert stats['pending_rows'] == 10
+    assert stats['requeued_rows'] == 4
+    assert stats['dead_letter_rows'] == 4
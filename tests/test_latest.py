@@ -0,0 +1,46 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import src.models
+from src.models import db
+from src.models.device import Device
+from src.models.sensor_data import SensorData
+
+DEVICE_IDS = ('microbit_a', 'microbit_b', 'sensor_c')
+
+
+def seed(app):
+    """每个设备写入交错的行和帧，各传感器的读数数量不同"""
+    now = datetime.utcnow().replace(microsecond=0)
+    with app.app_context():
+        for device_id in DEVICE_IDS:
+            db.session.add(Device(device_id=device_id, device_type='microbit', name=device_id))
+        db.session.commit()
+        for n, device_id in enumerate(DEVICE_IDS):
+            rows = [
+                SensorData.build_row(device_id, sensor_type, float(i), 'u', timestamp=now - timedelta(seconds=i * (n + 1)))
+                for sensor_type, count in (('temperature', 30), ('humidity', 5), ('light', 12))
+                for i in range(count)
+            ]
+            SensorData.add_many(rows[::2])
+            app.config['SENSOR_STORAGE_MODE'] = 'frames'
+            SensorData.add_many(rows[1::2])
+            app.config['SENSOR_STORAGE_MODE'] = 'rows'
+
+
+def readings(items):
+    return [(reading.timestamp, reading.sensor_type, reading.value) for reading in items]
+
+
+@pytest.mark.parametrize('max_bind_params', [999, 4])
+def test_latest_for_devices_matches_per_device_query(app, monkeypatch, max_bind_params):
+    """批量查询（参数上限较小时分为多条UNION ALL语句）与逐个设备查询的结果相同"""
+    seed(app)
+    monkeypatch.setattr(src.models, 'MAX_BIND_PARAMS', max_bind_params)
+    with app.app_context():
+        latest = SensorData.get_latest_for_devices(list(DEVICE_IDS) + ['unknown'], 10)
+        assert latest['unknown'] == []
+        for device_id in DEVICE_IDS:
+            assert len(latest[device_id]) == 10
+            assert readings(latest[device_id]) == readings(SensorData.get_latest_data(device_id, limit=10))
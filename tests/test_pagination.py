@@ -0,0 +1,99 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from src.models import sensor_frame
+from src.models.sensor_archive import ArchiveSegment
+from src.models.sensor_data import SensorData
+from src.services.archive import sensor_archiver
+
+SENSOR_TYPES = ('temperature', 'humidity', 'light')
+
+
+def seed(app, device_id, compactor):
+    """写入按行存储、帧模式和已归档的读数，同一时刻的读数分布在不同来源中；每条读数的数值唯一"""
+    now = datetime.utcnow().replace(microsecond=0)
+    counter = iter(range(100000))
+
+    def build(minutes_ago, sensor_type):
+        timestamp = now - timedelta(minutes=minutes_ago)
+        return SensorData.build_row(device_id, sensor_type, float(next(counter)), 'u', timestamp=timestamp)
+
+    with app.app_context():
+        # 40天前的数据：归档后只存在于归档文件中
+        SensorData.add_many([build(40 * 1440 + i, SENSOR_TYPES[i % 3]) for i in range(30)])
+        app.config['SENSOR_STORAGE_MODE'] = 'frames'
+        SensorData.add_many([build(40 * 1440 + i, sensor_type) for i in range(0, 30, 4) for sensor_type in SENSOR_TYPES])
+        app.config['SENSOR_STORAGE_MODE'] = 'rows'
+        # 启用汇总表时只归档已压缩的数据
+        compactor.compact()
+        assert sensor_archiver.archive() > 0
+        assert ArchiveSegment.query.count() > 0
+
+        # 最近的数据：行和帧在同一时刻交错
+        SensorData.add_many([build(i // 2, SENSOR_TYPES[i % 3]) for i in range(40)])
+        app.config['SENSOR_STORAGE_MODE'] = 'frames'
+        SensorData.add_many([build(i, sensor_type) for i in range(0, 20, 3) for sensor_type in SENSOR_TYPES])
+        # 不包含light的帧：按light过滤时帧扫描可能在凑满一页之前达到上限
+        SensorData.add_many([build(i + 0.5, 'temperature') for i in range(20)])
+        app.config['SENSOR_STORAGE_MODE'] = 'rows'
+
+        # 归档后才到达的旧数据留在热数据中，与归档读数的时间交错
+        SensorData.add_many([build(40 * 1440 + 5, 'temperature')])
+
+        expected = [(reading.timestamp, reading.sensor_type, reading.value) for reading in SensorData.get_data_by_time_range(
+            device_id, now - timedelta(days=60), now
+        )]
+    assert len(expected) == 136
+    return expected
+
+
+def read_all_pages(client, device_id, limit, sensor_type=None):
+    """按next_cursor读取全部分页，返回 (读数, 带游标但不满limit条的页数)"""
+    readings = []
+    short_pages = 0
+    params = {'limit': limit}
+    if sensor_type:
+        params['sensor_type'] = sensor_type
+    while True:
+        body = client.get(f'/api/devices/{device_id}/data', query_string=params).get_json()
+        assert body['success']
+        assert body['count'] <= limit
+        readings += [
+            (datetime.fromisoformat(item['timestamp']), item['sensor_type'], item['value']) for item in body['data']
+        ]
+        if body['next_cursor'] is None:
+            return readings, short_pages
+        if body['count'] < limit:
+            short_pages += 1
+        params['cursor'] = body['next_cursor']
+
+
+@pytest.mark.parametrize('limit', [1, 7, 50, 1000])
+def test_cursor_paging_has_no_duplicates_or_gaps(app, client, device_id, compactor, limit):
+    """游标分页覆盖行、帧和归档中的全部读数，不重复、不遗漏，并按时间倒序"""
+    expected = seed(app, device_id, compactor)
+    readings, _ = read_all_pages(client, device_id, limit)
+
+    assert len(readings) == len(set(readings))
+    assert sorted(readings) == sorted(expected)
+    timestamps = [timestamp for timestamp, _, _ in readings]
+    assert timestamps == sorted(timestamps, reverse=True)
+
+
+def test_cursor_paging_resumes_after_frame_scan_limit(app, client, device_id, compactor, monkeypatch):
+    """帧扫描达到上限时返回的短页带有游标，从停止位置继续不会跳过读数"""
+    expected = seed(app, device_id, compactor)
+    monkeypatch.setattr(sensor_frame, 'FRAME_SCAN_MAX', 3)
+
+    readings, short_pages = read_all_pages(client, device_id, 5, sensor_type='light')
+
+    assert short_pages > 0
+    assert readings
+    assert len(readings) == len(set(readings))
+    assert sorted(readings) == sorted(reading for reading in expected if reading[1] == 'light')
+
+
+def test_invalid_cursor_is_rejected(client, device_id):
+    response = client.get(f'/api/devices/{device_id}/data', query_string={'cursor': 'not-a-cursor'})
+    assert response.status_code == 400
@@ -0,0 +1,33 @@
+from src.models import db
+from src.models.device import Device
+from src.services.presence import presence
+
+
+def stored_status(app, device_id):
+    with app.app_context():
+        return db.session.query(Device.status).filter_by(device_id=device_id).scalar()
+
+
+def listed(client, status):
+    body = client.get('/api/devices', query_string={'status': status}).get_json()
+    assert body['success']
+    return {device['device_id']: device['status'] for device in body['data']}
+
+
+def test_status_filter_overlays_unflushed_presence(app, client, device_id):
+    """按状态筛选时叠加内存中的在线状态，读请求不写回数据库"""
+    with app.app_context():
+        Device.query.filter_by(device_id=device_id).update({'status': 'offline'})
+        db.session.commit()
+    presence.discard(device_id)
+    assert listed(client, 'online') == {}
+
+    assert client.post('/api/esp32/heartbeat', json={'device_id': device_id, 'system_info': {}}).status_code == 200
+    assert listed(client, 'online') == {device_id: 'online'}
+    assert listed(client, 'offline') == {}
+    assert client.get('/api/health').status_code == 200
+    assert stored_status(app, device_id) == 'offline'
+
+    presence.flush()
+    assert stored_status(app, device_id) == 'online'
+    assert listed(client, 'online') == {device_id: 'online'}
@@ -0,0 +1,150 @@
+import random
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from src.models import db
+from src.models.sensor_data import SensorData
+from src.models.sensor_rollup import RollupWatermark, SensorRollup
+
+AGGREGATES = 'avg,min,max,count,last'
+
+
+def seed(app, device_id, start, count, seed_value, storage_mode='rows'):
+    """在start之后3小时内写入count条随机读数"""
+    rng = random.Random(seed_value)
+    rows = [
+        SensorData.build_row(
+            device_id, rng.choice(['temperature', 'humidity']), rng.uniform(-50, 50), 'u',
+            timestamp=start + timedelta(seconds=rng.uniform(0, 3 * 3600))
+        )
+        for _ in range(count)
+    ]
+    with app.app_context():
+        app.config['SENSOR_STORAGE_MODE'] = storage_mode
+        SensorData.add_many(rows)
+        app.config['SENSOR_STORAGE_MODE'] = 'rows'
+
+
+def query_buckets(client, device_id, bucket, start, end):
+    body = client.get('/api/data/query', query_string={
+        'device_id': device_id,
+        'bucket': bucket,
+        'agg': AGGREGATES,
+        'start_time': start.isoformat(),
+        'end_time': end.isoformat()
+    }).get_json()
+    assert body['success'], body
+    return {
+        item['sensor_type']: [
+            {name: round(value, 6) if isinstance(value, float) else value for name, value in point.items()}
+            for point in item['points']
+        ]
+        for item in body['data']
+    }
+
+
+def raw_buckets(app, client, device_id, bucket, start, end):
+    """不读取汇总表时的聚合结果"""
+    app.config['ROLLUP_ENABLED'] = False
+    try:
+        return query_buckets(client, device_id, bucket, start, end)
+    finally:
+        app.config['ROLLUP_ENABLED'] = True
+
+
+@pytest.mark.parametrize('bucket', ['1m', '5m', '1h', '1d'])
+def test_buckets_match_before_and_after_compaction(app, client, device_id, compactor, monkeypatch, bucket):
+    """压缩前、分批压缩后和压缩后又写入数据时，时间桶聚合与直接扫描原始数据的结果一致（查询范围两端不与桶对齐）"""
+    base = datetime.utcnow().replace(minute=0, second=0, microsecond=0) - timedelta(hours=6)
+    seed(app, device_id, base, 1500, 1)
+    seed(app, device_id, base, 500, 2, storage_mode='frames')
+    start = base + timedelta(minutes=7, seconds=13, microseconds=250)
+    end = base + timedelta(hours=2, minutes=51, seconds=47)
+
+    before = query_buckets(client, device_id, bucket, start, end)
+    assert before == raw_buckets(app, client, device_id, bucket, start, end)
+    assert sum(point['count'] for points in before.values() for point in points) > 0
+
+    monkeypatch.setattr(compactor, 'batch_size', 300)
+    assert compactor.compact() == 2000
+    assert query_buckets(client, device_id, bucket, start, end) == before
+
+    # 压缩之后写入的数据只存在于原始表中，与汇总表合并
+    seed(app, device_id, base, 200, 3)
+    after = query_buckets(client, device_id, bucket, start, end)
+    assert after == raw_buckets(app, client, device_id, bucket, start, end)
+    assert after != before
+
+
+def test_statistics_match_after_compaction(app, client, device_id, compactor):
+    """统计接口在压缩前后返回相同的读数数量"""
+    seed(app, device_id, datetime.utcnow() - timedelta(hours=5), 800, 4)
+
+    def statistics():
+        body = client.get('/api/data/statistics', query_string={'hours': 6}).get_json()
+        assert body['success'], body
+        return body['statistics']
+
+    before = statistics()
+    assert compactor.compact() == 800
+    assert statistics() == before
+    assert before['total_records'] == 800
+
+
+def test_buckets_consistent_when_compaction_commits_during_query(app, client, device_id, compactor, monkeypatch):
+    """读取原始数据和汇总表之间压缩线程提交时，聚合结果既不重复计入也不遗漏"""
+    base = datetime.utcnow().replace(minute=0, second=0, microsecond=0) - timedelta(hours=6)
+    seed(app, device_id, base, 1000, 5)
+    compactor.compact()
+    seed(app, device_id, base, 300, 6)
+    start, end = base + timedelta(minutes=3), base + timedelta(hours=2, minutes=57)
+    expected = raw_buckets(app, client, device_id, '1h', start, end)
+
+    add_to_buckets = SensorRollup.add_to_buckets.__func__
+    calls = []
+
+    def compact_first(cls, *args, **kwargs):
+        calls.append(1)
+        if len(calls) == 1:
+            assert compactor.compact() == 300
+        return add_to_buckets(cls, *args, **kwargs)
+
+    monkeypatch.setattr(SensorRollup, 'add_to_buckets', classmethod(compact_first))
+    assert query_buckets(client, device_id, '1h', start, end) == expected
+    assert len(calls) == 2
+
+
+def test_compaction_stops_at_uncommitted_ids(app, device_id, compactor, monkeypatch):
+    """ID空缺（较小ID的事务尚未提交）之后的数据即使读数时间很早也不压缩，空缺超过lag秒后跳过"""
+    old = datetime.utcnow() - timedelta(days=3)
+    seed(app, device_id, old, 10, 7)
+    with app.app_context():
+        channel_id = SensorData.query.first().channel_id
+        table = SensorData.__table__
+        # ID 11 尚未提交，ID 12 是补传的旧数据
+        db.session.execute(table.insert(), [{'id': 12, 'channel_id': channel_id, 'value': 1.0, 'timestamp': old}])
+        db.session.commit()
+
+    monkeypatch.setattr(compactor, 'lag', 60)
+    assert compactor.compact() == 10
+    with app.app_context():
+        assert RollupWatermark.get_all()['rows'] == 10
+
+    with app.app_context():
+        db.session.execute(table.insert(), [{'id': 11, 'channel_id': channel_id, 'value': 2.0, 'timestamp': old}])
+        db.session.execute(table.insert(), [{'id': 14, 'channel_id': channel_id, 'value': 3.0, 'timestamp': old}])
+        db.session.commit()
+    assert compactor.compact() == 2
+    with app.app_context():
+        assert RollupWatermark.get_all()['rows'] == 12
+
+    # ID 13 回滚后不会再出现
+    monkeypatch.setattr(compactor, 'lag', 0.2)
+    skipped = compactor.stats()['gaps_skipped']
+    time.sleep(0.3)
+    assert compactor.compact() == 1
+    assert compactor.stats()['gaps_skipped'] == skipped + 1
+    with app.app_context():
+        assert RollupWatermark.get_all()['rows'] == 14
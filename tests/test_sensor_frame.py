@@ -0,0 +1,73 @@
+import gzip
+import struct
+
+import pytest
+
+from src.models.sensor_data import SensorData
+from src.utils.sensor_frame import FRAME_VERSION, SENSOR_FRAME_CONTENT_TYPE, decode_sensor_frame
+
+
+def sensor_frame(device_id, records):
+    """按紧凑二进制帧格式编码 (传感器编码, 数值) 列表"""
+    encoded_id = device_id.encode('utf-8')
+    body = struct.pack('<BB', FRAME_VERSION, len(encoded_id)) + encoded_id
+    return body + b''.join(struct.pack('<Bf', code, value) for code, value in records)
+
+
+def stored_values(app, device_id):
+    with app.app_context():
+        return sorted(
+            (reading.sensor_type, reading.value)
+            for reading in SensorData.get_page(device_id, 1000)[0]
+        )
+
+
+def test_decode_sensor_frame():
+    data = decode_sensor_frame(sensor_frame('esp32_test', [(0x01, 21.5), (0x10, 40000), (0x42, 1.25), (0x83, 1)]))
+    assert data == {
+        'device_id': 'esp32_test',
+        'temperature': 21.5,
+        'system_status': {'free_heap': 40000.0},
+        'analog_inputs': {'2': 1.25},
+        'digital_inputs': {'3': 1.0}
+    }
+
+
+@pytest.mark.parametrize('body', [b'\x01', b'\x02\x00', sensor_frame('esp32_test', [(0x01, 1.0)])[:-1]])
+def test_decode_sensor_frame_rejects_malformed_frames(body):
+    with pytest.raises(ValueError):
+        decode_sensor_frame(body)
+
+
+@pytest.mark.parametrize('records', [
+    [(0x20, 1.0), (0x21, 0.5)],
+    [(0x22, 0.5), (0x20, 1.0)]
+])
+def test_decode_sensor_frame_rejects_conflicting_codes(records):
+    """加速度计标量和分量不能出现在同一帧中"""
+    with pytest.raises(ValueError):
+        decode_sensor_frame(sensor_frame('microbit_test', records))
+
+
+@pytest.mark.parametrize('compressed', [False, True])
+def test_binary_frame_upload(app, client, device_id, compressed):
+    """二进制帧（可gzip压缩）解码后按传感器编码写入读数"""
+    body = sensor_frame(device_id, [(0x01, 21.5), (0x02, 55.0), (0x11, -61)])
+    headers = {'Content-Type': SENSOR_FRAME_CONTENT_TYPE}
+    if compressed:
+        body = gzip.compress(body)
+        headers['Content-Encoding'] = 'gzip'
+    response = client.post('/api/esp32/data', data=body, headers=headers)
+    assert response.status_code == 200
+    assert stored_values(app, device_id) == [('humidity', 55.0), ('temperature', 21.5), ('wifi_rssi', -61.0)]
+
+
+def test_malformed_binary_frame_is_rejected(client, device_id):
+    response = client.post('/api/esp32/data', data=b'\x09\x00', headers={'Content-Type': SENSOR_FRAME_CONTENT_TYPE})
+    assert response.status_code == 400
+
+
+def test_conflicting_binary_frame_is_rejected(client, device_id):
+    body = sensor_frame(device_id, [(0x20, 1.0), (0x21, 0.5), (0x22, 0.5), (0x23, 0.5)])
+    response = client.post('/api/esp32/data', data=body, headers={'Content-Type': SENSOR_FRAME_CONTENT_TYPE})
+    assert response.status_code == 400